@@ -0,0 +1,93 @@
+"""
+Run the benchmark suite, save the results as JSON and compare against a baseline.
+
+Run from src/:
+    python -m benchmarks [--only crypto,watermark] [--quick] [--output results.json]
+    python -m benchmarks --compare baseline.json [--threshold 0.2]
+"""
+import argparse
+import datetime
+import json
+import platform
+import sys
+from benchmarks import bench_crypto, bench_treekem, bench_watermark, bench_e2e
+
+SUITES = {
+    "treekem": bench_treekem,
+    "crypto": bench_crypto,
+    "watermark": bench_watermark,
+    "e2e": bench_e2e,
+}
+
+
+def run_suite(names, quick=False):
+    results = []
+    for name in names:
+        print(f"Running {name} benchmarks...", file=sys.stderr)
+        results.extend(SUITES[name].collect(quick=quick))
+    return {
+        "meta": {
+            "created": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "quick": quick,
+        },
+        "results": results,
+    }
+
+
+def compare(current, baseline, threshold):
+    """Rows of (case, baseline s, current s, ratio, regressed) for cases present in both runs"""
+    previous = {(r["bench"], r["case"]): r["seconds"] for r in baseline["results"]}
+    rows = []
+    for result in current["results"]:
+        key = (result["bench"], result["case"])
+        if key not in previous:
+            continue
+        ratio = result["seconds"] / previous[key] if previous[key] else float("inf")
+        rows.append((f"{key[0]}:{key[1]}", previous[key], result["seconds"], ratio, ratio > 1 + threshold))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--only", default=",".join(SUITES),
+                        help=f"comma separated, from {','.join(SUITES)}")
+    parser.add_argument("--quick", action="store_true", help="small sizes and single runs")
+    parser.add_argument("--output", help="write results to this JSON file")
+    parser.add_argument("--compare", metavar="BASELINE", help="JSON results of an earlier run")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="slowdown ratio above which a case is a regression (default 0.2 = 20%%)")
+    args = parser.parse_args()
+
+    names = args.only.split(",")
+    unknown = [name for name in names if name not in SUITES]
+    if unknown:
+        parser.error(f"unknown benchmark(s): {', '.join(unknown)}")
+
+    current = run_suite(names, args.quick)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(current, f, indent=2)
+
+    print(f"{'case':<48}{'ms':>12}")
+    for result in current["results"]:
+        print(f"{result['bench'] + ':' + result['case']:<48}{result['seconds'] * 1000:>12.2f}")
+
+    if not args.compare:
+        return 0
+
+    with open(args.compare, encoding="utf-8") as f:
+        baseline = json.load(f)
+    rows = compare(current, baseline, args.threshold)
+    print(f"\n{'case':<48}{'base ms':>11}{'now ms':>11}{'ratio':>8}")
+    for case, before, after, ratio, regressed in rows:
+        flag = "  REGRESSION" if regressed else ""
+        print(f"{case:<48}{before * 1000:>11.2f}{after * 1000:>11.2f}{ratio:>8.2f}{flag}")
+    regressions = sum(1 for row in rows if row[4])
+    print(f"\n{regressions} regression(s) out of {len(rows)} compared cases")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
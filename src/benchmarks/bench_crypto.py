@@ -0,0 +1,68 @@
+"""
+Throughput of the legacy CBC chunk format against the framed AEAD container.
+
+Run from src/:  python -m benchmarks.bench_crypto [--sizes 1,8,32] [--repeat 3]
+"""
+import argparse
+import os
+from benchmarks.common import best_time
+from utils.crypto import (
+    encrypt_chunked_data,
+    decrypt_chunked_data,
+    encrypt_framed_data,
+    decrypt_framed_data,
+)
+
+FORMATS = {
+    "legacy-cbc": (encrypt_chunked_data, decrypt_chunked_data),
+    "framed-gcm": (encrypt_framed_data, decrypt_framed_data),
+}
+
+
+def run(sizes_mb, repeat=3):
+    key = os.urandom(32)
+    rows = []
+    for size_mb in sizes_mb:
+        data = os.urandom(int(size_mb * 1024 * 1024))
+        for name, (encrypt, decrypt) in FORMATS.items():
+            encrypt_time, encrypted = best_time(encrypt, data, key, repeat=repeat)
+            decrypt_time, decrypted = best_time(decrypt, encrypted, key, repeat=repeat)
+            assert decrypted == data
+            rows.append({
+                "format": name,
+                "size_mb": size_mb,
+                "overhead_pct": 100.0 * (len(encrypted) - len(data)) / max(len(data), 1),
+                "encrypt_mb_s": size_mb / encrypt_time,
+                "decrypt_mb_s": size_mb / decrypt_time,
+            })
+    return rows
+
+
+def collect(quick=False):
+    """Suite records: one per (format, direction, size)"""
+    records = []
+    for row in run([1] if quick else [1, 8, 32], repeat=1 if quick else 3):
+        for direction in ("encrypt", "decrypt"):
+            records.append({
+                "bench": "crypto",
+                "case": f"{row['format']}/{direction}/{row['size_mb']:g}MiB",
+                "seconds": row["size_mb"] / row[f"{direction}_mb_s"],
+            })
+    return records
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", default="1,8,32", help="payload sizes in MiB, comma separated")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    sizes = [float(size) for size in args.sizes.split(",")]
+    print(f"{'format':<12}{'MiB':>8}{'overhead %':>12}{'enc MiB/s':>12}{'dec MiB/s':>12}")
+    for row in run(sizes, args.repeat):
+        print(f"{row['format']:<12}{row['size_mb']:>8g}{row['overhead_pct']:>12.2f}"
+              f"{row['encrypt_mb_s']:>12.1f}{row['decrypt_mb_s']:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
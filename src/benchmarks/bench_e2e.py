@@ -0,0 +1,90 @@
+"""
+End-to-end cost of the bot's _process_photo path on a synthetic shared photo.
+
+Runs the same steps as a /view request (group rekey, decode of the downloaded
+bytes, DCT base, per-recipient LSB batch, in-memory PNG encode) in-process,
+without Telegram.
+
+Run from src/:  python -m benchmarks.bench_e2e [--resolutions 720p] [--viewers 10]
+"""
+import argparse
+import os
+import tempfile
+from cryptography.hazmat.primitives.asymmetric import x25519
+from benchmarks.common import RESOLUTIONS, timed, synthetic_photo, synthetic_watermark, write_image
+from bot.group_state import GroupState
+from bot.jobs import render_dct_base, render_lsb_batch
+from utils.watermark import coefficient_cache
+
+
+def lsb_text(chat_id, member_ids):
+    # 与 PhotoEncryptBot._process_photo 的水印文本格式一致
+    members = "\n".join(str(uid) for uid in member_ids)
+    return f"=== 安全水印 ===\n群组ID: {chat_id}\n时间戳: 2024-01-01 00:00:00\n成员列表:\n{members}\n=== 结束 ===\n"
+
+
+def share_photo(photo_path, watermark_path, viewers):
+    """One shared photo viewed by `viewers` users, as one batch"""
+    group = GroupState()
+    group.add_member(0, x25519.X25519PrivateKey.generate().public_key())
+    recipients = []
+    for viewer in range(1, viewers + 1):
+        group.add_member(viewer, x25519.X25519PrivateKey.generate().public_key())
+        recipients.append((
+            lsb_text(-100, group.member_ids),
+            group.group_key(),
+            None,
+        ))
+    with open(photo_path, "rb") as f:
+        photo_bytes = f.read()
+    base = render_dct_base(photo_bytes, watermark_path, 0.05)
+    render_lsb_batch(base, recipients)
+
+
+def run(resolutions, viewers=10):
+    rows = []
+    with tempfile.TemporaryDirectory() as workdir:
+        watermark_path = write_image(os.path.join(workdir, "watermark.png"), synthetic_watermark())
+        for name in resolutions:
+            height, width = RESOLUTIONS[name]
+            photo_path = write_image(os.path.join(workdir, f"{name}.png"), synthetic_photo(height, width))
+            for count in sorted({1, viewers}):
+                coefficient_cache.clear()
+                seconds = timed(share_photo, photo_path, watermark_path, count)
+                rows.append({
+                    "resolution": name,
+                    "viewers": count,
+                    "seconds": seconds,
+                    "per_viewer": seconds / count,
+                })
+    coefficient_cache.clear()
+    return rows
+
+
+def collect(quick=False):
+    """Suite records: one per (resolution, viewer count)"""
+    return [
+        {
+            "bench": "e2e",
+            "case": f"process_photo/{row['resolution']}/{row['viewers']}_viewers",
+            "seconds": row["seconds"],
+        }
+        for row in run(["480p"] if quick else ["720p", "1080p"], viewers=3 if quick else 10)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--resolutions", default="720p,1080p",
+                        help=f"comma separated, from {','.join(RESOLUTIONS)}")
+    parser.add_argument("--viewers", type=int, default=10)
+    args = parser.parse_args()
+
+    print(f"{'resolution':<11}{'viewers':>8}{'total ms':>11}{'ms/viewer':>11}")
+    for row in run(args.resolutions.split(","), args.viewers):
+        print(f"{row['resolution']:<11}{row['viewers']:>8}{row['seconds'] * 1000:>11.1f}"
+              f"{row['per_viewer'] * 1000:>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Rekey cost of the flat TreeNode star against the binary RatchetTree.
+
+Run from src/:  python -m benchmarks.bench_treekem [--sizes 10,1000,100000]
+"""
+import argparse
+from benchmarks.common import timed
+from cryptography.hazmat.primitives.asymmetric import x25519
+from utils.treekem import TreeNode, RatchetTree
+
+
+def random_public_keys(count):
+    return [x25519.X25519PrivateKey.generate().public_key() for _ in range(count)]
+
+
+def build_star(public_keys):
+    # 一次提交建树，避免逐个 add_member_TreeNode 的 O(n^2) 开销干扰测量
+    root = TreeNode(deferred=True)
+    for public_key in public_keys:
+        root.propose_add(public_key)
+    root.commit()
+    return root
+
+
+def run(sizes):
+    rows = []
+    for size in sizes:
+        public_keys = random_public_keys(size)
+        extra_member = random_public_keys(1)[0]
+
+        star = build_star(public_keys)
+        before = star.exchange_count
+        seconds = timed(star.update_key_TreeNode)
+        rows.append({
+            "tree": "star", "members": size, "op": "update",
+            "seconds": seconds, "exchanges": star.exchange_count - before,
+        })
+
+        tree = RatchetTree.from_public_keys(public_keys)
+        for op, fn, args in (
+            ("update", tree.commit, ()),
+            ("add", tree.add_member, (extra_member,)),
+            ("remove", tree.remove_member, (extra_member,)),
+        ):
+            before = tree.exchange_count
+            seconds = timed(fn, *args)
+            rows.append({
+                "tree": "ratchet", "members": size, "op": op,
+                "seconds": seconds, "exchanges": tree.exchange_count - before,
+            })
+    return rows
+
+
+def collect(quick=False):
+    """Suite records: one per (tree, op, member count)"""
+    return [
+        {
+            "bench": "treekem",
+            "case": f"{row['tree']}/{row['op']}/{row['members']}",
+            "seconds": row["seconds"],
+            "exchanges": row["exchanges"],
+        }
+        for row in run([10, 100] if quick else [10, 100, 1000])
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", default="10,1000,100000", help="member counts, comma separated")
+    args = parser.parse_args()
+
+    print(f"{'tree':<9}{'members':>9}{'op':>8}{'ms':>12}{'exchanges':>11}")
+    for row in run([int(size) for size in args.sizes.split(",")]):
+        print(f"{row['tree']:<9}{row['members']:>9}{row['op']:>8}"
+              f"{row['seconds'] * 1000:>12.2f}{row['exchanges']:>11}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+LSB and DCT watermark embed/extract time by image resolution, on synthetic images.
+
+Run from src/:  python -m benchmarks.bench_watermark [--resolutions 480p,1080p] [--repeat 3]
+"""
+import argparse
+import os
+import tempfile
+from benchmarks.common import RESOLUTIONS, best_time, synthetic_photo, synthetic_watermark, write_image
+from utils.watermark import (
+    coefficient_cache,
+    encode_lsb,
+    decode_lsb,
+    dct_watermark_color,
+    extract_dct_watermark,
+    qim_watermark_color,
+    detect_qim_watermark,
+)
+
+LSB_PAYLOAD = os.urandom(512)
+QIM_KEY = os.urandom(32)
+
+
+def run(resolutions, repeat=3):
+    rows = []
+    with tempfile.TemporaryDirectory() as workdir:
+        watermark_path = write_image(os.path.join(workdir, "watermark.png"), synthetic_watermark())
+        for name in resolutions:
+            height, width = RESOLUTIONS[name]
+            photo_path = write_image(os.path.join(workdir, f"{name}.png"), synthetic_photo(height, width))
+            lsb_path = os.path.join(workdir, f"{name}_lsb.png")
+            dct_path = os.path.join(workdir, f"{name}_dct.png")
+            extracted_path = os.path.join(workdir, f"{name}_extracted.png")
+            qim_path = os.path.join(workdir, f"{name}_qim.png")
+
+            cases = [
+                ("lsb_encode", None, encode_lsb, (photo_path, LSB_PAYLOAD, lsb_path)),
+                ("lsb_decode", None, decode_lsb, (lsb_path,)),
+                # 冷缓存：每次都重新计算水印 DCT 系数
+                ("dct_embed", coefficient_cache.clear, dct_watermark_color, (photo_path, watermark_path, dct_path, 0.05)),
+                ("dct_embed_cached", None, dct_watermark_color, (photo_path, watermark_path, dct_path, 0.05)),
+                ("dct_extract", coefficient_cache.clear, extract_dct_watermark, (photo_path, dct_path, extracted_path, 0.05)),
+                ("dct_extract_cached", None, extract_dct_watermark, (photo_path, dct_path, extracted_path, 0.05)),
+                # 盲检测模式：检测只读取水印图，不需要原图
+                ("qim_embed", None, qim_watermark_color, (photo_path, watermark_path, qim_path, QIM_KEY)),
+                ("qim_detect", None, detect_qim_watermark, (qim_path, watermark_path, QIM_KEY)),
+            ]
+            for op, setup, fn, args in cases:
+                seconds, _ = best_time(fn, *args, repeat=repeat, setup=setup)
+                rows.append({
+                    "op": op,
+                    "resolution": name,
+                    "megapixels": height * width / 1e6,
+                    "seconds": seconds,
+                })
+    coefficient_cache.clear()
+    return rows
+
+
+def collect(quick=False):
+    """Suite records: one per (operation, resolution)"""
+    resolutions = ["480p"] if quick else ["480p", "720p", "1080p"]
+    return [
+        {"bench": "watermark", "case": f"{row['op']}/{row['resolution']}", "seconds": row["seconds"]}
+        for row in run(resolutions, repeat=1 if quick else 3)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--resolutions", default="480p,720p,1080p",
+                        help=f"comma separated, from {','.join(RESOLUTIONS)}")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'op':<20}{'resolution':>11}{'MP':>7}{'ms':>11}")
+    for row in run(args.resolutions.split(","), args.repeat):
+        print(f"{row['op']:<20}{row['resolution']:>11}{row['megapixels']:>7.2f}"
+              f"{row['seconds'] * 1000:>11.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""
+Helpers shared by the benchmark modules: timing and synthetic inputs.
+"""
+import time
+import cv2
+import numpy as np
+
+RESOLUTIONS = {
+    "480p": (480, 640),
+    "720p": (720, 1280),
+    "1080p": (1080, 1920),
+    "4k": (2160, 3840),
+}
+
+
+def best_time(fn, *args, repeat=3, setup=None):
+    """Return (best wall time, last result) over repeat runs; setup() runs untimed before each"""
+    best = float("inf")
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        result = fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - start
+
+
+def synthetic_photo(height, width, seed=0):
+    """BGR image with smooth gradients plus noise, so PNG sizes resemble real photos"""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    base = np.stack([
+        127 + 100 * np.sin(x / 97.0 + c) * np.cos(y / 61.0 - c) for c in range(3)
+    ], axis=-1)
+    noise = rng.normal(0, 12, size=(height, width, 3))
+    return np.clip(base + noise, 0, 255).astype(np.uint8)
+
+
+def synthetic_watermark(height=256, width=256):
+    """Grayscale watermark: white text and a ring on black"""
+    watermark = np.zeros((height, width), dtype=np.uint8)
+    cv2.circle(watermark, (width // 2, height // 2), min(height, width) // 3, 255, 6)
+    cv2.putText(watermark, "SGM", (width // 5, height // 2 + 20),
+                cv2.FONT_HERSHEY_SIMPLEX, width / 120.0, 255, 4)
+    return watermark
+
+
+def write_image(path, pixels):
+    if not cv2.imwrite(path, pixels):
+        raise ValueError(f"Could not write image to {path}")
+    return path
@@ -0,0 +1,66 @@
+import os
+import asyncio
+import functools
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from utils import metrics
+
+
+class TaskExecutor:
+    """
+    Runs CPU-bound bot work off the asyncio event loop:
+    - kind="process" (default) uses a process pool, kind="thread" a thread pool
+    - max_workers limits the pool size (None lets concurrent.futures decide)
+    - timeout (seconds) bounds how long a handler waits for one task
+    """
+
+    def __init__(self, kind="process", max_workers=None, timeout=None):
+        if kind not in ("process", "thread"):
+            raise ValueError(f"Unknown executor kind: {kind}")
+        self.kind = kind
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self._pool = None
+
+    @classmethod
+    def from_env(cls):
+        """Configure from BOT_EXECUTOR, BOT_WORKERS and BOT_TASK_TIMEOUT"""
+        workers = os.getenv("BOT_WORKERS")
+        timeout = os.getenv("BOT_TASK_TIMEOUT")
+        return cls(
+            kind=os.getenv("BOT_EXECUTOR", "process"),
+            max_workers=int(workers) if workers else None,
+            timeout=float(timeout) if timeout else None,
+        )
+
+    def _get_pool(self):
+        if self._pool is None:
+            if self.kind == "process":
+                self._pool = ProcessPoolExecutor(max_workers=self.max_workers)
+            else:
+                self._pool = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix="bot-worker"
+                )
+        return self._pool
+
+    async def run(self, fn, *args, **kwargs):
+        """Run fn(*args, **kwargs) in the pool; raises asyncio.TimeoutError on timeout"""
+        loop = asyncio.get_running_loop()
+        collect = self.kind == "process" and metrics.registry.enabled
+        if collect:
+            # 工作进程中记录的指标随结果一起带回主进程
+            call = functools.partial(metrics.call_collecting, fn, args, kwargs)
+        else:
+            call = functools.partial(fn, *args, **kwargs)
+        future = loop.run_in_executor(self._get_pool(), call)
+        # 超时只会放弃等待，已在进程中运行的任务会继续执行到结束
+        result = await asyncio.wait_for(future, self.timeout)
+        if collect:
+            result, snapshot = result
+            metrics.registry.merge(snapshot)
+        return result
+
+    def shutdown(self, wait=True):
+        """Stop the pool, dropping tasks that have not started yet"""
+        if self._pool is not None:
+            self._pool.shutdown(wait=wait, cancel_futures=True)
+            self._pool = None
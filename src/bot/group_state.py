@@ -0,0 +1,38 @@
+from utils.treekem import RatchetTree
+
+
+class GroupState:
+    """
+    Live key tree for one shared photo in one chat:
+    - Members are added incrementally as they request the photo
+    - The group key is only recomputed when membership actually changed
+    """
+
+    def __init__(self):
+        self.tree = RatchetTree(deferred=True)
+        self.member_ids = []  # 按加入顺序记录成员ID
+
+    def has_member(self, member_id):
+        return self.tree.find_member(member_id) is not None or any(
+            member_id == queued_id
+            for action, _, queued_id in self.tree.proposals
+            if action == "add"
+        )
+
+    def add_member(self, member_id, public_key):
+        """Queue a new member; returns False if the member is already in the group"""
+        if self.has_member(member_id):
+            return False
+        self.tree.propose_add(public_key, member_id)
+        self.member_ids.append(member_id)
+        return True
+
+    @property
+    def epoch(self):
+        return self.tree.epoch
+
+    def group_key(self):
+        """Current group key, committing queued membership changes first"""
+        if self.tree.proposals or self.tree.group_key is None:
+            self.tree.commit()
+        return self.tree.group_key
@@ -1,5 +1,10 @@
+import io
 import os
+import time
+import asyncio
 import datetime
+import hashlib
+import functools
 from telegram import Update
 from telegram.ext import (
     Application,
@@ -8,22 +13,48 @@ from telegram.ext import (
     ContextTypes,
     filters,
 )
-from cryptography.hazmat.primitives import serialization
-from cryptography.hazmat.primitives.asymmetric import x25519
-from utils.treekem import TreeNode
-from utils.crypto import aes_encrypt
-from utils.watermark import dct_watermark_color, encode_lsb
+from bot.executor import TaskExecutor
+from bot.group_state import GroupState
+from bot.key_store import KeyStore
+from bot.scheduler import ViewScheduler
+from bot.render_cache import RenderCache, cache_key
+from bot.share_store import ShareStore, remove_files, scan_share_files
+from bot.jobs import render_dct_base, render_dct_base_file, render_lsb_batch
+from utils import metrics
+from utils.watermark import LSB_VERSION
 
 PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WATERMARK_PATH = os.path.join(PROJECT_ROOT, "data/watermarks/watermark.png")
+DCT_ALPHA = 0.05
+SWEEP_BATCH_FILES = 64  # 清理过期分享时每批删除的文件数
 
 
 class PhotoEncryptBot:
-    def __init__(self, app):
+    def __init__(self, app, executor=None, debug=False, key_store=None, save_photos=True, scheduler=None,
+                 render_cache=None, shares=None):
         self.app = app
+        self.executor = executor or TaskExecutor()  # 密钥树与水印计算在此执行，不阻塞事件循环
+        # 查看请求先进入有界队列，限制同时处理的数量并合并重复请求
+        self.scheduler = scheduler or ViewScheduler()
+        self.debug = debug  # 为 True 时额外保存 DCT/LSB 中间图像
+        # 照片只在内存中处理；为 True 时原图和最终图片再异步写入磁盘留档
+        self.save_photos = save_photos
+        self.pending_writes = set()
+        # 所有用户私钥集中存放在 output/keys 下的单一存储文件中
+        self.key_store = key_store if key_store is not None else KeyStore(
+            os.path.join(PROJECT_ROOT, "output", "keys")
+        )
+        # 渲染结果按 (原图哈希, 接收者, 成员纪元, 水印配置) 缓存在 output/decrypted 下
+        self.render_cache = render_cache if render_cache is not None else RenderCache(
+            os.path.join(PROJECT_ROOT, "output", "decrypted")
+        )
+        self.render_config = _render_config()
         self.share_requests = {}  # {user_id: {"chat_id": group_id}}
-        self.pending_photos = (
-            {}
-        )  # {group_id: {"sender_id": user_id, "original_path": str, "photo_path": str, "requested_users": list, "timestamp": str}}
+        # 待查看的分享按 (群组, 分享者, 分享ID) 索引，过期后由清理任务删除状态与文件
+        self.shares = (
+            shares if shares is not None else ShareStore()
+        )  # entry: {"chat_id", "sender_id", "share_id", "file_tag", "original_path", "original_saved", "photo_bytes", "photo_hash", "requested_users", "timestamp", "group": GroupState, "group_lock": Lock, "dct_base": ndarray or .npy path, "render_queue": list, "renderer": Task, "files": dict, "cache_keys": set, "expires_at": float}
+        self.sweeper = None
         self.setup_handlers()
 
         os.makedirs("output/original", exist_ok=True)
@@ -32,31 +63,99 @@ class PhotoEncryptBot:
         os.makedirs("output/extracted", exist_ok=True)
         os.makedirs("output/keys", exist_ok=True)
 
-    def get_user_key_path(self, user_id):
-        """Get path to user's private key file"""
-        return os.path.join(PROJECT_ROOT, "output", "keys", f"user_{user_id}_key.pem")
+        # 分享文件所在目录: 启动时据此接续分享ID，避免重启后新分享沿用旧文件名；
+        # 重启前遗留的过期文件由 sweep_orphans 清理
+        self.share_dirs = [
+            os.path.join(PROJECT_ROOT, "output", name) for name in ("original", "encrypted", "decrypted")
+        ]
+        self.shares.seed_ids(
+            max((share_id for _, share_id, _ in scan_share_files(self.share_dirs)), default=0)
+        )
 
     def load_or_generate_key(self, user_id):
         """Load existing key or generate new one if not exists"""
-        key_path = self.get_user_key_path(user_id)
-
-        if os.path.exists(key_path):
-            with open(key_path, "rb") as f:
-                private_key = x25519.X25519PrivateKey.from_private_bytes(f.read())
-            print(f"Loaded existing key for user {user_id}")
-        else:
-            private_key = x25519.X25519PrivateKey.generate()
-            with open(key_path, "wb") as f:
-                f.write(
-                    private_key.private_bytes(
-                        encoding=serialization.Encoding.Raw,
-                        format=serialization.PrivateFormat.Raw,
-                        encryption_algorithm=serialization.NoEncryption(),
-                    )
-                )
-            print(f"Generated new key for user {user_id}")
-
-        return private_key
+        return self.key_store.get_or_create(user_id)
+
+    def write_behind(self, path, data):
+        """Persist data to path in a worker thread without delaying the reply"""
+        if not self.save_photos:
+            return None
+        return self._in_background(_write_file, path, data)
+
+    def _in_background(self, fn, *args):
+        task = asyncio.create_task(asyncio.to_thread(fn, *args))
+        self.pending_writes.add(task)
+        task.add_done_callback(self._write_done)
+        return task
+
+    def _write_done(self, task):
+        self.pending_writes.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            print(f"写入照片文件失败: {task.exception()}")
+
+    def start_sweeper(self, interval=300.0):
+        """Sweep expired shares and orphaned files now, then every interval seconds"""
+        async def loop():
+            while True:
+                try:
+                    await self.sweep()
+                    await self.sweep_orphans()
+                except Exception as e:
+                    print(f"清理过期分享失败: {e}")
+                await asyncio.sleep(interval)
+
+        self.sweeper = asyncio.create_task(loop())
+        return self.sweeper
+
+    async def sweep(self):
+        """Drop expired shares, then delete their files in batches off the event loop"""
+        expired = self.shares.pop_expired()
+        if not expired:
+            return 0
+        paths = [path for entry in expired for path in entry["files"]]
+        for i in range(0, len(paths), SWEEP_BATCH_FILES):
+            deleted, freed = await asyncio.to_thread(remove_files, paths[i:i + SWEEP_BATCH_FILES])
+            self.shares.record_deleted(deleted, freed)
+        for entry in expired:
+            for render_key in entry["cache_keys"]:
+                await asyncio.to_thread(self.render_cache.discard, render_key)
+        metrics.inc("shares_expired", len(expired))
+        print(f"已清理 {len(expired)} 个过期分享，删除 {len(paths)} 个文件")
+        return len(expired)
+
+    async def sweep_orphans(self):
+        """Delete share files older than the share TTL that no live share tracks, e.g. ones left by a restart"""
+        cutoff = time.time() - self.shares.ttl
+        live = self.shares.tracked_files()
+        found = await asyncio.to_thread(scan_share_files, self.share_dirs)
+        paths = [path for path, _, mtime in found if mtime < cutoff and path not in live]
+        for i in range(0, len(paths), SWEEP_BATCH_FILES):
+            deleted, freed = await asyncio.to_thread(remove_files, paths[i:i + SWEEP_BATCH_FILES])
+            self.shares.record_deleted(deleted, freed)
+        if paths:
+            metrics.inc("orphan_files_deleted", len(paths))
+            print(f"已删除 {len(paths)} 个无对应分享的过期文件")
+        return len(paths)
+
+    def _store_render(self, render_key, photo, final_output=None):
+        """Cache a render and, when keeping files, expose it as final_output; True if final_output is a hard link (runs in a thread)"""
+        cached = self.render_cache.put(render_key, photo)
+        if final_output is None:
+            return False
+        if cached and self.render_cache.link(render_key, final_output):
+            return True
+        _write_file(final_output, photo)
+        return False
+
+    def _render_stored(self, pending, final_output, task):
+        # final_*.png 硬链接到缓存条目时不占额外磁盘空间，不重复计入
+        if not task.cancelled() and task.exception() is None and task.result():
+            self.shares.track_file(pending, final_output, 0)
+
+    async def flush_writes(self):
+        """Wait for queued write-behind tasks, e.g. before shutdown"""
+        if self.pending_writes:
+            await asyncio.gather(*self.pending_writes, return_exceptions=True)
 
     def setup_handlers(self):
         self.app.add_handler(CommandHandler("start", self.start))
@@ -101,36 +200,46 @@ class PhotoEncryptBot:
         timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
         readable_timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
-        # Download and save original photo
+        # Download once into memory; the encoded bytes are decoded once by the DCT pass
         photo_file = await update.message.photo[-1].get_file()
-        original_path = f"output/original/photo_{user_id}_{timestamp}.png"
-        temp_path = f"temp_share_{user_id}.png"
-        await photo_file.download_to_drive(original_path)
-        await photo_file.download_to_drive(temp_path)
+        buffer = io.BytesIO()
+        await photo_file.download_to_memory(buffer)
+        photo_bytes = buffer.getvalue()
 
-        # Store in pending photos with timestamp
-        self.pending_photos[chat_id] = {
+        # Store as a new pending share; earlier shares in the chat stay viewable
+        pending = {
+            "chat_id": chat_id,
             "sender_id": user_id,
-            "original_path": original_path,
-            "photo_path": temp_path,
+            "photo_bytes": photo_bytes,
+            "photo_hash": hashlib.sha256(photo_bytes).hexdigest(),
             "requested_users": [user_id],
             "timestamp": timestamp,
             "readable_timestamp": readable_timestamp,
+            "group": None,  # 首次查看时创建，之后增量加入成员
+            "group_lock": asyncio.Lock(),  # 串行化对 group 的修改
+            "dct_base": None,  # DCT 水印底图，所有接收者共用
+            "render_queue": [],  # 等待个性化 LSB 的查看请求
+            "renderer": None,  # 正在批量处理 render_queue 的任务
         }
+        share_id = self.shares.add(chat_id, user_id, pending)
+        # 文件名带上分享ID，同一秒内的多次分享不会互相覆盖
+        pending["file_tag"] = f"{timestamp}_{share_id}"
+        pending["original_path"] = os.path.join(
+            PROJECT_ROOT, f"output/original/photo_{user_id}_{pending['file_tag']}.png"
+        )
+        write = self.write_behind(pending["original_path"], photo_bytes)
+        if write is not None:
+            self.shares.track_file(pending, pending["original_path"], len(photo_bytes))
+            write.add_done_callback(functools.partial(_original_written, pending))
+        self.shares.trim_memory()
 
         await context.bot.send_message(
             chat_id=chat_id,
-            text=f"用户 {user_id} 分享了一张照片\n\n如需查看，请回复: /view_{user_id}",
+            text=f"用户 {user_id} 分享了一张照片\n\n如需查看，请回复: /view_{user_id}_{share_id}",
         )
 
         await update.message.reply_text("照片已接收，已在群组发布分享通知")
 
-        try:
-            os.remove(temp_path)
-            print(f"已删除临时文件: {temp_path}")
-        except Exception as e:
-            print(f"删除临时文件失败: {e}")
-
     async def handle_group_text(
         self, update: Update, context: ContextTypes.DEFAULT_TYPE
     ):
@@ -138,125 +247,239 @@ class PhotoEncryptBot:
         user_id = update.effective_user.id
         text = update.message.text
 
-        if not text.startswith("/view_") or chat_id not in self.pending_photos:
+        if not text.startswith("/view_"):
             return
 
         try:
-            target_user_id = int(text[6:])
-            if self.pending_photos[chat_id]["sender_id"] != target_user_id:
+            # /view_<分享者ID>_<分享ID>；省略分享ID时查看该用户最新的分享
+            target, _, share = text[6:].partition("_")
+            target_user_id = int(target)
+            pending = self.shares.get(chat_id, target_user_id, int(share) if share else None)
+            if pending is None:
                 return
+            share_id = pending["share_id"]
 
-            # Add requesting user
-            if user_id not in self.pending_photos[chat_id]["requested_users"]:
-                self.pending_photos[chat_id]["requested_users"].append(user_id)
+            metrics.inc("view_requests")
 
-            # Generate key tree
-            root = TreeNode()
+            # 同一用户对同一分享的重复请求合并为一个任务
+            try:
+                _, position = self.scheduler.submit(
+                    (chat_id, target_user_id, share_id, user_id),
+                    functools.partial(
+                        self._serve_view, context.bot, chat_id, target_user_id, share_id, user_id
+                    ),
+                )
+            except asyncio.QueueFull:
+                await update.message.reply_text("处理繁忙，请稍后再试")
+                return
+            if position:
+                await update.message.reply_text(f"处理繁忙，已排队 #{position}")
 
-            # 1. Sender's key
-            sender_private = self.load_or_generate_key(target_user_id)
-            sender_public = sender_private.public_key()
-            root.add_member_TreeNode(sender_public)
+        except Exception as e:
+            metrics.inc("view_errors")
+            print(f"处理查看请求时出错: {e}")
 
-            # 2. Requesters' keys
-            for uid in self.pending_photos[chat_id]["requested_users"]:
-                if uid != target_user_id:
-                    private_key = self.load_or_generate_key(uid)
-                    public_key = private_key.public_key()
-                    root.add_member_TreeNode(public_key)
+    @metrics.timed("view_request")
+    async def _serve_view(self, bot, chat_id, target_user_id, share_id, user_id):
+        """Scheduled job for one /view_ request: rekey, render and upload"""
+        try:
+            # 排队期间分享可能已经过期
+            pending = self.shares.get(chat_id, target_user_id, share_id)
+            if pending is None:
+                return
 
-            root.update_key_TreeNode()
-            derived_key = root.group_key
+            # 同一分享的并发查看不能交错执行加成员与提交；密钥生成和树提交都在线程中完成
+            async with pending["group_lock"]:
+                # Add requesting user
+                if user_id not in pending["requested_users"]:
+                    pending["requested_users"].append(user_id)
+
+                # Live key tree for this shared photo: sender first, then requesters
+                group = pending["group"]
+                if group is None:
+                    group = pending["group"] = GroupState()
+                with metrics.span("view_keys"):
+                    for uid in [target_user_id, user_id]:
+                        if not group.has_member(uid):
+                            private_key = await asyncio.to_thread(self.load_or_generate_key, uid)
+                            group.add_member(uid, private_key.public_key())
+
+                # Only a membership change triggers an (O(log n)) rekey
+                with metrics.span("view_rekey"):
+                    derived_key = await asyncio.to_thread(group.group_key)
+
+                # 与派生密钥同一纪元的成员列表和缓存键
+                member_info = "\n".join(
+                    [str(uid) for uid in pending["requested_users"]]
+                )
+                # 成员变化会推进纪元，旧的渲染结果自然不再命中
+                render_key = cache_key(
+                    pending["photo_hash"], chat_id, pending["file_tag"], user_id, group.epoch, self.render_config
+                )
 
             # 使用原始图片的时间戳
-            timestamp = self.pending_photos[chat_id]["timestamp"]
-            readable_timestamp = self.pending_photos[chat_id]["readable_timestamp"]
+            readable_timestamp = pending["readable_timestamp"]
 
             # Save derived key with receiver ID and original timestamp
-            derived_key_filename = f"derived_key_{user_id}_{timestamp}.bin"
-            with open(
-                os.path.join(PROJECT_ROOT, "output", "encrypted", derived_key_filename),
-                "wb",
-            ) as file:
-                file.write(derived_key)
-
-            # Prepare watermark info
-            member_info = "\n".join(
-                [str(uid) for uid in self.pending_photos[chat_id]["requested_users"]]
-            )
-
-            # Process photo with receiver ID and original timestamp
-            output_path = await self._process_photo(
-                chat_id,
-                self.pending_photos[chat_id]["original_path"],
-                readable_timestamp,
-                member_info,
-                derived_key,
-                user_id,
-                timestamp,
+            derived_key_path = os.path.join(
+                PROJECT_ROOT, "output", "encrypted", f"derived_key_{user_id}_{pending['file_tag']}.bin"
             )
+            await asyncio.to_thread(_write_file, derived_key_path, derived_key)
+            self.shares.track_file(pending, derived_key_path, len(derived_key))
+            photo = await asyncio.to_thread(self.render_cache.get, render_key)
+            if photo is None:
+                # Process photo with receiver ID and original timestamp
+                photo = await self._process_photo(
+                    pending,
+                    readable_timestamp,
+                    member_info,
+                    derived_key,
+                    user_id,
+                )
+                # 缓存与留档共用一份文件: final_*.png 是缓存条目的硬链接
+                final_output = None
+                if self.save_photos:
+                    final_output = os.path.join(
+                        PROJECT_ROOT, f"output/decrypted/final_{user_id}_{pending['file_tag']}.png"
+                    )
+                    self.shares.track_file(pending, final_output, len(photo))
+                store = self._in_background(self._store_render, render_key, photo, final_output)
+                if final_output is not None:
+                    store.add_done_callback(functools.partial(self._render_stored, pending, final_output))
+                pending["cache_keys"].add(render_key)
 
             # Send to user
-            await context.bot.send_photo(
-                chat_id=user_id,
-                photo=open(output_path, "rb"),
-                caption=f"🖼️ 来自用户 {target_user_id} 的分享照片\n"
-                f"时间戳: {readable_timestamp}\n"
-                f"接收者ID: {user_id}",
-            )
+            with metrics.span("view_upload"):
+                await bot.send_photo(
+                    chat_id=user_id,
+                    photo=io.BytesIO(photo),
+                    caption=f"🖼️ 来自用户 {target_user_id} 的分享照片\n"
+                    f"时间戳: {readable_timestamp}\n"
+                    f"接收者ID: {user_id}",
+                )
 
         except Exception as e:
+            metrics.inc("view_errors")
             print(f"处理查看请求时出错: {e}")
+            raise
 
+    @metrics.timed("view_render")
     async def _process_photo(
         self,
-        chat_id,
-        input_path,
+        pending,
         timestamp,
         member_info,
         derived_key,
         receiver_id,
-        file_timestamp,
     ):
         # Prepare LSB watermark
         lsb_text = f"""=== 安全水印 ===
-群组ID: {chat_id}
+群组ID: {pending["chat_id"]}
 时间戳: {timestamp}
 成员列表:
 {member_info}
 === 结束 ===
 """
-        encrypted_lsb = aes_encrypt(lsb_text.encode(), derived_key)
-        lsb_length = len(encrypted_lsb)
-
-        # Append LSB length to derived key file
-        derived_key_filename = f"derived_key_{receiver_id}_{file_timestamp}.bin"
-        with open(
-            os.path.join(PROJECT_ROOT, "output", "encrypted", derived_key_filename),
-            "ab",
-        ) as file:
-            file.write(lsb_length.to_bytes(4, byteorder="big"))
-
-        # Generate output filenames with receiver ID and original timestamp
-        dct_output = os.path.join(
-            PROJECT_ROOT, f"output/decrypted/dct_{receiver_id}_{file_timestamp}.png"
-        )
-        lsb_output = os.path.join(
-            PROJECT_ROOT, f"output/decrypted/lsb_{receiver_id}_{file_timestamp}.png"
-        )
-        final_output = os.path.join(
-            PROJECT_ROOT, f"output/decrypted/final_{receiver_id}_{file_timestamp}.png"
-        )
+        lsb_debug_path = None
+        if self.debug:
+            lsb_debug_path = os.path.join(
+                PROJECT_ROOT, f"output/decrypted/lsb_{receiver_id}_{pending['file_tag']}.png"
+            )
 
-        # Apply watermarks
-        dct_watermark_color(
-            input_path,
-            os.path.join(PROJECT_ROOT, "data/watermarks/watermark.png"),
-            dct_output,
-            alpha=0.05,
+        # Queue the LSB pass; viewers arriving while a batch renders join the next one
+        done = asyncio.get_running_loop().create_future()
+        pending["render_queue"].append(
+            ((lsb_text, derived_key, lsb_debug_path), done)
         )
-
-        encode_lsb(dct_output, encrypted_lsb, lsb_output)
-        os.rename(lsb_output, final_output)
-
-        return final_output
\ No newline at end of file
+        if pending["renderer"] is None or pending["renderer"].done():
+            pending["renderer"] = asyncio.create_task(self._render_queued(pending))
+        # The LSB payload carries its own length header, so no sidecar is written
+        photo = await done
+        if lsb_debug_path and os.path.exists(lsb_debug_path):
+            self.shares.track_file(pending, lsb_debug_path, os.path.getsize(lsb_debug_path))
+        return photo
+
+    async def _render_queued(self, pending):
+        """Drain a shared photo's render queue: one DCT pass, then batched LSB passes"""
+        while pending["render_queue"]:
+            batch, pending["render_queue"] = pending["render_queue"], []
+            try:
+                if pending["dct_base"] is None and pending["photo_bytes"] is None:
+                    # 内存上限下原图已被释放，从落盘的副本重新读取
+                    pending["photo_bytes"] = await asyncio.to_thread(_read_file, pending["original_path"])
+                if pending["dct_base"] is None:
+                    dct_debug_path = None
+                    if self.debug:
+                        dct_debug_path = os.path.join(
+                            PROJECT_ROOT,
+                            f"output/decrypted/dct_{pending['sender_id']}_{pending['file_tag']}.png",
+                        )
+                    with metrics.span("render_dct_base"):
+                        if self.executor.kind == "process":
+                            # 底图只落盘一次，各批次在工作进程中映射读取，不再逐批序列化整幅数组
+                            base_path = os.path.join(
+                                PROJECT_ROOT,
+                                f"output/original/dct_base_{pending['sender_id']}_{pending['file_tag']}.npy",
+                            )
+                            pending["dct_base"] = await self.executor.run(
+                                render_dct_base_file,
+                                pending["photo_bytes"],
+                                WATERMARK_PATH,
+                                DCT_ALPHA,
+                                base_path,
+                                dct_debug_path,
+                            )
+                            self.shares.track_file(pending, base_path, os.path.getsize(base_path))
+                        else:
+                            pending["dct_base"] = await self.executor.run(
+                                render_dct_base,
+                                pending["photo_bytes"],
+                                WATERMARK_PATH,
+                                DCT_ALPHA,
+                                dct_debug_path,
+                            )
+                    if dct_debug_path and os.path.exists(dct_debug_path):
+                        self.shares.track_file(pending, dct_debug_path, os.path.getsize(dct_debug_path))
+                with metrics.span("render_lsb_batch"):
+                    photos = await self.executor.run(
+                        render_lsb_batch,
+                        pending["dct_base"],
+                        [recipient for recipient, _ in batch],
+                    )
+            except Exception as e:
+                for _, done in batch:
+                    if not done.done():
+                        done.set_exception(e)
+                continue
+            for (_, done), photo in zip(batch, photos):
+                if not done.done():
+                    done.set_result(photo)
+        # 队列已清空，本分享也可参与内存回收
+        pending["renderer"] = None
+        self.shares.trim_memory()
+
+
+def _render_config():
+    # 水印图内容、DCT 强度或 LSB 格式变化时，旧缓存全部失效
+    try:
+        with open(WATERMARK_PATH, "rb") as file:
+            watermark_hash = hashlib.sha256(file.read()).hexdigest()
+    except FileNotFoundError:
+        watermark_hash = None
+    return (watermark_hash, DCT_ALPHA, LSB_VERSION)
+
+
+def _original_written(pending, task):
+    # 原图写完之前文件可能不完整，内存中的副本须保留到写入成功
+    pending["original_saved"] = not task.cancelled() and task.exception() is None
+
+
+def _read_file(path):
+    with open(path, "rb") as file:
+        return file.read()
+
+
+def _write_file(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as file:
+        file.write(data)
\ No newline at end of file
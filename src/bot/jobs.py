@@ -0,0 +1,61 @@
+"""
+CPU-bound work run by the bot's TaskExecutor.
+
+Everything here is a plain module-level function taking and returning
+picklable values (bytes, str, int, numpy arrays), so it can run in a
+process pool.
+"""
+import os
+import numpy as np
+from utils.crypto import aes_encrypt
+from utils.pipeline import WatermarkPipeline
+
+
+def render_dct_base(image, watermark_path, alpha, debug_path=None):
+    """
+    DCT-watermark the shared photo once; the result is the base for every recipient.
+
+    image may be a path or the encoded bytes downloaded from Telegram; either
+    way it is decoded exactly once here.
+    """
+    pipeline = WatermarkPipeline(
+        watermark_path=watermark_path,
+        alpha=alpha,
+        debug_paths={"dct": debug_path},
+    )
+    return pipeline.apply_dct(image)
+
+
+def render_dct_base_file(image, watermark_path, alpha, base_path, debug_path=None):
+    """
+    render_dct_base, but save the base as .npy and return its path.
+
+    Process workers then memory-map the file instead of receiving the whole
+    array pickled with every LSB batch.
+    """
+    base = render_dct_base(image, watermark_path, alpha, debug_path)
+    os.makedirs(os.path.dirname(base_path) or ".", exist_ok=True)
+    np.save(base_path, base)
+    return base_path
+
+
+def render_lsb_batch(base, recipients):
+    """
+    Personalize the DCT base for a batch of recipients.
+
+    base is the DCT base array or the path of one saved by
+    render_dct_base_file. recipients is a list of (lsb_text, derived_key,
+    debug_path); each gets its own LSB payload on a copy of base. Returns the
+    encoded PNG bytes in the same order, ready to upload without touching the
+    disk.
+    """
+    if isinstance(base, str):
+        base = np.load(base, mmap_mode="r")
+    photos = []
+    for lsb_text, derived_key, debug_path in recipients:
+        encrypted_lsb = aes_encrypt(lsb_text.encode(), derived_key)
+        pipeline = WatermarkPipeline(
+            lsb_payload=encrypted_lsb, debug_paths={"lsb": debug_path}
+        )
+        photos.append(pipeline.to_bytes(base))
+    return photos
@@ -0,0 +1,185 @@
+import os
+import re
+import mmap
+import struct
+import threading
+from collections import OrderedDict
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import x25519
+
+KEY_RECORD_SIZE = 32  # X25519 原始私钥
+KEY_INDEX_ENTRY = struct.Struct(">q")  # 用户ID，与 keys.bin 中的记录一一对应
+LEGACY_KEY_PATTERN = re.compile(r"^user_(-?\d+)_key\.pem$")
+
+
+class KeyStore:
+    """Private keys of all bot users in mmap'd keys.bin/keys.idx files behind an LRU cache"""
+
+    def __init__(self, keys_dir, max_entries=4096):
+        self.keys_dir = keys_dir
+        self.data_path = os.path.join(keys_dir, "keys.bin")
+        self.index_path = os.path.join(keys_dir, "keys.idx")
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._positions = {}  # {user_id: 记录序号}
+        self._cache = OrderedDict()
+        self._map = None
+        self._mapped_records = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(keys_dir, exist_ok=True)
+        self._load_index()
+        self._migrate_legacy_keys()
+
+    def _load_index(self):
+        for path in (self.data_path, self.index_path):
+            if not os.path.exists(path):
+                open(path, "wb").close()
+
+        with open(self.index_path, "rb") as f:
+            index = f.read()
+        # 追加中断时两个文件可能长度不一致，只承认两边都完整的记录
+        count = min(
+            len(index) // KEY_INDEX_ENTRY.size,
+            os.path.getsize(self.data_path) // KEY_RECORD_SIZE,
+        )
+        for position in range(count):
+            (user_id,) = KEY_INDEX_ENTRY.unpack_from(index, position * KEY_INDEX_ENTRY.size)
+            self._positions[user_id] = position
+
+        # 截掉不完整的尾部，保证后续追加位置与序号对齐
+        for path, size in (
+            (self.index_path, count * KEY_INDEX_ENTRY.size),
+            (self.data_path, count * KEY_RECORD_SIZE),
+        ):
+            if os.path.getsize(path) != size:
+                with open(path, "r+b") as f:
+                    f.truncate(size)
+
+    def _migrate_legacy_keys(self):
+        migrated_dir = os.path.join(self.keys_dir, "migrated")
+        migrated = 0
+        for name in sorted(os.listdir(self.keys_dir)):
+            match = LEGACY_KEY_PATTERN.match(name)
+            if not match:
+                continue
+            path = os.path.join(self.keys_dir, name)
+            user_id = int(match.group(1))
+            if user_id not in self._positions:
+                with open(path, "rb") as f:
+                    raw = f.read()
+                if len(raw) != KEY_RECORD_SIZE:
+                    print(f"Skipping malformed key file {name}")
+                    continue
+                self._append(user_id, raw)
+                migrated += 1
+            # 旧文件移到 migrated/ 下保留，不再参与查找
+            os.makedirs(migrated_dir, exist_ok=True)
+            os.replace(path, os.path.join(migrated_dir, name))
+        if migrated:
+            print(f"Migrated {migrated} legacy key files into {self.data_path}")
+
+    def __len__(self):
+        return len(self._positions)
+
+    def __contains__(self, user_id):
+        return user_id in self._positions
+
+    def _append(self, user_id, raw):
+        # 先写入并落盘密钥记录，再写索引：索引里出现的ID一定有完整的记录
+        with open(self.data_path, "ab") as f:
+            f.write(raw)
+            f.flush()
+            os.fsync(f.fileno())
+        with open(self.index_path, "ab") as f:
+            f.write(KEY_INDEX_ENTRY.pack(user_id))
+            f.flush()
+            os.fsync(f.fileno())
+        self._positions[user_id] = len(self._positions)
+
+    def _read_record(self, position):
+        if position >= self._mapped_records:
+            # 新追加的记录不在旧映射范围内，重新映射
+            if self._map is not None:
+                self._map.close()
+            with open(self.data_path, "rb") as f:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._mapped_records = len(self._map) // KEY_RECORD_SIZE
+        offset = position * KEY_RECORD_SIZE
+        return self._map[offset:offset + KEY_RECORD_SIZE]
+
+    def _remember(self, user_id, private_key):
+        self._cache[user_id] = private_key
+        self._cache.move_to_end(user_id)
+        while len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+
+    def get(self, user_id):
+        """Private key of user_id, or None if the user has no key yet"""
+        with self._lock:
+            private_key = self._cache.get(user_id)
+            if private_key is not None:
+                self._cache.move_to_end(user_id)
+                self.hits += 1
+                return private_key
+            self.misses += 1
+
+            position = self._positions.get(user_id)
+            if position is None:
+                return None
+            private_key = x25519.X25519PrivateKey.from_private_bytes(
+                self._read_record(position)
+            )
+            self._remember(user_id, private_key)
+            return private_key
+
+    def get_or_create(self, user_id):
+        """Private key of user_id, generating and appending one on first use"""
+        private_key = self.get(user_id)
+        if private_key is not None:
+            return private_key
+
+        with self._lock:
+            if user_id in self._positions:
+                # 另一个线程刚刚生成了该用户的密钥
+                private_key = x25519.X25519PrivateKey.from_private_bytes(
+                    self._read_record(self._positions[user_id])
+                )
+            else:
+                private_key = x25519.X25519PrivateKey.generate()
+                self._append(
+                    user_id,
+                    private_key.private_bytes(
+                        encoding=serialization.Encoding.Raw,
+                        format=serialization.PrivateFormat.Raw,
+                        encryption_algorithm=serialization.NoEncryption(),
+                    ),
+                )
+                print(f"Generated new key for user {user_id}")
+            self._remember(user_id, private_key)
+            return private_key
+
+    def preload(self, user_ids=None):
+        """Warm the cache (all users by default, up to max_entries); returns the count"""
+        with self._lock:
+            if user_ids is None:
+                user_ids = list(self._positions)
+            user_ids = [uid for uid in user_ids if uid in self._positions]
+            user_ids = user_ids[-self.max_entries:] if self.max_entries else []
+            for user_id in user_ids:
+                if user_id not in self._cache:
+                    self._remember(
+                        user_id,
+                        x25519.X25519PrivateKey.from_private_bytes(
+                            self._read_record(self._positions[user_id])
+                        ),
+                    )
+            return len(user_ids)
+
+    def close(self):
+        with self._lock:
+            if self._map is not None:
+                self._map.close()
+                self._map = None
+                self._mapped_records = 0
@@ -1,6 +1,12 @@
 import os
 from telegram.ext import Application, CommandHandler, MessageHandler, filters
-from bot.handlers import PhotoEncryptBot
+from bot.handlers import PhotoEncryptBot, PROJECT_ROOT
+from bot.executor import TaskExecutor
+from bot.key_store import KeyStore
+from bot.scheduler import ViewScheduler
+from bot.render_cache import RenderCache
+from bot.share_store import ShareStore
+from utils import metrics
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -10,15 +16,72 @@ async def post_init(application: Application) -> None:
         ("start", "Start the bot"),
         ("init_group", "Initialize group encryption"),
     ])
+    # 启动时及此后每 SHARE_SWEEP_SECONDS 秒清理一次过期分享、其文件及重启前遗留的文件
+    application.bot_data["bot"].start_sweeper(float(os.getenv("SHARE_SWEEP_SECONDS", "300")))
+
+async def post_shutdown(application: Application) -> None:
+    bot = application.bot_data["bot"]
+    if bot.sweeper is not None:
+        bot.sweeper.cancel()
+    # 取消排队和运行中的查看任务，再等待尚未落盘的原图/最终图片写完
+    await bot.scheduler.shutdown()
+    await bot.flush_writes()
+    print(f"View queue stats: {bot.scheduler.stats()}")
+    print(f"Render cache stats: {bot.render_cache.stats()}")
+    print(f"Share store stats: {bot.shares.stats()}")
+    # 停止工作进程/线程池，丢弃尚未开始的任务
+    application.bot_data["executor"].shutdown()
+    application.bot_data["key_store"].close()
+    if os.getenv("METRICS_FILE"):
+        metrics.write_textfile(os.getenv("METRICS_FILE"))
 
 def main():
     TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
     if not TOKEN:
         raise ValueError("Please set TELEGRAM_BOT_TOKEN in .env file")
     
-    app = Application.builder().token(TOKEN).post_init(post_init).build()
+    app = (
+        Application.builder()
+        .token(TOKEN)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
+
+    # METRICS_PORT 在本地端口提供 Prometheus 指标，METRICS_FILE 定期写入文本文件
+    metrics_port = os.getenv("METRICS_PORT")
+    metrics_file = os.getenv("METRICS_FILE")
+    if metrics_port or metrics_file:
+        metrics.enable()
+    if metrics_port:
+        metrics.start_http_server(int(metrics_port))
+        print(f"Serving metrics on http://127.0.0.1:{metrics_port}/")
+    if metrics_file:
+        metrics.start_textfile_writer(metrics_file)
+
+    executor = TaskExecutor.from_env()
+    app.bot_data["executor"] = executor
+
+    # 启动时迁移旧的单用户密钥文件并预热缓存
+    key_store = KeyStore(os.path.join(PROJECT_ROOT, "output", "keys"))
+    print(f"Preloaded {key_store.preload()} user keys")
+    app.bot_data["key_store"] = key_store
     
-    bot = PhotoEncryptBot(app)
+    bot = PhotoEncryptBot(
+        app,
+        executor=executor,
+        debug=os.getenv("WATERMARK_DEBUG") == "1",
+        key_store=key_store,
+        # SAVE_PHOTOS=0 时照片只在内存中处理，不在 output/ 下留档
+        save_photos=os.getenv("SAVE_PHOTOS", "1") != "0",
+        # BOT_VIEW_CONCURRENCY 个查看任务并行，最多 BOT_VIEW_QUEUE 个排队
+        scheduler=ViewScheduler.from_env(),
+        # RENDER_CACHE_MB / RENDER_CACHE_DAYS 限制渲染缓存的大小与保留时间
+        render_cache=RenderCache.from_env(os.path.join(PROJECT_ROOT, "output", "decrypted")),
+        # SHARE_TTL_HOURS 后分享过期，状态与相关文件一并删除；内存中的原图与底图不超过 SHARE_MEMORY_MB
+        shares=ShareStore.from_env(),
+    )
+    app.bot_data["bot"] = bot
     
     app.run_polling(allowed_updates=["message", "callback_query"])
 
@@ -0,0 +1,157 @@
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from utils import metrics
+
+CACHE_PREFIX = "cache_"
+CACHE_SUFFIX = ".png"
+
+
+def cache_key(*parts):
+    """Content address for a render: sha256 over the repr of its inputs"""
+    return hashlib.sha256(repr(parts).encode("utf-8")).hexdigest()
+
+
+class RenderCache:
+    """Disk-backed LRU cache of rendered photos, one cache_<sha256>.png per entry"""
+
+    def __init__(self, cache_dir, max_bytes=512 * 1024 * 1024, max_age=7 * 24 * 3600):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # {key: (size, last_used)}，最久未使用的在前
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load_index()
+
+    @classmethod
+    def from_env(cls, cache_dir):
+        """Configure from RENDER_CACHE_MB and RENDER_CACHE_DAYS"""
+        return cls(
+            cache_dir,
+            max_bytes=int(float(os.getenv("RENDER_CACHE_MB", "512")) * 1024 * 1024),
+            max_age=float(os.getenv("RENDER_CACHE_DAYS", "7")) * 24 * 3600,
+        )
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{CACHE_PREFIX}{key}{CACHE_SUFFIX}")
+
+    def _load_index(self):
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            name = entry.name
+            if not (name.startswith(CACHE_PREFIX) and name.endswith(CACHE_SUFFIX)):
+                continue
+            if name.endswith(".tmp" + CACHE_SUFFIX):
+                # 写入中断留下的临时文件
+                os.remove(entry.path)
+                continue
+            stat = entry.stat()
+            entries.append((stat.st_mtime, name[len(CACHE_PREFIX):-len(CACHE_SUFFIX)], stat.st_size))
+        for last_used, key, size in sorted(entries):
+            self._entries[key] = (size, last_used)
+            self._bytes += size
+        self._evict(time.time())
+
+    def _remove(self, key):
+        size, _ = self._entries.pop(key)
+        self._bytes -= size
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def _evict(self, now):
+        # 先删过期项，再按 LRU 顺序删到总大小不超过上限
+        expired = [key for key, (_, last_used) in self._entries.items() if now - last_used > self.max_age]
+        for key in expired:
+            self._remove(key)
+        while self._entries and self._bytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+
+    def get(self, key):
+        """Cached bytes for key, or None"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry[1] > self.max_age:
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                metrics.inc("render_cache_misses")
+                return None
+            self._entries.move_to_end(key)
+            self._entries[key] = (entry[0], now)
+        try:
+            with open(self._path(key), "rb") as f:
+                data = f.read()
+            os.utime(self._path(key), (now, now))
+        except FileNotFoundError:
+            # 文件被外部删除，按未命中处理
+            with self._lock:
+                if key in self._entries:
+                    self._remove(key)
+                self.misses += 1
+            metrics.inc("render_cache_misses")
+            return None
+        self.hits += 1
+        metrics.inc("render_cache_hits")
+        return data
+
+    def put(self, key, data):
+        """Store data under key, then evict down to the size limit"""
+        if len(data) > self.max_bytes:
+            return False
+        path = self._path(key)
+        temp_path = os.path.join(self.cache_dir, f"{CACHE_PREFIX}{key}.tmp{CACHE_SUFFIX}")
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+        now = time.time()
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key)[0]
+            self._entries[key] = (len(data), now)
+            self._bytes += len(data)
+            self._evict(now)
+        return True
+
+    def link(self, key, path):
+        """Hard-link the cached file for key to path, so both names share one copy on disk"""
+        if key not in self._entries:
+            return False
+        try:
+            if os.path.lexists(path):
+                os.remove(path)
+            os.link(self._path(key), path)
+        except OSError:
+            # 跨文件系统或不支持硬链接时由调用方另行写入
+            return False
+        return True
+
+    def discard(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
@@ -0,0 +1,141 @@
+import os
+import time
+import asyncio
+from collections import deque
+from utils import metrics
+
+
+class ViewScheduler:
+    """Bounded, per-chat round-robin queue of view jobs that coalesces duplicate keys"""
+
+    def __init__(self, concurrency=2, max_queued=64):
+        if concurrency < 1:
+            raise ValueError("concurrency must be at least 1")
+        self.concurrency = concurrency
+        self.max_queued = max_queued
+        self._queues = {}  # {chat_id: deque([key, ...])}
+        self._chats = deque()  # 有等待任务的群组，按轮转顺序排列
+        self._jobs = {}  # {key: (job, future, enqueued_at)}，包括排队中与运行中的任务
+        self._running = 0
+        self._tasks = set()  # 事件循环只弱引用任务，需自行持有，避免运行中被回收
+        self._counts = {"submitted": 0, "coalesced": 0, "rejected": 0, "completed": 0, "failed": 0}
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._max_depth = 0
+
+    @classmethod
+    def from_env(cls):
+        """Configure from BOT_VIEW_CONCURRENCY and BOT_VIEW_QUEUE"""
+        return cls(
+            concurrency=int(os.getenv("BOT_VIEW_CONCURRENCY", "2")),
+            max_queued=int(os.getenv("BOT_VIEW_QUEUE", "64")),
+        )
+
+    @property
+    def depth(self):
+        """Number of jobs waiting for a free slot"""
+        return sum(len(queue) for queue in self._queues.values())
+
+    def submit(self, key, job):
+        """Schedule job() under key = (chat_id, ...); returns (future, position), position None if coalesced"""
+        if key in self._jobs:
+            self._counts["coalesced"] += 1
+            metrics.inc("view_coalesced")
+            return self._jobs[key][1], None
+
+        position = 0
+        if self._running >= self.concurrency:
+            position = self.depth + 1
+            if position > self.max_queued:
+                self._counts["rejected"] += 1
+                metrics.inc("view_rejected")
+                raise asyncio.QueueFull(f"view queue is full ({self.max_queued} waiting)")
+
+        future = asyncio.get_running_loop().create_future()
+        self._jobs[key] = (job, future, time.perf_counter())
+        chat_id = key[0]
+        if chat_id not in self._queues:
+            self._queues[chat_id] = deque()
+            self._chats.append(chat_id)
+        self._queues[chat_id].append(key)
+        self._counts["submitted"] += 1
+        self._max_depth = max(self._max_depth, self.depth)
+        self._dispatch()
+        return future, position
+
+    def _next_key(self):
+        # 轮转: 取队首群组的一个任务，若该群组仍有等待任务则排到队尾
+        chat_id = self._chats.popleft()
+        queue = self._queues[chat_id]
+        key = queue.popleft()
+        if queue:
+            self._chats.append(chat_id)
+        else:
+            del self._queues[chat_id]
+        return key
+
+    def _dispatch(self):
+        while self._running < self.concurrency and self._chats:
+            key = self._next_key()
+            self._running += 1
+            task = asyncio.create_task(self._run(key))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, key):
+        job, future, enqueued_at = self._jobs[key]
+        wait = time.perf_counter() - enqueued_at
+        self._wait_total += wait
+        self._wait_max = max(self._wait_max, wait)
+        metrics.registry.observe("view_queue_wait", wait)
+        try:
+            result = await job()
+        except Exception as e:
+            self._counts["failed"] += 1
+            if not future.done():
+                future.set_exception(e)
+                # 没有人等待结果时避免 "exception was never retrieved" 警告
+                future.exception()
+        else:
+            self._counts["completed"] += 1
+            if not future.done():
+                future.set_result(result)
+        finally:
+            if not future.done():
+                # 任务被取消
+                future.cancel()
+            del self._jobs[key]
+            self._running -= 1
+            self._dispatch()
+
+    async def shutdown(self, cancel=True):
+        """Drop queued jobs and cancel (or, with cancel=False, wait for) running ones"""
+        for queue in self._queues.values():
+            for key in queue:
+                _, future, _ = self._jobs.pop(key)
+                future.cancel()
+        self._queues.clear()
+        self._chats.clear()
+        tasks = list(self._tasks)
+        if cancel:
+            for task in tasks:
+                task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        # 尚未开始执行就被取消的任务不会走到 _run 的 finally
+        for _, future, _ in self._jobs.values():
+            future.cancel()
+        self._jobs.clear()
+        self._running = 0
+
+    def stats(self):
+        """Queue depth, running jobs, outcome counts and queue wait times (seconds)"""
+        started = self._counts["completed"] + self._counts["failed"] + self._running
+        return {
+            "depth": self.depth,
+            "max_depth": self._max_depth,
+            "running": self._running,
+            "chats_waiting": len(self._chats),
+            **self._counts,
+            "wait_avg": self._wait_total / started if started else 0.0,
+            "wait_max": self._wait_max,
+        }
@@ -0,0 +1,195 @@
+import os
+import re
+import time
+
+# 分享相关文件名: <种类>_<用户ID>_<YYYYmmdd_HHMMSS>_<分享ID>.<扩展名>
+SHARE_FILE_RE = re.compile(
+    r"^(?:photo|dct_base|derived_key|final|lsb|dct)_\d+_\d{8}_\d{6}_(\d+)\.(?:png|bin|npy)$"
+)
+
+
+class ShareStore:
+    """Pending shares by (chat_id, sender_id, share_id) with TTL expiry and a memory cap"""
+
+    def __init__(self, ttl=24 * 3600, max_memory=256 * 1024 * 1024):
+        self.ttl = ttl
+        self.max_memory = max_memory
+        self._shares = {}  # {(chat_id, sender_id, share_id): entry}
+        self._latest = {}  # {(chat_id, sender_id): 最新的 share_id}
+        self._next_id = 1
+        self._counts = {"added": 0, "expired": 0, "files_deleted": 0, "bytes_freed": 0, "memory_trimmed": 0}
+
+    @classmethod
+    def from_env(cls):
+        """Configure from SHARE_TTL_HOURS and SHARE_MEMORY_MB"""
+        return cls(
+            ttl=float(os.getenv("SHARE_TTL_HOURS", "24")) * 3600,
+            max_memory=int(float(os.getenv("SHARE_MEMORY_MB", "256")) * 1024 * 1024),
+        )
+
+    def add(self, chat_id, sender_id, entry, ttl=None):
+        """Store entry as a new share and return its share_id"""
+        share_id = self._next_id
+        self._next_id += 1
+        entry["share_id"] = share_id
+        entry["expires_at"] = time.time() + (self.ttl if ttl is None else ttl)
+        entry["last_used"] = time.time()
+        entry.setdefault("files", {})  # {路径: 字节数}
+        entry.setdefault("cache_keys", set())
+        self._shares[(chat_id, sender_id, share_id)] = entry
+        self._latest[(chat_id, sender_id)] = share_id
+        self._counts["added"] += 1
+        return share_id
+
+    def get(self, chat_id, sender_id, share_id=None):
+        """The live share, or the sender's latest one in the chat when share_id is None"""
+        if share_id is None:
+            share_id = self._latest.get((chat_id, sender_id))
+        entry = self._shares.get((chat_id, sender_id, share_id))
+        now = time.time()
+        if entry is None or entry["expires_at"] <= now:
+            return None
+        entry["last_used"] = now
+        return entry
+
+    def seed_ids(self, last_id):
+        """Continue share IDs after last_id, e.g. the highest one found on disk at startup"""
+        self._next_id = max(self._next_id, last_id + 1)
+
+    def track_file(self, entry, path, size):
+        entry["files"][path] = size
+
+    def tracked_files(self):
+        return {os.path.normpath(path) for entry in self._shares.values() for path in entry["files"]}
+
+    def pop_expired(self, now=None):
+        """Remove and return expired entries; shares still rendering are kept until the next sweep"""
+        now = time.time() if now is None else now
+        expired = []
+        for key, entry in list(self._shares.items()):
+            if entry["expires_at"] > now:
+                continue
+            renderer = entry.get("renderer")
+            if renderer is not None and not renderer.done():
+                continue
+            del self._shares[key]
+            expired.append(entry)
+
+        for chat_id, sender_id, share_id in {
+            (entry["chat_id"], entry["sender_id"], entry["share_id"]) for entry in expired
+        }:
+            if self._latest.get((chat_id, sender_id)) == share_id:
+                remaining = [
+                    key[2] for key in self._shares if key[:2] == (chat_id, sender_id)
+                ]
+                if remaining:
+                    self._latest[(chat_id, sender_id)] = max(remaining)
+                else:
+                    del self._latest[(chat_id, sender_id)]
+        self._counts["expired"] += len(expired)
+        return expired
+
+    def trim_memory(self):
+        """Drop cached data of idle shares, least recently viewed first, until under max_memory"""
+        used = sum(_memory_bytes(entry) for entry in self._shares.values())
+        released = 0
+        idle = [
+            entry for entry in self._shares.values()
+            if entry.get("renderer") is None or entry["renderer"].done()
+        ]
+        idle.sort(key=lambda entry: entry["last_used"])
+        # 先丢可重算的底图，再丢已落盘、可重新读取的原图
+        for field in ("dct_base", "photo_bytes"):
+            for entry in idle:
+                if used - released <= self.max_memory:
+                    break
+                size = _field_bytes(entry, field)
+                if not size:
+                    continue
+                if field == "photo_bytes" and not entry.get("original_saved"):
+                    # 原图尚未完整落盘(写入中或失败)，丢掉后无法重新读取
+                    continue
+                entry[field] = None
+                released += size
+        if released:
+            self._counts["memory_trimmed"] += released
+        return released
+
+    def record_deleted(self, files, freed):
+        self._counts["files_deleted"] += files
+        self._counts["bytes_freed"] += freed
+
+    def stats(self):
+        """Live entry counts and the bytes they hold in memory and on disk"""
+        memory_bytes = 0
+        disk_bytes = 0
+        files = 0
+        for entry in self._shares.values():
+            memory_bytes += _memory_bytes(entry)
+            disk_bytes += sum(entry["files"].values())
+            files += len(entry["files"])
+        return {
+            "shares": len(self._shares),
+            "chats": len({key[0] for key in self._shares}),
+            "senders": len(self._latest),
+            "memory_bytes": memory_bytes,
+            "max_memory": self.max_memory,
+            "disk_bytes": disk_bytes,
+            "files": files,
+            **self._counts,
+        }
+
+    def __len__(self):
+        return len(self._shares)
+
+
+def _field_bytes(entry, field):
+    value = entry.get(field)
+    if field == "dct_base":
+        # 进程池模式下 dct_base 是 .npy 路径，不占内存
+        return getattr(value, "nbytes", 0)
+    return len(value or b"")
+
+
+def _memory_bytes(entry):
+    return _field_bytes(entry, "photo_bytes") + _field_bytes(entry, "dct_base")
+
+
+def remove_files(paths):
+    """Delete paths, ignoring ones that are already gone; returns (files deleted, bytes freed)"""
+    deleted = 0
+    freed = 0
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            # 仍有其他硬链接(如渲染缓存条目)时删除并不释放空间
+            size = stat.st_size if stat.st_nlink == 1 else 0
+            os.remove(path)
+        except FileNotFoundError:
+            continue
+        except OSError as e:
+            print(f"删除过期文件失败: {e}")
+            continue
+        deleted += 1
+        freed += size
+    return deleted, freed
+
+
+def scan_share_files(directories):
+    """(path, share_id, mtime) of every share file in directories, skipping missing ones"""
+    found = []
+    for directory in directories:
+        try:
+            entries = list(os.scandir(directory))
+        except FileNotFoundError:
+            continue
+        for entry in entries:
+            match = SHARE_FILE_RE.match(entry.name)
+            if match is None:
+                continue
+            try:
+                mtime = entry.stat().st_mtime
+            except FileNotFoundError:
+                continue
+            found.append((os.path.normpath(entry.path), int(match.group(1)), mtime))
+    return found
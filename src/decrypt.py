@@ -1,37 +1,46 @@
 import os
+import sys
+import mmap
+import argparse
 from utils.crypto import (
     aes_decrypt, 
     decrypt_message, 
     decrypt_watermark,
-    decrypt_chunked_data
+    decrypt_chunked_data,
+    decrypt_file
 )
-from utils.watermark import extract_dct_watermark, decode_lsb
+from utils.watermark import extract_dct_watermark, extract_qim_watermark, detect_qim_watermark, decode_lsb
+from utils.batch import as_bool, load_manifest, read_key_file, run_batch
 
 # Get the project root (src/)
 PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
 
 def load_derived_key(filename):
     """加载派生密钥，处理版本标记"""
-    with open(os.path.join(PROJECT_ROOT, "output", "encrypted", filename), "rb") as file:
-        header = file.read(4)
-        if header == b'CHK1':  # 新版本格式
-            derived_key = file.read(32)
-            lsb_length_bytes = file.read(4)
-        else:  # 旧版本格式
-            derived_key = header + file.read(28)
-            lsb_length_bytes = file.read(4)
-        
-        lsb_length = int.from_bytes(lsb_length_bytes, byteorder='big') if lsb_length_bytes else None
-        return derived_key, lsb_length
+    return read_key_file(os.path.join(PROJECT_ROOT, "output", "encrypted", filename))
+
+def decrypt_message_file(path, derived_key):
+    """直接 mmap 密文文件解密，不先把整个文件读入内存"""
+    with open(path, "rb") as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return ""
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as encrypted_data:
+            return decrypt_message(encrypted_data, derived_key)
 
 def decrypt_and_save_text(derived_key_filename="derived_key.bin"):
     derived_key, _ = load_derived_key(derived_key_filename)
-    with open(os.path.join(PROJECT_ROOT, "output", "encrypted", "encrypted_messages.txt"), "rb") as file:
-        encrypted_data = file.read()
-    
-    decrypted_message = decrypt_message(encrypted_data, derived_key)
+    encrypted_path = os.path.join(PROJECT_ROOT, "output", "encrypted", "encrypted_messages.txt")
+    decrypted_message = decrypt_message_file(encrypted_path, derived_key)
     print("解密后的消息:", decrypted_message)
 
+def decrypt_and_save_photo(derived_key, encrypted_filename="encrypted_photo.bin", output_filename="decrypted_photo.png"):
+    encrypted_path = os.path.join(PROJECT_ROOT, "output", "encrypted", encrypted_filename)
+    output_path = os.path.join(PROJECT_ROOT, "output", "decrypted", output_filename)
+    # 流式解密，文件到文件
+    decrypted_size = decrypt_file(encrypted_path, output_path, derived_key)
+    print(f"解密照片已保存到 {output_path}，大小: {decrypted_size}字节")
+    return output_path
+
 def decrypt_dct_watermark(original_image_path, watermarked_image_path, output_watermark_path):
     try:
         extracted_path = extract_dct_watermark(original_image_path, watermarked_image_path, output_watermark_path)
@@ -42,7 +51,18 @@ def decrypt_dct_watermark(original_image_path, watermarked_image_path, output_wa
     except Exception as e:
         print(f"DCT水印提取错误: {e}")
 
+def decrypt_blind_watermark(watermarked_image_path, watermark_path, derived_key, output_watermark_path):
+    """盲检测模式: 只读取水印照片，以派生密钥提取并校验DCT水印"""
+    try:
+        extract_qim_watermark(watermarked_image_path, output_watermark_path, derived_key)
+        print(f"盲检测DCT水印提取并保存到 {output_watermark_path}")
+        detected, score = detect_qim_watermark(watermarked_image_path, watermark_path, derived_key)
+        print(f"水印{'验证通过' if detected else '未通过验证'}，比特一致率 {score:.1%}")
+    except Exception as e:
+        print(f"盲检测DCT水印提取错误: {e}")
+
 def decrypt_lsb_watermark(watermarked_image_path, lsb_length, derived_key):
+    # lsb_length 仅用于旧版无头部的水印(长度保存在密钥文件中)，新水印传 None
     try:
         lsb_watermark_bytes = decode_lsb(watermarked_image_path, lsb_length)
         if lsb_watermark_bytes:
@@ -53,7 +73,94 @@ def decrypt_lsb_watermark(watermarked_image_path, lsb_length, derived_key):
     except Exception as e:
         print(f"LSB水印解密失败: {e}")
 
+def _item_key_path(item, default_key):
+    # 未指定密钥时，优先使用批量加密在密文旁生成的 <stem>_key.bin
+    if item.get('key'):
+        return item['key']
+    sidecar = os.path.splitext(item['input'])[0] + "_key.bin"
+    return sidecar if os.path.exists(sidecar) else default_key
+
+def decrypt_item(item, default_key, out_dir):
+    """
+    批处理: 解密单个密文文件。
+    照片输出 <stem>.png 并解出LSB水印；blind 时无需原图提取并校验盲检测DCT水印，
+    否则给出 original 时提取DCT水印；
+    文本输出 <stem>.txt。
+    """
+    key_path = _item_key_path(item, default_key)
+    if not key_path:
+        raise ValueError("no key file for this item")
+    derived_key, lsb_length = read_key_file(key_path)
+    stem = item.get('output') or os.path.splitext(os.path.basename(item['input']))[0]
+
+    if item.get('type', 'photo') == 'text':
+        message = decrypt_message_file(item['input'], derived_key)
+        output_path = os.path.join(out_dir, f"{stem}.txt")
+        with open(output_path, "w", encoding="utf-8") as file:
+            file.write(message)
+        return {'bytes': os.path.getsize(item['input']), 'detail': output_path}
+
+    output_path = os.path.join(out_dir, f"{stem}.png")
+    decrypt_file(item['input'], output_path, derived_key)
+    details = [output_path]
+    try:
+        lsb_text = decrypt_watermark(decode_lsb(output_path, lsb_length), derived_key)
+        details.append(f"LSB: {lsb_text.decode('utf-8', errors='ignore')!r}")
+    except ValueError as e:
+        details.append(f"LSB: {e}")
+    if as_bool(item.get('blind', False)):
+        dct_path = extract_qim_watermark(output_path, os.path.join(out_dir, f"{stem}_dct.png"), derived_key)
+        if item.get('watermark'):
+            detected, score = detect_qim_watermark(output_path, item['watermark'], derived_key)
+            details.append(f"DCT: {'detected' if detected else 'not detected'} ({score:.1%})")
+        else:
+            details.append(f"DCT: {dct_path}")
+    elif item.get('original'):
+        dct_path = extract_dct_watermark(item['original'], output_path,
+                                         os.path.join(out_dir, f"{stem}_dct.png"),
+                                         float(item.get('alpha', 0.1)))
+        details.append(f"DCT: {dct_path}")
+    return {'bytes': os.path.getsize(item['input']), 'detail': "; ".join(details)}
+
+def batch_main(argv):
+    """非交互批处理模式: 由命令行参数或清单文件给出多个密文文件，进程池并行解密"""
+    parser = argparse.ArgumentParser(
+        description="Decrypt many encrypted photos/messages without prompts.",
+        epilog="Manifest items (JSON list or CSV columns): type (photo|text), input, key, "
+               "output, original, alpha, blind, watermark. Without key, <input stem>_key.bin next to the "
+               "input is used, then --key.")
+    parser.add_argument("--photos", nargs="+", default=[], help="encrypted photo files (.bin)")
+    parser.add_argument("--messages", nargs="+", default=[], help="encrypted message files")
+    parser.add_argument("--manifest", help="JSON or CSV file listing items")
+    parser.add_argument("--key", help="derived key file for items without their own")
+    parser.add_argument("--original", help="original photo, to extract the DCT watermark from --photos")
+    parser.add_argument("--blind", action="store_true",
+                        help="check the keyed blind DCT watermark of --photos (no original needed)")
+    parser.add_argument("--watermark", help="expected watermark image for --blind detection")
+    parser.add_argument("--alpha", type=float, default=0.1, help="DCT watermark strength used when embedding")
+    parser.add_argument("--out-dir", default=os.path.join(PROJECT_ROOT, "output", "batch", "decrypted"))
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: CPU count)")
+    args = parser.parse_args(argv)
+
+    items = load_manifest(args.manifest) if args.manifest else []
+    for photo in args.photos:
+        items.append({'type': 'photo', 'input': photo, 'original': args.original, 'alpha': args.alpha,
+                      'blind': args.blind, 'watermark': args.watermark})
+    for message in args.messages:
+        items.append({'type': 'text', 'input': message})
+    if not items:
+        parser.error("nothing to do: give --photos, --messages or --manifest")
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    results = run_batch(decrypt_item, items, (args.key, args.out_dir), args.workers,
+                        [os.path.basename(item['input']) for item in items])
+    return 0 if all(result['status'] == 'ok' for result in results) else 1
+
 if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        # 带命令行参数时进入非交互批处理模式
+        sys.exit(batch_main(sys.argv[1:]))
+
     os.makedirs(os.path.join(PROJECT_ROOT, "output", "decrypted"), exist_ok=True)
     os.makedirs(os.path.join(PROJECT_ROOT, "output", "extracted"), exist_ok=True)
     
@@ -65,21 +172,33 @@ if __name__ == "__main__":
         decrypt_and_save_text(derived_key_filename)
     elif choice == 'photo':
         photo_to_decrypt = input("输入要解密的照片文件名(默认: final_watermarked.png): ").strip() or "final_watermarked.png"
-        original_photo_path = input("输入原始未加水印照片路径(默认: data/photos/testphoto.png): ").strip() or os.path.join(PROJECT_ROOT, "data", "photos", "testphoto.png")
+        blind = input("DCT水印是否为盲检测模式? (yes/no): ").strip().lower() == 'yes'
+        # 盲检测需与嵌入时相同的水印图片
+        blind_watermark_path = (input("输入嵌入时使用的水印图片路径(默认: data/watermarks/watermark.png): ").strip()
+                                or os.path.join(PROJECT_ROOT, "data", "watermarks", "watermark.png")) if blind else None
+        original_photo_path = None if blind else input("输入原始未加水印照片路径(默认: data/photos/testphoto.png): ").strip() or os.path.join(PROJECT_ROOT, "data", "photos", "testphoto.png")
         
         dct_watermarked_image_path = os.path.join(PROJECT_ROOT, "output", "decrypted", photo_to_decrypt)
+
+        if os.path.exists(os.path.join(PROJECT_ROOT, "output", "encrypted", "encrypted_photo.bin")):
+            print("解密加密照片 'encrypted_photo.bin'...")
+            decrypt_and_save_photo(derived_key)
         output_dct_watermark_path = os.path.join(PROJECT_ROOT, "output", "extracted", "extracted_dct_watermark.png")
 
-        if os.path.exists(dct_watermarked_image_path):
+        if os.path.exists(dct_watermarked_image_path) and blind:
+            print(f"从 '{dct_watermarked_image_path}' 盲检测DCT水印(无需原图)...")
+            decrypt_blind_watermark(dct_watermarked_image_path, blind_watermark_path,
+                                    derived_key, output_dct_watermark_path)
+        elif os.path.exists(dct_watermarked_image_path):
             print(f"从 '{dct_watermarked_image_path}' 解密DCT水印...")
             decrypt_dct_watermark(original_photo_path, dct_watermarked_image_path, output_dct_watermark_path)
         else:
             print(f"未找到DCT水印文件 '{dct_watermarked_image_path}'")
 
-        if os.path.exists(dct_watermarked_image_path) and lsb_length:
+        if os.path.exists(dct_watermarked_image_path):
             print(f"从 '{dct_watermarked_image_path}' 解密LSB水印...")
             decrypt_lsb_watermark(dct_watermarked_image_path, lsb_length, derived_key)
         else:
-            print("未找到LSB水印或长度信息")
+            print("未找到LSB水印")
     else:
         print("无效输入，请输入 'text' 或 'photo'")
\ No newline at end of file
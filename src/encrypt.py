@@ -1,14 +1,17 @@
 import os
+import sys
 import shlex
-import shutil
-from utils.treekem import TreeNode
+import argparse
+from utils.treekem import RatchetTree
 from utils.crypto import (
     encrypt_chunked_data, 
     encrypt_watermark, 
     encrypt_long_message, 
-    encrypt_photo
+    encrypt_photo,
+    encrypt_framed_file
 )
-from utils.watermark import dct_watermark_color, encode_lsb
+from utils.pipeline import WatermarkPipeline
+from utils.batch import as_bool, load_manifest, read_key_file, run_batch, write_key_file
 
 # Get the project root (src/)
 PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
@@ -31,49 +34,166 @@ def encrypt_and_save_text(root, message, derived_key_filename="derived_key.bin")
 
 def encrypt_and_save_photo(root, photo_path, watermark_options={}, derived_key_filename="derived_key.bin"):
     derived_key = root.group_key
-    temp_photo_path = photo_path
     save_derived_key(derived_key, derived_key_filename)
 
     # 用户自定义文件名
-    dct_output_filename = input("输入DCT水印照片文件名(默认: dct_watermarked.png): ").strip() or "dct_watermarked.png"
-    lsb_output_filename = input("输入LSB水印照片文件名(默认: lsb_watermarked.png): ").strip() or "lsb_watermarked.png"
     final_output_filename = input("输入最终水印照片文件名(默认: final_watermarked.png): ").strip() or "final_watermarked.png"
 
+    # 调试模式下才保存DCT/LSB中间图像
+    debug_paths = {}
+    if watermark_options.get('debug', False):
+        if watermark_options.get('dct', False):
+            dct_output_filename = input("输入DCT水印照片文件名(默认: dct_watermarked.png): ").strip() or "dct_watermarked.png"
+            debug_paths['dct'] = os.path.join(PROJECT_ROOT, "output", "decrypted", dct_output_filename)
+        if watermark_options.get('lsb', False):
+            lsb_output_filename = input("输入LSB水印照片文件名(默认: lsb_watermarked.png): ").strip() or "lsb_watermarked.png"
+            debug_paths['lsb'] = os.path.join(PROJECT_ROOT, "output", "decrypted", lsb_output_filename)
+
+    pipeline = WatermarkPipeline(debug_paths=debug_paths)
+
     # 应用DCT水印
     if watermark_options.get('dct', False):
-        watermark_image = watermark_options.get('dct_watermark_path', 
+        pipeline.watermark_path = watermark_options.get('dct_watermark_path', 
             os.path.join(PROJECT_ROOT, "data", "watermarks", "watermark.png"))
-        dct_output_path = os.path.join(PROJECT_ROOT, "output", "decrypted", dct_output_filename)
-        temp_photo_path = dct_watermark_color(temp_photo_path, watermark_image, dct_output_path)
-        print(f"DCT水印照片已保存到 {dct_output_path}")
+        # 盲检测模式以派生密钥为水印密钥，验证时无需原图
+        if watermark_options.get('blind', False):
+            pipeline.blind_key = derived_key
 
     # 应用LSB水印
     if watermark_options.get('lsb', False):
         lsb_text = watermark_options.get('lsb_text', "SecretMessage")
-        encrypt_lsb_text = encrypt_watermark(lsb_text.encode(), derived_key)
-        
-        if watermark_options.get('dct', False):
-            lsb_input_path = dct_output_path
-        else:
-            lsb_input_path = temp_photo_path
-            
-        lsb_output_path = os.path.join(PROJECT_ROOT, "output", "decrypted", lsb_output_filename)
-        temp_photo_path = encode_lsb(lsb_input_path, encrypt_lsb_text, lsb_output_path)
-        print(f"LSB水印照片已保存到 {lsb_output_path}")
-        
-        # 保存LSB长度信息
-        with open(os.path.join(PROJECT_ROOT, "output", "encrypted", derived_key_filename), "ab") as file:
-            file.write(len(encrypt_lsb_text).to_bytes(4, byteorder='big'))
+        # LSB负载自带头部(长度与CRC)，无需在密钥文件中保存长度
+        pipeline.lsb_payload = encrypt_watermark(lsb_text.encode(), derived_key)
 
-    # 保存最终水印照片
+    # 在内存中完成所有水印后只编码一次最终水印照片
     final_output_path = os.path.join(PROJECT_ROOT, "output", "decrypted", final_output_filename)
-    shutil.copy(temp_photo_path, final_output_path)
+    pipeline.to_file(photo_path, final_output_path)
+    for stage, path in debug_paths.items():
+        print(f"{stage.upper()}水印照片已保存到 {path}")
     print(f"最终水印照片已保存到 {final_output_path}")
 
+    # 流式加密最终水印照片，内存占用与文件大小无关
+    encrypted_photo_path = os.path.join(PROJECT_ROOT, "output", "encrypted", "encrypted_photo.bin")
+    encrypted_size = encrypt_framed_file(final_output_path, encrypted_photo_path, derived_key)
+    print(f"加密照片已保存到 {encrypted_photo_path}，大小: {encrypted_size}字节")
+
+def _item_stem(item, index):
+    if item.get('output'):
+        return item['output']
+    if item.get('type', 'photo') == 'photo':
+        return os.path.splitext(os.path.basename(item['input']))[0]
+    return f"message_{index}"
+
+def assign_stems(items):
+    """为每项分配输出文件名前缀; 重名(如不同目录下的同名照片)依次加 _2、_3 ... 后缀，避免互相覆盖"""
+    taken = {"derived_key"}  # 输出目录中已占用的 derived_key.bin
+    for index, item in enumerate(items):
+        base = stem = _item_stem(item, index)
+        suffix = 2
+        # 按小写比较，兼顾不区分大小写的文件系统
+        while stem.lower() in taken:
+            stem = f"{base}_{suffix}"
+            suffix += 1
+        taken.add(stem.lower())
+        item['stem'] = stem
+
+def encrypt_photo_item(item, derived_key, out_dir):
+    """批处理: 为单张照片加水印并加密，输出 <stem>_watermarked.png、<stem>.bin 和 <stem>_key.bin"""
+    stem = item['stem']
+    pipeline = WatermarkPipeline(alpha=float(item.get('alpha', 0.1)))
+    # blind 隐含 dct，与 --photos 的 args.dct or args.blind 一致
+    blind = as_bool(item.get('blind', False))
+    if blind or as_bool(item.get('dct', False)):
+        pipeline.watermark_path = item.get('watermark') or os.path.join(PROJECT_ROOT, "data", "watermarks", "watermark.png")
+        if blind:
+            pipeline.blind_key = derived_key
+    if item.get('lsb_text'):
+        pipeline.lsb_payload = encrypt_watermark(item['lsb_text'].encode(), derived_key)
+
+    watermarked_path = os.path.join(out_dir, f"{stem}_watermarked.png")
+    encrypted_path = os.path.join(out_dir, f"{stem}.bin")
+    pipeline.to_file(item['input'], watermarked_path)
+    encrypt_framed_file(watermarked_path, encrypted_path, derived_key)
+    write_key_file(os.path.join(out_dir, f"{stem}_key.bin"), derived_key)
+    return {'bytes': os.path.getsize(item['input']), 'detail': encrypted_path}
+
+def encrypt_text_item(item, derived_key, out_dir):
+    """批处理: 加密单条消息(input 为文本，或 file 为文本文件路径)，输出 <stem>.bin 和 <stem>_key.bin"""
+    if item.get('file'):
+        with open(item['file'], encoding='utf-8') as file:
+            message = file.read()
+    else:
+        message = item['input']
+    encrypted_path = os.path.join(out_dir, f"{item['stem']}.bin")
+    with open(encrypted_path, "wb") as file:
+        file.write(encrypt_long_message(message, derived_key))
+    write_key_file(os.path.join(out_dir, f"{item['stem']}_key.bin"), derived_key)
+    return {'bytes': len(message.encode()), 'detail': encrypted_path}
+
+def encrypt_item(item, derived_key, out_dir):
+    if item.get('key'):
+        derived_key, _ = read_key_file(item['key'])
+    if item.get('type', 'photo') == 'text':
+        return encrypt_text_item(item, derived_key, out_dir)
+    return encrypt_photo_item(item, derived_key, out_dir)
+
+def batch_main(argv):
+    """非交互批处理模式: 由命令行参数或清单文件给出多张照片/多条消息，进程池并行处理"""
+    parser = argparse.ArgumentParser(
+        description="Watermark and encrypt many photos/messages without prompts.",
+        epilog="Manifest items (JSON list or CSV columns): type (photo|text), input, file, "
+               "output, dct, blind, watermark, alpha, lsb_text, key.")
+    parser.add_argument("--photos", nargs="+", default=[], help="photo paths to watermark and encrypt")
+    parser.add_argument("--messages", nargs="+", default=[], help="text messages to encrypt")
+    parser.add_argument("--manifest", help="JSON or CSV file listing items")
+    parser.add_argument("--dct", action="store_true", help="add the DCT watermark to --photos")
+    parser.add_argument("--blind", action="store_true",
+                        help="use the keyed blind DCT mode (verifiable without the original)")
+    parser.add_argument("--watermark", help="DCT watermark image (default: data/watermarks/watermark.png)")
+    parser.add_argument("--alpha", type=float, default=0.1, help="DCT watermark strength")
+    parser.add_argument("--lsb-text", help="encrypted LSB watermark text for --photos")
+    parser.add_argument("--key", help="existing derived key file to use instead of a new group")
+    parser.add_argument("--members", type=int, default=3, help="group size when generating a new group key")
+    parser.add_argument("--out-dir", default=os.path.join(PROJECT_ROOT, "output", "batch"))
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: CPU count)")
+    args = parser.parse_args(argv)
+
+    items = load_manifest(args.manifest) if args.manifest else []
+    for photo in args.photos:
+        items.append({'type': 'photo', 'input': photo, 'dct': args.dct or args.blind,
+                      'blind': args.blind, 'watermark': args.watermark,
+                      'alpha': args.alpha, 'lsb_text': args.lsb_text})
+    for message in args.messages:
+        items.append({'type': 'text', 'input': message})
+    if not items:
+        parser.error("nothing to do: give --photos, --messages or --manifest")
+
+    if args.key:
+        derived_key, _ = read_key_file(args.key)
+    else:
+        root = RatchetTree(deferred=True)
+        for _ in range(args.members):
+            root.add_member_TreeNode(root.generate_private_key().public_key())
+        root.update_key_TreeNode()
+        derived_key = root.group_key
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    write_key_file(os.path.join(args.out_dir, "derived_key.bin"), derived_key)
+    assign_stems(items)
+
+    results = run_batch(encrypt_item, items, (derived_key, args.out_dir), args.workers,
+                        [item['stem'] for item in items])
+    return 0 if all(result['status'] == 'ok' for result in results) else 1
+
 if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        # 带命令行参数时进入非交互批处理模式
+        sys.exit(batch_main(sys.argv[1:]))
+
     os.makedirs(os.path.join(PROJECT_ROOT, "output", "encrypted"), exist_ok=True)
     os.makedirs("temp", exist_ok=True)
-    root = TreeNode()
+    # 延迟模式: 增删成员只排队，update_key_TreeNode 时一次性重新计算
+    root = RatchetTree(deferred=True)
     
     choice = input("What would you like to encrypt? Enter 'text' or 'photo': ").strip().lower()
     num_members = int(input("Number of members in the group: "))
@@ -99,12 +219,17 @@ if __name__ == "__main__":
             watermark_path = input("Enter watermark image path (default: data/watermarks/watermark.png): ").strip() or os.path.join(PROJECT_ROOT, "data", "watermarks", "watermark.png")
             watermark_options['dct'] = True
             watermark_options['dct_watermark_path'] = watermark_path
+            blind_choice = input("Use blind DCT watermark (verifiable without the original)? (yes/no): ").strip().lower()
+            watermark_options['blind'] = blind_choice == 'yes'
         
         lsb_choice = input("Add LSB watermark? (yes/no): ").strip().lower()
         if lsb_choice == 'yes':
             lsb_text = input("Enter LSB watermark text (default: SecretMessage): ").strip() or "SecretMessage"
             watermark_options['lsb'] = True
             watermark_options['lsb_text'] = lsb_text
+
+        debug_choice = input("Save intermediate watermark images? (yes/no): ").strip().lower()
+        watermark_options['debug'] = debug_choice == 'yes'
         
         encrypt_and_save_photo(root, photo_path, watermark_options, derived_key_filename)
     else:
@@ -129,8 +254,9 @@ if __name__ == "__main__":
         root.print_tree()
     elif action == "remove":
         index_to_remove = int(input("Enter the index of the member to remove (starting from 0): "))
-        if 0 <= index_to_remove < len(root.children):
-            root.remove_member_TreeNode(root.children[index_to_remove].public_key)
+        members = root.members()
+        if 0 <= index_to_remove < len(members):
+            root.remove_member_TreeNode(members[index_to_remove])
             print("Member removed.")
             root.update_key_TreeNode()
             if choice == 'photo' and watermark_options:
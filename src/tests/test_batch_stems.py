@@ -0,0 +1,55 @@
+"""
+Output file names of encrypt.py's batch mode.
+
+Run from src/:  python -m unittest discover tests
+"""
+import contextlib
+import io
+import os
+import tempfile
+import unittest
+import cv2
+import numpy as np
+import encrypt
+
+
+class AssignStemsTest(unittest.TestCase):
+    def test_colliding_basenames_get_suffixes(self):
+        items = [
+            {'type': 'photo', 'input': os.path.join('a', 'x.png')},
+            {'type': 'photo', 'input': os.path.join('b', 'x.png')},
+            {'type': 'photo', 'input': os.path.join('c', 'X.jpg')},
+            {'type': 'photo', 'input': os.path.join('d', 'x_2.png')},
+        ]
+        encrypt.assign_stems(items)
+        self.assertEqual([item['stem'] for item in items], ['x', 'x_2', 'X_3', 'x_2_2'])
+
+    def test_stem_cannot_take_the_shared_key_file(self):
+        items = [{'type': 'text', 'input': 'hi', 'output': 'derived_key'}]
+        encrypt.assign_stems(items)
+        self.assertEqual(items[0]['stem'], 'derived_key_2')
+
+    def test_batch_keeps_both_photos(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            inputs = []
+            for index, folder in enumerate(('a', 'b')):
+                os.makedirs(os.path.join(tmp, folder))
+                path = os.path.join(tmp, folder, 'x.png')
+                cv2.imwrite(path, np.full((16, 16, 3), 40 * (index + 1), np.uint8))
+                inputs.append(path)
+            out_dir = os.path.join(tmp, 'out')
+
+            with contextlib.redirect_stdout(io.StringIO()):
+                status = encrypt.batch_main(
+                    ['--photos', *inputs, '--out-dir', out_dir, '--workers', '1', '--members', '1'])
+
+            self.assertEqual(status, 0)
+            for stem, value in (('x', 40), ('x_2', 80)):
+                image = cv2.imread(os.path.join(out_dir, f'{stem}_watermarked.png'))
+                self.assertEqual(int(image[0, 0, 0]), value)
+                self.assertTrue(os.path.exists(os.path.join(out_dir, f'{stem}.bin')))
+                self.assertTrue(os.path.exists(os.path.join(out_dir, f'{stem}_key.bin')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+"""
+decrypt_range on intact and tampered framed containers.
+
+Run from src/:  python -m unittest discover tests
+"""
+import os
+import tempfile
+import unittest
+from utils.crypto import FRAME_TRAILER, decrypt_range, encrypt_framed_data
+
+KEY = bytes(range(32))
+PLAINTEXT = os.urandom(5000)
+CHUNK_SIZE = 1024
+
+
+class DecryptRangeTest(unittest.TestCase):
+    def setUp(self):
+        self.container = encrypt_framed_data(PLAINTEXT, KEY, chunk_size=CHUNK_SIZE)
+        handle, self.path = tempfile.mkstemp(suffix='.bin')
+        os.close(handle)
+        self.addCleanup(os.remove, self.path)
+
+    def _write(self, data):
+        with open(self.path, 'wb') as file:
+            file.write(data)
+
+    def _tamper_trailer(self, **fields):
+        trailer = dict(zip(
+            ('index_offset', 'plaintext_length', 'frame_count', 'magic'),
+            FRAME_TRAILER.unpack(self.container[-FRAME_TRAILER.size:]),
+        ))
+        trailer.update(fields)
+        self._write(self.container[:-FRAME_TRAILER.size] + FRAME_TRAILER.pack(
+            trailer['index_offset'], trailer['plaintext_length'], trailer['frame_count'], trailer['magic']))
+        return trailer
+
+    def test_intact_ranges(self):
+        self._write(self.container)
+        for start, length in ((0, 5000), (1000, 100), (4090, 2000), (5000, 10), (0, 0)):
+            self.assertEqual(decrypt_range(self.path, start, length, KEY), PLAINTEXT[start:start + length])
+
+    def test_lowered_plaintext_length(self):
+        self._tamper_trailer(plaintext_length=4500)
+        with self.assertRaises(ValueError):
+            decrypt_range(self.path, 0, 5000, KEY)
+
+    def test_inflated_plaintext_length(self):
+        for plaintext_length in (5200, 50000, 2 ** 40):
+            self._tamper_trailer(plaintext_length=plaintext_length)
+            with self.assertRaises(ValueError):
+                decrypt_range(self.path, 0, 2 ** 41, KEY)
+
+    def test_inflated_length_with_matching_frame_count(self):
+        # frame_count 与 plaintext_length 一致，但索引长度对不上
+        self._tamper_trailer(plaintext_length=50000, frame_count=49)
+        with self.assertRaises(ValueError):
+            decrypt_range(self.path, 40000, 100, KEY)
+
+    def test_shifted_index_offset(self):
+        trailer = FRAME_TRAILER.unpack(self.container[-FRAME_TRAILER.size:])
+        for index_offset in (trailer[0] - 8, trailer[0] + 8, 0, 2 ** 63):
+            self._tamper_trailer(index_offset=index_offset)
+            with self.assertRaises(ValueError):
+                decrypt_range(self.path, 0, 5000, KEY)
+
+    def test_truncated_container(self):
+        for size in (10, 40):
+            self._write(self.container[:size])
+            with self.assertRaises(ValueError):
+                decrypt_range(self.path, 0, 10, KEY)
+
+
+if __name__ == '__main__':
+    unittest.main()
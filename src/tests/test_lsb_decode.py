@@ -0,0 +1,125 @@
+"""
+Partial PNG decoding behind decode_lsb, and its fallback to a full decode.
+
+Run from src/:  python -m unittest discover tests
+"""
+import os
+import struct
+import tempfile
+import unittest
+import zlib
+from unittest import mock
+import cv2
+import numpy as np
+from PIL import Image
+from utils import watermark
+from utils.watermark import decode_lsb, encode_lsb_array
+
+
+def _paeth(a, b, c):
+    pa, pb, pc = abs(b - c), abs(a - c), abs(a + b - 2 * c)
+    return a if pa <= pb and pa <= pc else b if pb <= pc else c
+
+
+def _filter_row(filter_type, row, previous, bpp):
+    out = bytearray()
+    for i, value in enumerate(row):
+        a = row[i - bpp] if i >= bpp else 0
+        b = previous[i]
+        c = previous[i - bpp] if i >= bpp else 0
+        predictor = [0, a, b, (a + b) >> 1, _paeth(a, b, c)][filter_type]
+        out.append((value - predictor) & 0xFF)
+    return out
+
+
+def write_png(path, pixels, filters):
+    """RGB PNG whose row y uses filters[y % len(filters)]"""
+    height, width, bpp = pixels.shape
+    raw = bytearray()
+    previous = bytes(width * bpp)
+    for y in range(height):
+        row = pixels[y].tobytes()
+        filter_type = filters[y % len(filters)]
+        raw.append(filter_type)
+        raw += _filter_row(filter_type, row, previous, bpp)
+        previous = row
+
+    def chunk(chunk_type, data):
+        return struct.pack('>I', len(data)) + chunk_type + data + struct.pack('>I', zlib.crc32(chunk_type + data))
+
+    with open(path, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n')
+        f.write(chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)))
+        compressed = zlib.compress(bytes(raw))
+        # 拆成多个 IDAT 块，覆盖跨块的增量解压
+        for i in range(0, len(compressed), 64):
+            f.write(chunk(b'IDAT', compressed[i:i + 64]))
+        f.write(chunk(b'IEND', b''))
+
+
+class PartialPngDecodeTest(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.TemporaryDirectory()
+        self.pixels = np.random.default_rng(0).integers(0, 256, size=(40, 37, 3), dtype=np.uint8)
+
+    def tearDown(self):
+        self.workdir.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.workdir.name, name)
+
+    def test_top_rows_match_full_decode_for_every_filter_type(self):
+        path = self.path('filters.png')
+        write_png(path, self.pixels, [0, 1, 2, 3, 4])
+        np.testing.assert_array_equal(np.asarray(Image.open(path).convert('RGB')), self.pixels)
+        rows, size = watermark._png_top_rows(path, 17)
+        self.assertEqual(size, (37, 40))
+        np.testing.assert_array_equal(rows, self.pixels[:17])
+
+    def test_decode_lsb_round_trip_through_partial_decode(self):
+        payload = os.urandom(120)
+        path = self.path('payload.png')
+        write_png(path, encode_lsb_array(self.pixels, payload), [4, 3, 1])
+        self.assertEqual(decode_lsb(path), payload)
+
+
+class FullDecodeFallbackTest(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.TemporaryDirectory()
+        self.payload = os.urandom(64)
+        pixels = np.random.default_rng(1).integers(0, 256, size=(32, 48, 3), dtype=np.uint8)
+        self.image = encode_lsb_array(pixels, self.payload, bgr=True)
+
+    def tearDown(self):
+        self.workdir.cleanup()
+
+    def write(self, name):
+        path = os.path.join(self.workdir.name, name)
+        cv2.imwrite(path, self.image)
+        return path
+
+    def test_falls_back_when_partial_decode_raises(self):
+        path = self.write('raises.png')
+        with mock.patch.object(watermark, '_png_top_rows', side_effect=ValueError("boom")) as partial:
+            self.assertEqual(decode_lsb(path), self.payload)
+        partial.assert_called()
+
+    def test_falls_back_when_partial_decode_returns_wrong_shape(self):
+        path = self.write('wrong_shape.png')
+        wrong = (np.zeros((1, 5, 3), dtype=np.uint8), (5, 1))
+        with mock.patch.object(watermark, '_png_top_rows', return_value=wrong):
+            self.assertEqual(decode_lsb(path), self.payload)
+
+    def test_non_png_uses_full_decode(self):
+        self.assertEqual(decode_lsb(self.write('payload.bmp')), self.payload)
+
+    def test_unsupported_png_layout_uses_full_decode(self):
+        path = os.path.join(self.workdir.name, 'gray.png')
+        cv2.imwrite(path, cv2.cvtColor(self.image, cv2.COLOR_BGR2GRAY))
+        with self.assertRaises(ValueError):
+            watermark._png_top_rows(path, 1)
+        expected = watermark._extract_lsb_bits(np.asarray(Image.open(path).convert('RGB'))[:1], 16)
+        self.assertEqual(watermark._read_lsb_prefix(path, 16), (expected, (48, 32)))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+"""
+Input formats WatermarkPipeline accepts, including ones OpenCV cannot read.
+
+Run from src/:  python -m unittest discover tests
+"""
+import os
+import tempfile
+import unittest
+import numpy as np
+from PIL import Image
+from utils.pipeline import WatermarkPipeline
+from utils.watermark import decode_lsb
+
+
+class GifInputTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = tmp.name
+        self.gif_path = os.path.join(self.tmp, 'input.gif')
+        rgb = np.zeros((48, 64, 3), np.uint8)
+        rgb[:, :32] = (200, 30, 10)
+        rgb[:, 32:] = (10, 60, 220)
+        Image.fromarray(rgb).save(self.gif_path)
+        with Image.open(self.gif_path) as img:
+            self.expected_rgb = np.asarray(img.convert('RGB'))
+
+    def test_lsb_only_gif_to_file(self):
+        payload = b'gif payload'
+        output_path = os.path.join(self.tmp, 'output.png')
+        WatermarkPipeline(lsb_payload=payload).to_file(self.gif_path, output_path)
+        self.assertEqual(decode_lsb(output_path), payload)
+        with Image.open(output_path) as img:
+            rgb = np.asarray(img.convert('RGB')).astype(int)
+        # LSB 只改动最低位
+        self.assertLessEqual(int(np.abs(rgb - self.expected_rgb).max()), 1)
+
+    def test_gif_bytes(self):
+        with open(self.gif_path, 'rb') as file:
+            pixels = WatermarkPipeline().load(file.read())
+        np.testing.assert_array_equal(pixels[..., ::-1], self.expected_rgb)
+
+    def test_missing_file(self):
+        with self.assertRaises(FileNotFoundError):
+            WatermarkPipeline().load(os.path.join(self.tmp, 'missing.gif'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+"""
+Blind (QIM) watermark detection after a JPEG round trip.
+
+Run from src/:  python -m unittest discover tests
+"""
+import os
+import tempfile
+import unittest
+import cv2
+from utils.watermark import QIM_DETECT_THRESHOLD, detect_qim_watermark, qim_watermark_array
+
+SRC = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PHOTO_PATH = os.path.join(SRC, 'data', 'photos', 'testphoto.png')
+WATERMARK_PATH = os.path.join(SRC, 'data', 'watermarks', 'watermark.png')
+KEY = bytes(range(32))
+
+
+class QimJpegTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = tmp.name
+        self.photo = cv2.imread(PHOTO_PATH)
+
+    def _detect_after_jpeg(self, size, quality, key=KEY):
+        image = cv2.resize(self.photo, (size, size), interpolation=cv2.INTER_AREA)
+        watermarked = qim_watermark_array(image, WATERMARK_PATH, KEY)
+        path = os.path.join(self.tmp, f'{size}_{quality}.jpg')
+        cv2.imwrite(path, watermarked, [cv2.IMWRITE_JPEG_QUALITY, quality])
+        return detect_qim_watermark(path, WATERMARK_PATH, key)
+
+    def test_detected_after_jpeg_quality_90(self):
+        for size in (256, 512, 1024):
+            detected, score = self._detect_after_jpeg(size, 90)
+            self.assertTrue(detected, f'{size}px: score {score:.3f}')
+            self.assertGreater(score, 0.95)
+
+    def test_detected_after_jpeg_quality_75_on_large_images(self):
+        detected, score = self._detect_after_jpeg(1024, 75)
+        self.assertTrue(detected, f'score {score:.3f}')
+
+    def test_wrong_key_is_not_detected(self):
+        detected, score = self._detect_after_jpeg(512, 90, key=bytes(32))
+        self.assertFalse(detected)
+        self.assertLess(score, QIM_DETECT_THRESHOLD)
+
+
+if __name__ == '__main__':
+    unittest.main()
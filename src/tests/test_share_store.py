@@ -0,0 +1,101 @@
+"""
+ShareStore bookkeeping and the share files it finds on disk.
+
+Run from src/:  python -m unittest discover tests
+"""
+import os
+import tempfile
+import unittest
+from bot.share_store import ShareStore, remove_files, scan_share_files
+
+
+class ShareFilesTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dirs = [os.path.join(tmp.name, name) for name in ('original', 'encrypted', 'decrypted')]
+        for directory in self.dirs:
+            os.makedirs(directory)
+
+    def _touch(self, directory, name, mtime=None):
+        path = os.path.join(directory, name)
+        with open(path, 'wb') as file:
+            file.write(b'x')
+        if mtime is not None:
+            os.utime(path, (mtime, mtime))
+        return os.path.normpath(path)
+
+    def test_scan_matches_share_files_only(self):
+        original, encrypted, decrypted = self.dirs
+        expected = {
+            self._touch(original, 'photo_42_20250101_120000_7.png'): 7,
+            self._touch(original, 'dct_base_42_20250101_120000_7.npy'): 7,
+            self._touch(encrypted, 'derived_key_9_20250101_120000_12.bin'): 12,
+            self._touch(decrypted, 'final_9_20250101_120000_12.png'): 12,
+        }
+        # 渲染缓存、私钥与不带分享ID的旧文件不属于分享文件
+        self._touch(decrypted, 'cache_' + 'ab' * 32 + '.png')
+        self._touch(original, 'photo_42_20250101_120000.png')
+        self._touch(encrypted, 'derived_key.bin')
+
+        found = scan_share_files(self.dirs + [os.path.join(original, 'missing')])
+        self.assertEqual({path: share_id for path, share_id, _ in found}, expected)
+
+    def test_seed_ids_skips_ids_on_disk(self):
+        self._touch(self.dirs[0], 'photo_42_20250101_120000_7.png')
+        store = ShareStore()
+        store.seed_ids(max(share_id for _, share_id, _ in scan_share_files(self.dirs)))
+        self.assertEqual(store.add(1, 42, {}), 8)
+        # 已分配过的ID不会因为较小的种子而回退
+        store.seed_ids(3)
+        self.assertEqual(store.add(1, 42, {}), 9)
+
+    def test_tracked_files(self):
+        store = ShareStore()
+        entry = {}
+        store.add(1, 42, entry)
+        path = os.path.join(self.dirs[0], 'photo_42_20250101_120000_1.png')
+        store.track_file(entry, path, 1)
+        self.assertEqual(store.tracked_files(), {os.path.normpath(path)})
+
+
+class TrimMemoryTest(unittest.TestCase):
+    def test_photo_bytes_kept_until_original_is_saved(self):
+        store = ShareStore(max_memory=0)
+        entry = {'photo_bytes': b'x' * 100, 'original_path': __file__}
+        store.add(1, 42, entry)
+        # 文件已存在但写入尚未完成
+        self.assertEqual(store.trim_memory(), 0)
+        self.assertIsNotNone(entry['photo_bytes'])
+
+        entry['original_saved'] = True
+        self.assertEqual(store.trim_memory(), 100)
+        self.assertIsNone(entry['photo_bytes'])
+
+    def test_busy_share_is_not_trimmed(self):
+        class Running:
+            def done(self):
+                return False
+
+        store = ShareStore(max_memory=0)
+        entry = {'photo_bytes': b'x' * 100, 'original_saved': True, 'renderer': Running()}
+        store.add(1, 42, entry)
+        self.assertEqual(store.trim_memory(), 0)
+
+
+class RemoveFilesTest(unittest.TestCase):
+    def test_hard_linked_file_frees_nothing(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            cached = os.path.join(tmp, 'cache.png')
+            linked = os.path.join(tmp, 'final.png')
+            single = os.path.join(tmp, 'photo.png')
+            for path in (cached, single):
+                with open(path, 'wb') as file:
+                    file.write(b'x' * 10)
+            os.link(cached, linked)
+            self.assertEqual(remove_files([linked, single, os.path.join(tmp, 'gone')]), (2, 10))
+            self.assertTrue(os.path.exists(cached))
+
+
+if __name__ == '__main__':
+    unittest.main()
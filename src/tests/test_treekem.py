@@ -0,0 +1,102 @@
+"""
+RatchetTree member bookkeeping and its memory per member.
+
+Run from src/:  python -m unittest discover tests
+"""
+import os
+import random
+import tracemalloc
+import unittest
+from cryptography.hazmat.primitives.asymmetric import x25519
+from utils.treekem import LeafIndex, RatchetTree
+
+
+def _public_keys(count):
+    return [os.urandom(32) for _ in range(count)]
+
+
+class LeafIndexTest(unittest.TestCase):
+    def test_matches_a_dict(self):
+        stored = {}  # leaf -> key
+        index = LeafIndex(stored.__getitem__)
+        model = {}  # key -> leaf
+        rng = random.Random(1)
+        for leaf in range(5000):
+            key = rng.randrange(300)
+            if key in model:
+                if rng.random() < 0.5:
+                    self.assertEqual(index.pop(key), model[key])
+                    del stored[model.pop(key)]
+            else:
+                stored[leaf] = key
+                index.add(key, leaf)
+                model[key] = leaf
+            self.assertEqual(index.get(key), model.get(key))
+            self.assertEqual(len(index), len(model))
+        for key in range(300):
+            self.assertEqual(index.get(key), model.get(key))
+        self.assertIsNone(index.pop(1000))
+
+
+class RatchetTreeMembersTest(unittest.TestCase):
+    def test_add_remove_find(self):
+        public_keys = _public_keys(40)
+        tree = RatchetTree(deferred=True)
+        for member_id, public_key in enumerate(public_keys):
+            tree.propose_add(public_key, member_id)
+        tree.commit()
+        self.assertEqual(tree.members(), public_keys)
+
+        for member_id in range(0, 40, 3):
+            tree.remove_member_by_id_TreeNode(member_id)
+        tree.commit()
+        remaining = [key for member_id, key in enumerate(public_keys) if member_id % 3]
+        self.assertEqual(tree.members(), remaining)
+        for member_id, public_key in enumerate(public_keys):
+            self.assertEqual(tree.find_member(member_id), public_key if member_id % 3 else None)
+
+        # 新成员优先填入被移除成员留下的最左空叶子
+        newcomer = _public_keys(1)[0]
+        self.assertEqual(tree.add_member(newcomer, member_id='new'), 2)
+        self.assertEqual(tree.find_member('new'), newcomer)
+        self.assertFalse(tree.remove_member(public_keys[0]))
+
+    def test_key_rotation(self):
+        old_key, new_key, other_key = _public_keys(3)
+        tree = RatchetTree(deferred=True)
+        tree.propose_add(old_key, 'a')
+        tree.propose_add(other_key, 'b')
+        tree.commit()
+        tree.propose_update(old_key, new_key)
+        tree.commit()
+        self.assertEqual(tree.find_member('a'), new_key)
+        self.assertFalse(tree.remove_member(old_key))
+        self.assertTrue(tree.remove_member(new_key))
+        self.assertIsNone(tree.find_member('a'))
+        self.assertEqual(tree.members(), [other_key])
+
+
+class RatchetTreeMemoryTest(unittest.TestCase):
+    MEMBERS = 2000
+
+    def test_bytes_per_member(self):
+        public_keys = [x25519.X25519PrivateKey.generate().public_key() for _ in range(self.MEMBERS)]
+        member_ids = [10 ** 12 + i for i in range(self.MEMBERS)]
+        tracemalloc.start()
+        try:
+            tree = RatchetTree(deferred=True)
+            for public_key, member_id in zip(public_keys, member_ids):
+                tree.propose_add(public_key, member_id)
+            tree.commit()
+            after_commit = tracemalloc.get_traced_memory()[0] / self.MEMBERS
+            tree.commit()
+            at_rest = tracemalloc.get_traced_memory()[0] / self.MEMBERS
+        finally:
+            tracemalloc.stop()
+        # RatchetTree 文档中记录的实测值: 静止时 93-170 字节/成员，提交后另加约 200 字节
+        self.assertLess(at_rest, 180)
+        self.assertLess(after_commit, at_rest + 240)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+import csv
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+KEY_FILE_MAGIC = b'CHK1'
+TRUE_VALUES = ('1', 'true', 'yes', 'y')
+
+
+def write_key_file(path, derived_key, lsb_length=None):
+    """写入派生密钥文件: 版本标记 + 32字节密钥 + 可选的4字节LSB长度"""
+    with open(path, "wb") as file:
+        file.write(KEY_FILE_MAGIC)
+        file.write(derived_key)
+        if lsb_length is not None:
+            file.write(lsb_length.to_bytes(4, byteorder='big'))
+    return path
+
+
+def read_key_file(path):
+    """读取派生密钥文件，返回 (derived_key, lsb_length或None)，兼容无版本标记的旧格式"""
+    with open(path, "rb") as file:
+        header = file.read(4)
+        if header == KEY_FILE_MAGIC:
+            derived_key = file.read(32)
+        else:
+            derived_key = header + file.read(28)
+        lsb_length_bytes = file.read(4)
+    lsb_length = int.from_bytes(lsb_length_bytes, byteorder='big') if lsb_length_bytes else None
+    return derived_key, lsb_length
+
+
+def as_bool(value):
+    """清单中的布尔字段: JSON 为 true/false，CSV 为 yes/no、1/0 等字符串"""
+    if isinstance(value, str):
+        return value.strip().lower() in TRUE_VALUES
+    return bool(value)
+
+
+def load_manifest(path):
+    """
+    读取批处理清单，返回字典列表:
+    - .json: 对象列表，或 {"items": [...]}
+    - .csv: 首行为列名，空单元格视为未设置
+    """
+    if path.lower().endswith('.csv'):
+        with open(path, newline='', encoding='utf-8') as file:
+            return [
+                {key: value for key, value in row.items() if value not in (None, '')}
+                for row in csv.DictReader(file)
+            ]
+    with open(path, encoding='utf-8') as file:
+        manifest = json.load(file)
+    if isinstance(manifest, dict):
+        manifest = manifest.get('items', [])
+    return list(manifest)
+
+
+def _run_item(worker, item, args):
+    # 在工作进程中执行单个条目，异常转为失败状态，不中断整个批次
+    start = time.perf_counter()
+    try:
+        result = worker(item, *args) or {}
+        result.setdefault('status', 'ok')
+    except Exception as e:
+        result = {'status': 'failed', 'error': f"{type(e).__name__}: {e}"}
+    result.setdefault('bytes', 0)
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+
+def run_batch(worker, items, args=(), workers=None, names=None):
+    """
+    用进程池并行处理 items，每完成一项打印进度，最后打印汇总。
+    worker(item, *args) 须为模块级函数，返回包含 bytes(已处理字节数) 等字段的字典。
+    返回与 items 顺序一致的结果列表。
+    """
+    names = names or [str(i) for i in range(len(items))]
+    results = [None] * len(items)
+    start = time.perf_counter()
+
+    if workers == 1:
+        # 单进程时直接执行，便于调试
+        for done, (i, item) in enumerate(enumerate(items), 1):
+            results[i] = _run_item(worker, item, args)
+            _print_progress(done, len(items), names[i], results[i])
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(_run_item, worker, item, args): i for i, item in enumerate(items)}
+            for done, future in enumerate(as_completed(futures), 1):
+                i = futures[future]
+                results[i] = future.result()
+                _print_progress(done, len(items), names[i], results[i])
+
+    print_summary(names, results, time.perf_counter() - start)
+    return results
+
+
+def _print_progress(done, total, name, result):
+    status = result['status'] if result['status'] == 'ok' else f"{result['status']} ({result.get('error', '')})"
+    print(f"[{done}/{total}] {name}: {status}, {result['seconds']:.2f}s")
+
+
+def print_summary(names, results, elapsed):
+    print(f"\n{'item':<40}{'status':>8}{'KiB':>10}{'s':>8}")
+    for name, result in zip(names, results):
+        print(f"{name[-40:]:<40}{result['status']:>8}{result['bytes'] / 1024:>10.1f}{result['seconds']:>8.2f}")
+        if result.get('detail') or result.get('error'):
+            print(f"    {result.get('detail') or result['error']}")
+
+    succeeded = sum(1 for result in results if result['status'] == 'ok')
+    total_bytes = sum(result['bytes'] for result in results)
+    elapsed = max(elapsed, 1e-9)
+    print(f"\n成功 {succeeded}/{len(results)}，耗时 {elapsed:.2f}s，"
+          f"吞吐量 {len(results) / elapsed:.2f} 项/s，{total_bytes / 1024 / 1024 / elapsed:.2f} MiB/s")
@@ -1,13 +1,38 @@
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives import padding
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.exceptions import InvalidTag
+import mmap
 import os
 import binascii
 import struct
+import itertools
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from utils import metrics
 
 # 常量定义
 CHUNK_SIZE = 1024  # 每个加密块的大小(字节)
 CRC_SIZE = 4  # CRC32校验和的大小
+IV_SIZE = 16  # AES-CBC初始向量的大小
+# 完整明文块加密后的大小: IV + PKCS7填充后的(CRC + 数据)
+ENCRYPTED_CHUNK_SIZE = IV_SIZE + ((CRC_SIZE + CHUNK_SIZE) // 16 + 1) * 16
+STREAM_BUFFER_SIZE = 64 * 1024  # 流式读取时每次从文件读取的字节数
+PARALLEL_BATCH_CHUNKS = 256  # 并行模式下每个任务处理的块数
+
+# 分帧AEAD容器格式: 头部 + 若干 [4字节长度 | AES-GCM密文+标签] 帧
+FRAME_MAGIC = b'SGMC'
+FRAME_VERSION = 1
+FRAME_CHUNK_SIZE = 64 * 1024  # 默认每帧明文大小
+FRAME_NONCE_PREFIX_SIZE = 7  # nonce = 7字节随机前缀 + 4字节帧计数 + 1字节末帧标记
+FRAME_TAG_SIZE = 16
+FRAME_HEADER = struct.Struct('>4sBBI7s')  # magic, version, flags, chunk_size, nonce_prefix
+FRAME_LENGTH = struct.Struct('>I')
+FRAME_FLAG_INDEX = 0x01  # 容器末尾带有帧偏移索引
+FRAME_INDEX_ENTRY = struct.Struct('>Q')  # 每帧长度前缀在文件中的偏移
+FRAME_TRAILER = struct.Struct('>QQI4s')  # index_offset, plaintext_length, frame_count, magic
+FRAME_INDEX_MAGIC = b'SGMI'
 
 def aes_encrypt(data, key, iv=None):
     """改进的AES-CBC加密函数，支持分块加密"""
@@ -54,50 +79,508 @@ def recover_decrypted_data(encrypted_data, decryptor):
     
     return bytes(recovered)
 
-def encrypt_chunked_data(data, key):
-    """分块加密数据，每块包含CRC校验"""
-    chunks = []
-    for i in range(0, len(data), CHUNK_SIZE):
-        chunk = data[i:i+CHUNK_SIZE]
-        crc = binascii.crc32(chunk).to_bytes(CRC_SIZE, 'big')
-        encrypted_chunk = aes_encrypt(crc + chunk, key)
-        chunks.append(encrypted_chunk)
-    return b''.join(chunks)
-
-def decrypt_chunked_data(encrypted_data, key):
-    """解密分块数据，验证CRC校验"""
-    iv_size = 16
-    min_chunk_size = iv_size + CRC_SIZE + 16  # IV + CRC + 最小加密数据
-    
+def encrypt_chunk(chunk, key):
+    """加密单个数据块，前置CRC校验"""
+    crc = binascii.crc32(chunk).to_bytes(CRC_SIZE, 'big')
+    return aes_encrypt(crc + chunk, key)
+
+def decrypt_chunk(encrypted_chunk, key, position=0):
+    """解密单个数据块并验证CRC，position仅用于日志"""
+    try:
+        decrypted = aes_decrypt(encrypted_chunk, key)
+        crc = int.from_bytes(decrypted[:CRC_SIZE], 'big')
+        data_chunk = decrypted[CRC_SIZE:]
+        
+        if binascii.crc32(data_chunk) != crc:
+            print(f"块CRC校验失败，位置{position}")
+        return data_chunk  # CRC失败时仍然使用，但标记为不可靠
+    except Exception as e:
+        print(f"解密块失败: {e}")
+        return b'[corrupted data]'
+
+# PKCS7 填充字节表，避免热循环中重复构造
+_PADDING = [bytes([n]) * n for n in range(17)]
+
+def _encrypted_size(length):
+    """length 字节明文按旧版分块格式加密后的总大小"""
+    full_chunks, rest = divmod(length, CHUNK_SIZE)
+    size = full_chunks * ENCRYPTED_CHUNK_SIZE
+    if rest:
+        size += IV_SIZE + ((CRC_SIZE + rest) // 16 + 1) * 16
+    return size
+
+def _encrypt_chunk_into(algorithm, chunk, out):
+    """
+    加密单块并直接写入 out (memoryview)，返回写入字节数。
+    格式与 encrypt_chunk 相同: IV + CBC(CRC + 数据 + PKCS7填充)；
+    update_into 要求 out 比写入量多出至少15字节的余量。
+    """
+    iv = os.urandom(IV_SIZE)
+    out[:IV_SIZE] = iv
+    encryptor = Cipher(algorithm, modes.CBC(iv)).encryptor()
+    pad = 16 - (CRC_SIZE + len(chunk)) % 16
+    written = IV_SIZE
+    written += encryptor.update_into(binascii.crc32(chunk).to_bytes(CRC_SIZE, 'big'), out[written:])
+    written += encryptor.update_into(chunk, out[written:])
+    written += encryptor.update_into(_PADDING[pad], out[written:])
+    encryptor.finalize()
+    return written
+
+def _decrypt_chunk_into(algorithm, chunk, scratch, key, position):
+    """
+    把单块解密到复用的 scratch 中并校验填充与CRC，返回指向明文的 memoryview。
+    填充或长度异常时退回 decrypt_chunk 的容错恢复路径。
+    """
+    encrypted = chunk[IV_SIZE:]
+    if len(encrypted) % 16 == 0:
+        decryptor = Cipher(algorithm, modes.CBC(chunk[:IV_SIZE])).decryptor()
+        length = decryptor.update_into(encrypted, scratch)
+        decryptor.finalize()
+        pad = scratch[length - 1]
+        if 1 <= pad <= 16 and length - pad >= CRC_SIZE and scratch[length - pad:length] == _PADDING[pad]:
+            data = scratch[CRC_SIZE:length - pad]
+            if binascii.crc32(data) != int.from_bytes(scratch[:CRC_SIZE], 'big'):
+                print(f"块CRC校验失败，位置{position}")
+            return data
+    return decrypt_chunk(bytes(chunk), key, position)
+
+def _encrypt_buffer(data, key, destination=None):
+    """
+    单线程零拷贝加密 bytes/bytearray/memoryview/mmap:
+    - 不给 destination 时直接写入一个预分配的 bytearray 并返回
+    - 给出 destination 时经由复用的暂存区逐块写入文件对象，返回写入字节数
+    """
+    algorithm = algorithms.AES(key)
+    with memoryview(data) as view:
+        if destination is None:
+            total = _encrypted_size(len(view))
+            out = bytearray(total + 16)
+            written = 0
+            with memoryview(out) as out_view:
+                for offset in range(0, len(view), CHUNK_SIZE):
+                    written += _encrypt_chunk_into(algorithm, view[offset:offset + CHUNK_SIZE], out_view[written:])
+            del out[total:]
+        else:
+            scratch = bytearray(ENCRYPTED_CHUNK_SIZE + 16)
+            written = 0
+            with memoryview(scratch) as scratch_view:
+                for offset in range(0, len(view), CHUNK_SIZE):
+                    length = _encrypt_chunk_into(algorithm, view[offset:offset + CHUNK_SIZE], scratch_view)
+                    destination.write(scratch_view[:length])
+                    written += length
+        metrics.inc("bytes_encrypted", len(view))
+    return out if destination is None else written
+
+def _decrypt_buffer(data, key, write):
+    """单线程零拷贝解密: 逐块解密到复用的暂存区后交给 write(明文视图)，返回明文字节数"""
+    algorithm = algorithms.AES(key)
+    scratch = bytearray(ENCRYPTED_CHUNK_SIZE + 16)
+    total = 0
+    with memoryview(data) as view, memoryview(scratch) as scratch_view:
+        for position in range(0, len(view), ENCRYPTED_CHUNK_SIZE):
+            chunk = view[position:position + ENCRYPTED_CHUNK_SIZE]
+            if len(chunk) < IV_SIZE + 16:
+                print(f"警告: 剩余数据不足一个完整块({len(chunk)}字节)")
+                break
+            plaintext = _decrypt_chunk_into(algorithm, chunk, scratch_view, key, position)
+            write(plaintext)
+            total += len(plaintext)
+    metrics.inc("bytes_decrypted", total)
+    return total
+
+def _decrypt_buffer_to_bytearray(data, key):
+    # 输出按完整块预分配；只有容错恢复产生更长的数据时才会扩容
+    out = bytearray(len(data) // ENCRYPTED_CHUNK_SIZE * CHUNK_SIZE + CHUNK_SIZE)
     position = 0
-    decrypted_parts = []
-    
-    while position < len(encrypted_data):
-        remaining = len(encrypted_data) - position
-        if remaining < min_chunk_size:
-            print(f"警告: 剩余数据不足一个完整块({remaining}字节)")
+
+    def write(plaintext):
+        nonlocal position
+        end = position + len(plaintext)
+        if end > len(out):
+            out.extend(bytes(end - len(out)))
+        out[position:end] = plaintext
+        position = end
+
+    _decrypt_buffer(data, key, write)
+    del out[position:]
+    return out
+
+def _iter_blocks(source, size):
+    """把字节串、文件对象或字节迭代器切分为固定大小的块(最后一块可能较短)"""
+    if isinstance(source, (bytes, bytearray, memoryview, mmap.mmap)):
+        for i in range(0, len(source), size):
+            yield source[i:i+size]
+        return
+
+    if hasattr(source, 'read'):
+        # 文件对象: 按缓冲区大小读取，避免逐块系统调用
+        reads = iter(lambda: source.read(max(size, STREAM_BUFFER_SIZE)), b'')
+    else:
+        reads = iter(source)
+
+    pending = bytearray()
+    for data in reads:
+        pending += data
+        offset = 0
+        while len(pending) - offset >= size:
+            yield bytes(pending[offset:offset+size])
+            offset += size
+        del pending[:offset]
+    if pending:
+        yield bytes(pending)
+
+def _count_bytes(blocks, counter):
+    """透传数据块并在结束时累加字节计数；仅在启用监控时套用"""
+    total = 0
+    for block in blocks:
+        total += len(block)
+        yield block
+    metrics.inc(counter, total)
+
+def _encrypt_batch(chunks, key):
+    return [encrypt_chunk(chunk, key) for chunk in chunks]
+
+def _decrypt_batch(chunks, key, position):
+    decrypted = []
+    for chunk in chunks:
+        decrypted.append(decrypt_chunk(chunk, key, position))
+        position += len(chunk)
+    return decrypted
+
+def _iter_parallel(tasks, workers, executor):
+    """按提交顺序产出并行任务的结果，同时在途的任务数不超过 2 * workers"""
+    pool_class = ProcessPoolExecutor if executor == 'process' else ThreadPoolExecutor
+    with pool_class(max_workers=workers) as pool:
+        in_flight = deque()
+        for fn, args in tasks:
+            in_flight.append(pool.submit(fn, *args))
+            if len(in_flight) >= 2 * workers:
+                yield from in_flight.popleft().result()
+        while in_flight:
+            yield from in_flight.popleft().result()
+
+def _batched(iterable, batch_size):
+    iterator = iter(iterable)
+    while batch := list(itertools.islice(iterator, batch_size)):
+        yield batch
+
+def iter_encrypt_chunks(source, key, workers=None, batch_size=PARALLEL_BATCH_CHUNKS, executor='process'):
+    """
+    流式分块加密，逐块产出加密结果，内存占用与输入大小无关。
+    workers > 1 时按 batch_size 块一批分发到进程池(executor='process')或线程池(executor='thread')，
+    输出顺序与格式与串行模式完全一致。每块1KiB时Python层开销占主导，进程池扩展性更好。
+    """
+    chunks = _iter_blocks(source, CHUNK_SIZE)
+    if metrics.registry.enabled:
+        chunks = _count_bytes(chunks, "bytes_encrypted")
+    if not workers or workers <= 1:
+        for chunk in chunks:
+            yield encrypt_chunk(chunk, key)
+        return
+
+    tasks = ((_encrypt_batch, (batch, key)) for batch in _batched(chunks, batch_size))
+    yield from _iter_parallel(tasks, workers, executor)
+
+def iter_decrypt_chunks(source, key, workers=None, batch_size=PARALLEL_BATCH_CHUNKS, executor='process'):
+    """流式分块解密，逐块产出明文；并行参数与 iter_encrypt_chunks 相同"""
+    min_chunk_size = IV_SIZE + 16  # IV + 至少一个加密块
+
+    def complete_chunks():
+        for chunk in _iter_blocks(source, ENCRYPTED_CHUNK_SIZE):
+            if len(chunk) < min_chunk_size:
+                print(f"警告: 剩余数据不足一个完整块({len(chunk)}字节)")
+                return
+            yield chunk
+
+    def plaintext_chunks():
+        if not workers or workers <= 1:
+            position = 0
+            for chunk in complete_chunks():
+                yield decrypt_chunk(chunk, key, position)
+                position += len(chunk)
+            return
+
+        def tasks():
+            position = 0
+            for batch in _batched(complete_chunks(), batch_size):
+                yield _decrypt_batch, (batch, key, position)
+                position += sum(len(chunk) for chunk in batch)
+
+        yield from _iter_parallel(tasks(), workers, executor)
+
+    if metrics.registry.enabled:
+        yield from _count_bytes(plaintext_chunks(), "bytes_decrypted")
+    else:
+        yield from plaintext_chunks()
+
+@metrics.timed("encrypt_stream")
+def encrypt_stream(source, destination, key, workers=None, executor='process'):
+    """从source读取明文，加密后写入destination文件对象，返回写入的字节数"""
+    written = 0
+    for encrypted_chunk in iter_encrypt_chunks(source, key, workers, executor=executor):
+        destination.write(encrypted_chunk)
+        written += len(encrypted_chunk)
+    return written
+
+@metrics.timed("decrypt_stream")
+def decrypt_stream(source, destination, key, workers=None, executor='process'):
+    """从source读取密文(分帧容器或旧版格式)，解密后写入destination文件对象，返回写入的字节数"""
+    reader = _as_reader(source)
+    head = reader.read(FRAME_HEADER.size)
+    if is_framed(head):
+        chunks = _iter_decrypt_frames(reader, key, head)
+    else:
+        # 旧版格式: 把已读取的头部放回数据流
+        rest = iter(lambda: reader.read(STREAM_BUFFER_SIZE), b'')
+        chunks = iter_decrypt_chunks(itertools.chain([head], rest), key, workers, executor=executor)
+    written = 0
+    for data_chunk in chunks:
+        destination.write(data_chunk)
+        written += len(data_chunk)
+    return written
+
+def _map_file(file):
+    """只读映射整个文件；空文件无法映射，返回 None"""
+    if os.fstat(file.fileno()).st_size == 0:
+        return None
+    return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+@metrics.timed("encrypt_file")
+def encrypt_file(input_path, output_path, key, workers=None, executor='process'):
+    """文件到文件的流式加密；单线程时 mmap 输入，逐块写出，不复制整个文件"""
+    with open(input_path, "rb") as source, open(output_path, "wb") as destination:
+        mapped = None if workers and workers > 1 else _map_file(source)
+        if mapped is None:
+            return encrypt_stream(source, destination, key, workers, executor)
+        with mapped:
+            return _encrypt_buffer(mapped, key, destination)
+
+@metrics.timed("decrypt_file")
+def decrypt_file(input_path, output_path, key, workers=None, executor='process'):
+    """文件到文件的流式解密；mmap 输入，分帧容器与单线程旧版格式均不复制密文"""
+    with open(input_path, "rb") as source, open(output_path, "wb") as destination:
+        mapped = _map_file(source)
+        if mapped is None:
+            return decrypt_stream(source, destination, key, workers, executor)
+        with mapped:
+            if is_framed(mapped[:FRAME_HEADER.size]) or (workers and workers > 1):
+                return decrypt_stream(mapped, destination, key, workers, executor)
+            return _decrypt_buffer(mapped, key, destination.write)
+
+@metrics.timed("encrypt_chunked_data")
+def encrypt_chunked_data(data, key, workers=None, batch_size=PARALLEL_BATCH_CHUNKS, executor='process'):
+    """
+    分块加密数据，每块包含CRC校验；workers > 1 时多核并行。
+    单线程时直接写入预分配的 bytearray 并返回它(而不是拼接后的 bytes)。
+    """
+    if (not workers or workers <= 1) and isinstance(data, (bytes, bytearray, memoryview, mmap.mmap)):
+        return _encrypt_buffer(data, key)
+    return b''.join(iter_encrypt_chunks(data, key, workers, batch_size, executor))
+
+@metrics.timed("decrypt_chunked_data")
+def decrypt_chunked_data(encrypted_data, key, workers=None, batch_size=PARALLEL_BATCH_CHUNKS, executor='process'):
+    """
+    解密分块数据，验证CRC校验；workers > 1 时多核并行。
+    单线程时逐块解密进预分配的 bytearray 并返回它。
+    """
+    if (not workers or workers <= 1) and isinstance(encrypted_data, (bytes, bytearray, memoryview, mmap.mmap)):
+        return _decrypt_buffer_to_bytearray(encrypted_data, key)
+    return b''.join(iter_decrypt_chunks(encrypted_data, key, workers, batch_size, executor))
+
+def _frame_nonce(nonce_prefix, counter, last):
+    return nonce_prefix + counter.to_bytes(4, 'big') + (b'\x01' if last else b'\x00')
+
+def iter_encrypt_frames(source, key, chunk_size=FRAME_CHUNK_SIZE, index=True):
+    """
+    分帧AEAD加密: 先产出容器头部，再逐帧产出 长度前缀 + AES-GCM密文。
+    整个容器只做一次密钥扩展；每帧nonce由随机前缀与帧计数派生，
+    末帧标记写入nonce，截断或重排的密文都无法通过认证。
+    index=True 时在末帧之后追加帧偏移索引与尾部，供 decrypt_range 随机访问。
+    """
+    if not 0 < chunk_size < 2 ** 32 - FRAME_TAG_SIZE:
+        raise ValueError(f"Invalid frame chunk size: {chunk_size}")
+    aead = AESGCM(key)
+    nonce_prefix = os.urandom(FRAME_NONCE_PREFIX_SIZE)
+    flags = FRAME_FLAG_INDEX if index else 0
+    header = FRAME_HEADER.pack(FRAME_MAGIC, FRAME_VERSION, flags, chunk_size, nonce_prefix)
+    yield header
+    offsets = []
+    offset = len(header)
+    plaintext_length = 0
+
+    # 预读一块以判断当前块是否为末帧；空输入也产出一个空的末帧
+    chunks = _iter_blocks(source, chunk_size)
+    chunk = next(chunks, b'')
+    counter = 0
+    while True:
+        next_chunk = next(chunks, None)
+        last = next_chunk is None
+        encrypted = aead.encrypt(_frame_nonce(nonce_prefix, counter, last), chunk, header)
+        frame = FRAME_LENGTH.pack(len(encrypted)) + encrypted
+        yield frame
+        offsets.append(offset)
+        offset += len(frame)
+        plaintext_length += len(chunk)
+        if last:
             break
-            
-        iv = encrypted_data[position:position+iv_size]
-        chunk_size = min(CHUNK_SIZE + CRC_SIZE + iv_size, len(encrypted_data) - position)
-        chunk = encrypted_data[position:position+chunk_size]
-        position += chunk_size
-        
+        chunk = next_chunk
+        counter += 1
+
+    metrics.inc("bytes_encrypted", plaintext_length)
+    if index:
+        entries = b''.join(FRAME_INDEX_ENTRY.pack(frame_offset) for frame_offset in offsets)
+        yield entries + FRAME_TRAILER.pack(offset, plaintext_length, len(offsets), FRAME_INDEX_MAGIC)
+
+class _BufferReader:
+    """在 bytes/mmap 上按需切出 memoryview 的只读 reader，read() 不复制数据"""
+
+    def __init__(self, buffer):
+        self.view = memoryview(buffer)
+        self.position = 0
+
+    def read(self, size=-1):
+        end = len(self.view) if size < 0 else min(self.position + size, len(self.view))
+        data = self.view[self.position:end]
+        self.position = end
+        return data
+
+def _as_reader(source):
+    if isinstance(source, (bytes, bytearray, memoryview, mmap.mmap)):
+        return _BufferReader(source)
+    return source
+
+def _read_exact(reader, size):
+    data = reader.read(size)
+    if len(data) != size:
+        raise ValueError("Truncated framed ciphertext")
+    return data
+
+def _iter_decrypt_frames(reader, key, header):
+    magic, version, _, chunk_size, nonce_prefix = FRAME_HEADER.unpack(header)
+    if magic != FRAME_MAGIC or version != FRAME_VERSION:
+        raise ValueError("Not a framed ciphertext")
+    aead = AESGCM(key)
+    counter = 0
+    while True:
+        length = FRAME_LENGTH.unpack(_read_exact(reader, FRAME_LENGTH.size))[0]
+        if length > chunk_size + FRAME_TAG_SIZE:
+            raise ValueError(f"Frame {counter} exceeds the declared chunk size")
+        encrypted = _read_exact(reader, length)
+        # 先按非末帧尝试，失败再按末帧尝试；两者都失败说明密文被篡改
+        for last in (False, True):
+            try:
+                plaintext = aead.decrypt(_frame_nonce(nonce_prefix, counter, last), encrypted, header)
+            except InvalidTag:
+                continue
+            metrics.inc("bytes_decrypted", len(plaintext))
+            yield plaintext
+            break
+        else:
+            raise ValueError(f"Frame {counter} failed authentication")
+        if last:
+            return
+        counter += 1
+
+def iter_decrypt_frames(source, key):
+    """逐帧解密分帧容器并产出明文；认证失败或被截断时抛出ValueError"""
+    reader = _as_reader(source)
+    yield from _iter_decrypt_frames(reader, key, _read_exact(reader, FRAME_HEADER.size))
+
+def is_framed(data):
+    """判断密文是否为分帧容器格式"""
+    return len(data) >= FRAME_HEADER.size and data[:4] == FRAME_MAGIC and data[4] == FRAME_VERSION
+
+@metrics.timed("encrypt_framed_data")
+def encrypt_framed_data(data, key, chunk_size=FRAME_CHUNK_SIZE, index=True):
+    """使用分帧AEAD容器加密数据"""
+    return b''.join(iter_encrypt_frames(data, key, chunk_size, index))
+
+@metrics.timed("decrypt_framed_data")
+def decrypt_framed_data(encrypted_data, key):
+    return b''.join(iter_decrypt_frames(encrypted_data, key))
+
+@metrics.timed("encrypt_framed_stream")
+def encrypt_framed_stream(source, destination, key, chunk_size=FRAME_CHUNK_SIZE, index=True):
+    """流式分帧加密，返回写入的字节数"""
+    written = 0
+    for frame in iter_encrypt_frames(source, key, chunk_size, index):
+        destination.write(frame)
+        written += len(frame)
+    return written
+
+@metrics.timed("encrypt_framed_file")
+def encrypt_framed_file(input_path, output_path, key, chunk_size=FRAME_CHUNK_SIZE, index=True):
+    """文件到文件的流式分帧加密"""
+    with open(input_path, "rb") as source, open(output_path, "wb") as destination:
+        return encrypt_framed_stream(source, destination, key, chunk_size, index)
+
+def _decrypt_range(buffer, start, length, key):
+    header = bytes(buffer[:FRAME_HEADER.size])
+    if not is_framed(header):
+        raise ValueError("Not a framed ciphertext")
+    _, _, flags, chunk_size, nonce_prefix = FRAME_HEADER.unpack(header)
+    if not flags & FRAME_FLAG_INDEX:
+        raise ValueError("Framed ciphertext has no chunk index")
+    if chunk_size == 0 or len(buffer) < FRAME_HEADER.size + FRAME_TRAILER.size:
+        raise ValueError("Corrupted chunk index")
+
+    # 尾部不受认证保护，其中各字段须彼此一致，并在解密时与实际帧长度核对
+    index_offset, plaintext_length, frame_count, magic = FRAME_TRAILER.unpack_from(
+        buffer, len(buffer) - FRAME_TRAILER.size)
+    if magic != FRAME_INDEX_MAGIC or index_offset < FRAME_HEADER.size or \
+            index_offset + frame_count * FRAME_INDEX_ENTRY.size + FRAME_TRAILER.size != len(buffer) or \
+            frame_count != max(1, -(-plaintext_length // chunk_size)):
+        raise ValueError("Corrupted chunk index")
+
+    end = min(start + length, plaintext_length)
+    if start < 0 or length < 0:
+        raise ValueError("Range start and length must be non-negative")
+    if start >= end:
+        return b''
+
+    # 只解密覆盖 [start, end) 的帧
+    aead = AESGCM(key)
+    first_frame = start // chunk_size
+    last_frame = (end - 1) // chunk_size
+    plaintext = bytearray()
+    for counter in range(first_frame, last_frame + 1):
+        offset = FRAME_INDEX_ENTRY.unpack_from(buffer, index_offset + counter * FRAME_INDEX_ENTRY.size)[0]
+        if not FRAME_HEADER.size <= offset <= index_offset - FRAME_LENGTH.size:
+            raise ValueError(f"Frame {counter} offset is outside the container")
+        frame_length = FRAME_LENGTH.unpack_from(buffer, offset)[0]
+        if offset + FRAME_LENGTH.size + frame_length > index_offset:
+            raise ValueError(f"Frame {counter} is truncated")
+        encrypted = buffer[offset + FRAME_LENGTH.size:offset + FRAME_LENGTH.size + frame_length]
+        nonce = _frame_nonce(nonce_prefix, counter, counter == frame_count - 1)
         try:
-            decrypted = aes_decrypt(chunk, key)
-            crc = int.from_bytes(decrypted[:CRC_SIZE], 'big')
-            data_chunk = decrypted[CRC_SIZE:]
-            
-            if binascii.crc32(data_chunk) == crc:
-                decrypted_parts.append(data_chunk)
-            else:
-                print(f"块CRC校验失败，位置{position-chunk_size}")
-                decrypted_parts.append(data_chunk)  # 仍然使用，但标记为不可靠
-        except Exception as e:
-            print(f"解密块失败: {e}")
-            decrypted_parts.append(b'[corrupted data]')
-    
-    return b''.join(decrypted_parts)
+            frame = aead.decrypt(nonce, encrypted, header)
+        except InvalidTag:
+            raise ValueError(f"Frame {counter} failed authentication") from None
+        if len(frame) != min(chunk_size, plaintext_length - counter * chunk_size):
+            raise ValueError(f"Frame {counter} length does not match the chunk index")
+        plaintext += frame
+
+    skip = start - first_frame * chunk_size
+    metrics.inc("bytes_decrypted", end - start)
+    return bytes(plaintext[skip:skip + end - start])
+
+@metrics.timed("decrypt_range")
+def decrypt_range(path, start, length, key):
+    """
+    从带索引的分帧容器文件中解密明文区间 [start, start + length)。
+    通过mmap只读取所需帧，耗时与区间长度成正比而与文件大小无关。
+    """
+    with open(path, "rb") as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            raise ValueError("Not a framed ciphertext")
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            return _decrypt_range(buffer, start, length, key)
+
+def decrypt_data(encrypted_data, key):
+    """自动识别分帧容器或旧版CBC分块格式并解密"""
+    if is_framed(encrypted_data):
+        return decrypt_framed_data(encrypted_data, key)
+    return decrypt_chunked_data(encrypted_data, key)
 
 def encrypt_watermark(watermark, key):
     """加密水印数据，带CRC校验"""
@@ -119,21 +602,20 @@ def decrypt_watermark(encrypted_watermark, derived_key):
     return watermark
 
 def encrypt_long_message(message, derived_key):
-    """加密长文本消息，使用分块和CRC校验"""
+    """加密长文本消息，使用分帧AEAD容器"""
     message_bytes = message.encode('utf-8')
-    return encrypt_chunked_data(message_bytes, derived_key)
+    return encrypt_framed_data(message_bytes, derived_key)
 
 def decrypt_message(encrypted_data, derived_key):
-    """解密长文本消息，带错误恢复"""
-    decrypted = decrypt_chunked_data(encrypted_data, derived_key)
+    """解密长文本消息，兼容旧版分块格式"""
+    decrypted = decrypt_data(encrypted_data, derived_key)
     return decrypted.decode('utf-8', errors='replace')
 
 def encrypt_photo(photo_path, derived_key):
-    """加密照片，使用分块和CRC校验"""
+    """加密照片，使用分帧AEAD容器"""
     with open(photo_path, "rb") as photo_file:
-        photo_data = photo_file.read()
-    return encrypt_chunked_data(photo_data, derived_key)
+        return encrypt_framed_data(photo_file, derived_key)
 
 def decrypt_photo(encrypted_data, derived_key):
-    """解密照片，带错误恢复"""
-    return decrypt_chunked_data(encrypted_data, derived_key)
\ No newline at end of file
+    """解密照片，兼容旧版分块格式"""
+    return decrypt_data(encrypted_data, derived_key)
\ No newline at end of file
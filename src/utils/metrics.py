@@ -0,0 +1,215 @@
+import os
+import time
+import bisect
+import inspect
+import functools
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+METRIC_PREFIX = "sgm"
+# 秒；覆盖从单次密钥交换到大图 DCT 的范围
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Registry:
+    """
+    Process-wide latency histograms (per stage) and counters:
+    - Disabled by default; every recording call is then a single flag check
+    - Enable with enable() or METRICS_ENABLED=1
+    - render() produces the Prometheus text exposition format
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self._histograms = {}  # {stage: [各桶计数..., +Inf 计数, 总和]}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage, seconds):
+        if not self.enabled:
+            return
+        with self._lock:
+            histogram = self._histograms.get(stage)
+            if histogram is None:
+                histogram = self._histograms[stage] = [0] * (len(LATENCY_BUCKETS) + 1) + [0.0]
+            histogram[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+            histogram[-1] += seconds
+
+    def inc(self, name, amount=1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+    def snapshot(self):
+        """Picklable copy of all values, e.g. to ship from a worker process"""
+        with self._lock:
+            return (
+                {stage: list(values) for stage, values in self._histograms.items()},
+                dict(self._counters),
+            )
+
+    def merge(self, snapshot):
+        """Add a snapshot taken in another process into this registry"""
+        histograms, counters = snapshot
+        with self._lock:
+            for stage, values in histograms.items():
+                histogram = self._histograms.setdefault(stage, [0] * (len(LATENCY_BUCKETS) + 1) + [0.0])
+                for i, value in enumerate(values):
+                    histogram[i] += value
+            for name, value in counters.items():
+                self._counters[name] = self._counters.get(name, 0) + value
+
+    def render(self):
+        histograms, counters = self.snapshot()
+        lines = []
+        if histograms:
+            name = f"{METRIC_PREFIX}_stage_seconds"
+            lines.append(f"# HELP {name} Latency of instrumented stages.")
+            lines.append(f"# TYPE {name} histogram")
+            for stage in sorted(histograms):
+                values = histograms[stage]
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS + ("+Inf",), values[:-1]):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                lines.append(f'{name}_sum{{stage="{stage}"}} {values[-1]}')
+                lines.append(f'{name}_count{{stage="{stage}"}} {cumulative}')
+        for counter in sorted(counters):
+            name = f"{METRIC_PREFIX}_{counter}_total"
+            lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name} {counters[counter]}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry(enabled=os.getenv("METRICS_ENABLED") == "1")
+
+
+def enable():
+    registry.enabled = True
+
+
+def disable():
+    registry.enabled = False
+
+
+def inc(name, amount=1):
+    """Increase a counter, e.g. inc("bytes_encrypted", len(data))"""
+    if registry.enabled:
+        registry.inc(name, amount)
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ("stage", "start")
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        registry.observe(self.stage, time.perf_counter() - self.start)
+        return False
+
+
+def span(stage):
+    """Time a block: with span("dct_embed"): ...  (a shared no-op object when disabled)"""
+    return _Span(stage) if registry.enabled else _NULL_SPAN
+
+
+def timed(stage):
+    """Decorator form of span(); costs one flag check per call when disabled"""
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                if not registry.enabled:
+                    return await fn(*args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    return await fn(*args, **kwargs)
+                finally:
+                    registry.observe(stage, time.perf_counter() - start)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not registry.enabled:
+                return fn(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                registry.observe(stage, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+def call_collecting(fn, args, kwargs):
+    """Run fn in a worker process and return (result, metrics recorded by this call)"""
+    registry.enabled = True
+    registry.reset()
+    result = fn(*args, **kwargs)
+    return result, registry.snapshot()
+
+
+def write_textfile(path):
+    """Write the current metrics atomically, for node_exporter's textfile collector"""
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        f.write(registry.render())
+    os.replace(temp_path, path)
+    return path
+
+
+def start_textfile_writer(path, interval=15.0):
+    """Rewrite path every interval seconds from a daemon thread"""
+    def loop():
+        while True:
+            time.sleep(interval)
+            try:
+                write_textfile(path)
+            except OSError as e:
+                print(f"写入监控指标失败: {e}")
+
+    thread = threading.Thread(target=loop, name="metrics-textfile", daemon=True)
+    thread.start()
+    return thread
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_http_server(port, address="127.0.0.1"):
+    """Serve the metrics at http://address:port/ from a daemon thread"""
+    server = ThreadingHTTPServer((address, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
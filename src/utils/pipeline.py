@@ -0,0 +1,84 @@
+import os
+import cv2
+import numpy as np
+from utils import metrics
+from utils.watermark import (
+    dct_watermark_array,
+    dct_watermark_blocks_array,
+    qim_watermark_array,
+    encode_lsb_array,
+    decode_image_bytes,
+    read_image_pillow,
+    encode_image_bytes,
+)
+
+
+class WatermarkPipeline:
+    """Decode once, apply the DCT (keyed blind QIM with blind_key) and LSB watermarks, encode once"""
+
+    def __init__(self, watermark_path=None, alpha=0.1, lsb_payload=None,
+                 block_size=None, debug_paths=None, blind_key=None):
+        self.watermark_path = watermark_path
+        self.alpha = alpha
+        self.lsb_payload = lsb_payload
+        self.block_size = block_size
+        self.debug_paths = debug_paths or {}
+        self.blind_key = blind_key
+
+    def load(self, image):
+        """Decode the input into a BGR array (arrays are used as-is)"""
+        if isinstance(image, np.ndarray):
+            return image
+        if isinstance(image, (bytes, bytearray, memoryview)):
+            return decode_image_bytes(image)
+        pixels = cv2.imread(image)
+        if pixels is None:
+            pixels = read_image_pillow(image)
+        if pixels is None:
+            raise FileNotFoundError(f"Could not load image from {image}")
+        return pixels
+
+    def apply_dct(self, image):
+        """DCT stage only: the shared base image before any per-recipient payload"""
+        pixels = self.load(image)
+        if self.watermark_path:
+            if self.blind_key:
+                pixels = qim_watermark_array(pixels, self.watermark_path, self.blind_key)
+            elif self.block_size:
+                pixels = dct_watermark_blocks_array(pixels, self.watermark_path, self.alpha, self.block_size)
+            else:
+                pixels = dct_watermark_array(pixels, self.watermark_path, self.alpha)
+            self._write_debug('dct', pixels)
+        return pixels
+
+    def apply_lsb(self, pixels, inplace=False):
+        """LSB stage only; without inplace the input array is left untouched"""
+        if self.lsb_payload:
+            pixels = encode_lsb_array(pixels, self.lsb_payload, bgr=True, inplace=inplace)
+            self._write_debug('lsb', pixels)
+        return pixels
+
+    def run(self, image):
+        """Apply the configured watermarks and return the watermarked BGR array"""
+        pixels = self.apply_dct(image)
+        # DCT 阶段已产生新数组，可直接原地写入；否则复制，避免修改调用者的数据
+        return self.apply_lsb(pixels, inplace=bool(self.watermark_path))
+
+    def to_file(self, image, output_path):
+        """Run the pipeline and encode the result to output_path once"""
+        pixels = self.run(image)
+        with metrics.span("png_encode"):
+            written = cv2.imwrite(output_path, pixels)
+        if not written:
+            raise ValueError(f"Could not write image to {output_path}")
+        return output_path
+
+    def to_bytes(self, image, ext='.png'):
+        """Run the pipeline and return the encoded image bytes"""
+        return encode_image_bytes(self.run(image), ext)
+
+    def _write_debug(self, stage, pixels):
+        path = self.debug_paths.get(stage)
+        if path:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            cv2.imwrite(path, pixels)
@@ -2,12 +2,283 @@ from cryptography.hazmat.primitives.asymmetric import x25519
 from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+import heapq
 import os
+from array import array
+from utils import metrics
+
+class LeafStore:
+    """
+    Compact member leaves for TreeNode:
+    - Raw 32-byte public keys packed back to back in one bytearray
+    - Hash indexes from public key bytes and member ID to leaf position
+    - Removal swaps the last leaf into the hole, so every operation is O(1)
+    """
+    __slots__ = ('_keys', '_member_ids', '_by_key', '_by_member')
+
+    KEY_SIZE = 32
 
-class TreeNode:
     def __init__(self):
-        self.children = []
+        self._keys = bytearray()
+        self._member_ids = []
+        self._by_key = {}
+        self._by_member = {}
+
+    def __len__(self):
+        return len(self._member_ids)
+
+    def __iter__(self):
+        for position in range(len(self)):
+            yield self.public_key_at(position)
+
+    def __contains__(self, public_bytes):
+        return public_bytes in self._by_key
+
+    def public_key_at(self, position):
+        offset = position * self.KEY_SIZE
+        return bytes(self._keys[offset:offset + self.KEY_SIZE])
+
+    def position(self, public_bytes):
+        return self._by_key.get(public_bytes)
+
+    def position_of_member(self, member_id):
+        return self._by_member.get(member_id)
+
+    def add(self, public_bytes, member_id=None):
+        """Store a leaf and return its position (existing keys are not duplicated)"""
+        if len(public_bytes) != self.KEY_SIZE:
+            raise ValueError("Public key must be 32 raw bytes")
+        position = self._by_key.get(public_bytes)
+        if position is not None:
+            return position
+        position = len(self)
+        self._keys += public_bytes
+        self._member_ids.append(member_id)
+        self._by_key[public_bytes] = position
+        if member_id is not None:
+            self._by_member[member_id] = position
+        return position
+
+    def remove_at(self, position):
+        last = len(self) - 1
+        public_bytes = self.public_key_at(position)
+        member_id = self._member_ids[position]
+        if position != last:
+            # 用最后一个叶子填补空位，保持存储紧凑
+            last_bytes = self.public_key_at(last)
+            last_member_id = self._member_ids[last]
+            offset = position * self.KEY_SIZE
+            self._keys[offset:offset + self.KEY_SIZE] = last_bytes
+            self._member_ids[position] = last_member_id
+            self._by_key[last_bytes] = position
+            if last_member_id is not None:
+                self._by_member[last_member_id] = position
+        del self._keys[last * self.KEY_SIZE:]
+        self._member_ids.pop()
+        del self._by_key[public_bytes]
+        if member_id is not None:
+            del self._by_member[member_id]
+
+    def remove(self, public_bytes):
+        position = self._by_key.get(public_bytes)
+        if position is None:
+            return False
+        self.remove_at(position)
+        return True
+
+    def remove_member(self, member_id):
+        position = self._by_member.get(member_id)
+        if position is None:
+            return False
+        self.remove_at(position)
+        return True
+
+
+class NodeKeys:
+    """
+    Packed 32-byte keys for RatchetTree, indexed by slot:
+    - Keys sit back to back in one bytearray with a one-byte presence flag
+      per slot, so a slot costs 33 bytes instead of a bytes object
+    - Empty slots read as None; clearing a slot also zeroes its bytes
+    """
+    __slots__ = ('_keys', '_present')
+
+    KEY_SIZE = 32
+
+    def __init__(self, count=0):
+        self._keys = bytearray(count * self.KEY_SIZE)
+        self._present = bytearray(count)
+
+    def __len__(self):
+        return len(self._present)
+
+    def __getitem__(self, slot):
+        if not self._present[slot]:
+            return None
+        offset = slot * self.KEY_SIZE
+        return bytes(self._keys[offset:offset + self.KEY_SIZE])
+
+    def __setitem__(self, slot, key):
+        offset = slot * self.KEY_SIZE
+        if key is None:
+            self._keys[offset:offset + self.KEY_SIZE] = bytes(self.KEY_SIZE)
+            self._present[slot] = 0
+            return
+        if len(key) != self.KEY_SIZE:
+            raise ValueError("Key must be 32 raw bytes")
+        self._keys[offset:offset + self.KEY_SIZE] = key
+        self._present[slot] = 1
+
+    def extend(self, count):
+        """Append count empty slots"""
+        self._keys.extend(bytes(count * self.KEY_SIZE))
+        self._present.extend(bytes(count))
+
+
+class LeafIndex:
+    """
+    Hash index from keys to RatchetTree leaf nodes without per-entry objects:
+    - Open addressing with linear probing over an array of leaf node indices
+    - Keys are not stored; a candidate leaf is confirmed through key_at(leaf)
+    - The table is kept at most two-thirds full, so lookups stay O(1)
+    - Slot positions come from this process's hash(), so the index is not
+      meant to be pickled
+    """
+    __slots__ = ('_key_at', '_slots', '_used', '_count')
+
+    EMPTY = -1
+    DELETED = -2
+
+    def __init__(self, key_at):
+        self._key_at = key_at
+        self._slots = array('i', [self.EMPTY]) * 8
+        self._used = 0  # 已占用与已删除的槽位数
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def _probe(self, key):
+        mask = len(self._slots) - 1
+        slot = hash(key) & mask
+        while True:
+            yield slot
+            slot = (slot + 1) & mask
+
+    def get(self, key):
+        for slot in self._probe(key):
+            leaf = self._slots[slot]
+            if leaf == self.EMPTY:
+                return None
+            if leaf != self.DELETED and self._key_at(leaf) == key:
+                return leaf
+
+    def add(self, key, leaf):
+        """Index leaf under key; the caller ensures key is not indexed yet and key_at(leaf) == key"""
+        if (self._used + 1) * 3 > len(self._slots) * 2:
+            self._rebuild()
+        for slot in self._probe(key):
+            if self._slots[slot] < 0:
+                if self._slots[slot] == self.EMPTY:
+                    self._used += 1
+                self._slots[slot] = leaf
+                self._count += 1
+                return
+
+    def pop(self, key):
+        """Remove key and return its leaf, or None; call before key_at(leaf) changes"""
+        for slot in self._probe(key):
+            leaf = self._slots[slot]
+            if leaf == self.EMPTY:
+                return None
+            if leaf != self.DELETED and self._key_at(leaf) == key:
+                self._slots[slot] = self.DELETED
+                self._count -= 1
+                return leaf
+
+    def _rebuild(self):
+        # 按需扩容并清除删除标记，重建后负载不超过 1/2
+        leaves = [leaf for leaf in self._slots if leaf >= 0]
+        size = 8
+        while size < 2 * (len(leaves) + 1):
+            size *= 2
+        self._slots = array('i', [self.EMPTY]) * size
+        self._used = 0
+        self._count = 0
+        for leaf in leaves:
+            self.add(self._key_at(leaf), leaf)
+
+
+class UpdatePath:
+    """
+    Encrypted path secrets produced by one RatchetTree commit, packed into
+    one bytearray:
+    - Each entry holds the node index, its new public key, the ephemeral
+      public key and a (recipient node, ciphertext) pair per recipient
+    - Iterating yields the entries as dicts; the context is rebuilt from the
+      node index and the commit's epoch instead of being stored
+    """
+    __slots__ = ('epoch', '_records', '_count')
+
+    INDEX_SIZE = 8
+    KEY_SIZE = 32
+    CIPHERTEXT_SIZE = 48  # 32 字节路径密钥 + 16 字节 GCM 标签
+
+    def __init__(self, epoch=0):
+        self.epoch = epoch
+        self._records = bytearray()
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def context(self, node):
+        return node.to_bytes(self.INDEX_SIZE, 'big') + self.epoch.to_bytes(8, 'big')
+
+    def append(self, node, public_key, ephemeral_public_key, ciphertexts):
+        self._records += node.to_bytes(self.INDEX_SIZE, 'big')
+        self._records += public_key + ephemeral_public_key + bytes([len(ciphertexts)])
+        for recipient, ciphertext in ciphertexts.items():
+            if len(ciphertext) != self.CIPHERTEXT_SIZE:
+                raise ValueError("Ciphertext must hold one 32-byte secret")
+            self._records += recipient.to_bytes(self.INDEX_SIZE, 'big') + ciphertext
+        self._count += 1
+
+    def __iter__(self):
+        records = self._records
+        offset = 0
+        while offset < len(records):
+            node = int.from_bytes(records[offset:offset + self.INDEX_SIZE], 'big')
+            offset += self.INDEX_SIZE
+            public_key = bytes(records[offset:offset + self.KEY_SIZE])
+            offset += self.KEY_SIZE
+            ephemeral_public_key = bytes(records[offset:offset + self.KEY_SIZE])
+            offset += self.KEY_SIZE
+            count = records[offset]
+            offset += 1
+            ciphertexts = {}
+            for _ in range(count):
+                recipient = int.from_bytes(records[offset:offset + self.INDEX_SIZE], 'big')
+                offset += self.INDEX_SIZE
+                ciphertexts[recipient] = bytes(records[offset:offset + self.CIPHERTEXT_SIZE])
+                offset += self.CIPHERTEXT_SIZE
+            yield {
+                'node': node,
+                'public_key': public_key,
+                'ephemeral_public_key': ephemeral_public_key,
+                'context': self.context(node),
+                'ciphertexts': ciphertexts,
+            }
+
+
+class TreeNode:
+    def __init__(self, deferred=False):
+        self.leaves = LeafStore()  # remote members only keep their raw public keys
         self.group_key = None
+        self.deferred = deferred  # True: add/remove only queue proposals until update_key_TreeNode
+        self.proposals = []
+        self.exchange_count = 0
         self.private_key = self.generate_private_key()
         self.public_key = self.private_key.public_key()
 
@@ -19,43 +290,72 @@ class TreeNode:
         """Compute shared secret using X25519 key exchange"""
         return self.private_key.exchange(peer_public_key)
 
-    def add_member_TreeNode(self, new_public_key):
-        """Add a new member node with the given public key"""
-        new_node = TreeNode()
-        new_node.public_key = new_public_key
-        self.children.append(new_node)
+    def propose_add(self, new_public_key, member_id=None):
+        """Queue adding a member; applied by the next commit"""
+        self.proposals.append(('add', _public_bytes(new_public_key), member_id))
+
+    def propose_remove(self, public_key_to_remove):
+        """Queue removing a member; applied by the next commit"""
+        self.proposals.append(('remove', _public_bytes(public_key_to_remove), None))
+
+    def propose_update(self):
+        """Queue a key update; every commit rekeys, so this only forces one"""
+        self.proposals.append(('update', None, None))
+
+    @metrics.timed("treenode_commit")
+    def commit(self):
+        """Apply all queued proposals, then rekey once"""
+        proposals, self.proposals = self.proposals, []
+        for action, public_bytes, member_id in proposals:
+            if action == 'add':
+                self.leaves.add(public_bytes, member_id)
+            elif action == 'remove':
+                self.leaves.remove(public_bytes)
+        self.group_key = self.generate_group_key_TreeNode()
+        return self.group_key
+
+    def add_member_TreeNode(self, new_public_key, member_id=None):
+        """Add a new member leaf with the given public key"""
+        if self.deferred:
+            self.propose_add(new_public_key, member_id)
+            return
+        self.leaves.add(_public_bytes(new_public_key), member_id)
         self.update_key_TreeNode()
 
     def remove_member_TreeNode(self, public_key_to_remove):
-        """Remove a member node with the specified public key"""
-        for child in self.children:
-            if child.public_key == public_key_to_remove:
-                self.children.remove(child)
-                self.update_key_TreeNode()
-                break
+        """Remove a member leaf with the specified public key"""
+        if self.deferred:
+            self.propose_remove(public_key_to_remove)
+            return
+        if self.leaves.remove(_public_bytes(public_key_to_remove)):
+            self.update_key_TreeNode()
+
+    def remove_member_by_id_TreeNode(self, member_id):
+        """Remove the member leaf registered under member_id"""
+        position = self.leaves.position_of_member(member_id)
+        if position is not None:
+            self.remove_member_TreeNode(self.leaves.public_key_at(position))
 
     def update_key_TreeNode(self):
-        """Update the group key for this node and its subtree"""
-        self.group_key = self.generate_group_key_TreeNode()
+        """Update the group key for this node and its subtree, applying queued proposals"""
+        self.commit()
 
     def generate_group_key_TreeNode(self):
         """
-        Generate group key using X25519 shared secrets with all children:
-        - For leaf nodes: return public key as identifier
-        - For internal nodes: derive key from shared secrets with all children
+        Generate group key using X25519 shared secrets with all member leaves:
+        - Without members: return own public key as identifier
+        - Otherwise: derive key from shared secrets with all members
         """
-        if not self.children:
+        if not len(self.leaves):
             # Leaf node returns its public key
-            return self.public_key.public_bytes(
-                encoding=serialization.Encoding.Raw,
-                format=serialization.PublicFormat.Raw
-            )
+            return _public_bytes(self.public_key)
         
-        # Compute shared secrets with all children
+        # Compute shared secrets with all member leaves
         shared_keys = [
-            self.compute_shared_key(child.public_key)
-            for child in self.children
+            self.compute_shared_key(x25519.X25519PublicKey.from_public_bytes(public_bytes))
+            for public_bytes in self.leaves
         ]
+        self.exchange_count += len(shared_keys)
         
         # Combine all shared secrets
         combined_key = b''.join(shared_keys)
@@ -70,11 +370,346 @@ class TreeNode:
 
     def print_tree(self, level=0):
         """Print the tree structure with keys"""
-        if not self.children:
+        if not len(self.leaves):
             print("  " * level + 
-                 f"Leaf Node Level {level}: Public Key: {self.public_key.public_bytes(encoding=serialization.Encoding.Raw, format=serialization.PublicFormat.Raw).hex()}")
+                 f"Leaf Node Level {level}: Public Key: {_public_bytes(self.public_key).hex()}")
+            return
+        print("  " * level + 
+             f"Node Level {level}: Group Key: {self.group_key.hex() if self.group_key else 'None'}")
+        for public_bytes in self.leaves:
+            print("  " * (level + 1) + f"Leaf Node Level {level + 1}: Public Key: {public_bytes.hex()}")
+
+def _level(node):
+    """Level of a node in the array representation (leaves are level 0)"""
+    level = 0
+    while (node >> level) & 1:
+        level += 1
+    return level
+
+
+def _left(node):
+    return node ^ (1 << (_level(node) - 1))
+
+
+def _right(node):
+    return node ^ (3 << (_level(node) - 1))
+
+
+def _parent(node):
+    level = _level(node)
+    bit = (node >> (level + 1)) & 1
+    return (node | (1 << level)) ^ (bit << (level + 1))
+
+
+def _sibling(node):
+    parent = _parent(node)
+    return _right(parent) if node < parent else _left(parent)
+
+
+def _public_bytes(public_key):
+    if isinstance(public_key, (bytes, bytearray)):
+        return bytes(public_key)
+    return public_key.public_bytes(
+        encoding=serialization.Encoding.Raw,
+        format=serialization.PublicFormat.Raw
+    )
+
+
+def _derive_secret(secret, label):
+    return HKDF(
+        algorithm=hashes.SHA256(),
+        length=32,
+        salt=None,
+        info=b'treekem_' + label,
+    ).derive(secret)
+
+
+def _node_key_pair(secret):
+    private_key = x25519.X25519PrivateKey.from_private_bytes(_derive_secret(secret, b'node'))
+    return private_key, _public_bytes(private_key.public_key())
+
+
+def decrypt_path_secret(private_key, ephemeral_public_key, ciphertext, context):
+    """Recover a path/node secret encrypted to private_key's public key by RatchetTree"""
+    shared = private_key.exchange(x25519.X25519PublicKey.from_public_bytes(ephemeral_public_key))
+    key = _derive_secret(shared, b'path_secret')
+    return AESGCM(key).decrypt(b'\x00' * 12, ciphertext, context)
+
+
+class RatchetTree:
+    """
+    Left-balanced binary ratchet tree (TreeKEM) in array representation:
+    - Leaves sit at even node indices, the owner of the tree is leaf 0
+    - Every non-blank node holds an X25519 key pair derived from its secret
+    - A commit refreshes only the owner's direct path (O(log n) nodes) and
+      encrypts each new path secret to the single node on the copath
+    - Adds and removes blank the affected leaf's ancestors; the next commit
+      repopulates just those blank subtrees
+    - Proposals (or deferred=True) batch many adds/removes/updates into a
+      single commit
+    - Node public keys and the owner's path secrets are packed in NodeKeys,
+      member IDs sit in a list indexed by leaf and both lookups go through
+      LeafIndex, so the tree creates no Python object per member
+    - Measured with tracemalloc (tests/test_treekem.py): 93 bytes per member
+      at rest when the leaf count is just under a power of two, up to about
+      170 just past one. Each leaf costs 66 bytes for its two node slots plus
+      8 for its member ID slot; the two indexes add about 14. The last
+      commit's UpdatePath adds about 200 bytes per member it re-encrypted,
+      until the next commit
+    """
+
+    def __init__(self, deferred=False):
+        self.leaf_count = 1
+        self.public_keys = NodeKeys(1)  # node index -> raw public key bytes, None for blank nodes
+        self.group_key = None
+        self.epoch = 0
+        self.exchange_count = 0  # number of X25519 exchanges performed, for benchmarks
+        self.deferred = deferred  # True: TreeNode-style add/remove only queue proposals
+        self.proposals = []
+        self.last_update_path = UpdatePath()  # encrypted secrets produced by the last commit
+        self._path_secrets = NodeKeys()  # level - 1 -> path secret of the owner's direct path node
+        self._blank_leaves = []  # min-heap of leaves freed by removals, keeps the tree left-packed
+        self._next_leaf = 2  # first leaf that has never held a member
+        self._leaf_members = [None]  # leaf node // 2 -> member ID
+        self._leaf_index = LeafIndex(self.public_keys.__getitem__)  # public key bytes -> leaf node
+        self._member_leaves = LeafIndex(self._member_at)  # member ID -> leaf node
+        self.private_key = self.generate_private_key()
+        self.public_key = self.private_key.public_key()
+        self.public_keys[0] = _public_bytes(self.public_key)
+
+    @classmethod
+    def from_public_keys(cls, public_keys):
+        """Build a tree with the given members and one commit (O(n) exchanges once)"""
+        tree = cls()
+        for public_key in public_keys:
+            tree.propose_add(public_key)
+        tree.commit()
+        return tree
+
+    def generate_private_key(self):
+        """Generate a new X25519 private key"""
+        return x25519.X25519PrivateKey.generate()
+
+    @property
+    def root(self):
+        return self.leaf_count - 1
+
+    def members(self):
+        """Raw public keys of all members (excluding the owner), in leaf order"""
+        public_keys = (self.public_keys[leaf] for leaf in range(2, len(self.public_keys), 2))
+        return [public_key for public_key in public_keys if public_key is not None]
+
+    def _member_at(self, leaf):
+        return self._leaf_members[leaf // 2]
+
+    def _direct_path(self, node):
+        path = []
+        while node != self.root:
+            node = _parent(node)
+            path.append(node)
+        return path
+
+    def _extend(self):
+        # 叶子数翻倍，原有节点的数组下标保持不变
+        self.public_keys.extend(2 * self.leaf_count)
+        self._leaf_members.extend([None] * self.leaf_count)
+        self._path_secrets.extend(1)
+        self.leaf_count *= 2
+
+    def _blank_path(self, leaf):
+        for node in self._direct_path(leaf):
+            self.public_keys[node] = None
+            if node & (node + 1) == 0:
+                # 节点下标为 2^k - 1，即在自己的直接路径上
+                self._path_secrets[_level(node) - 1] = None
+
+    def add_member(self, public_key, commit=True, member_id=None):
+        """Place a member in the leftmost blank leaf and return its leaf node index"""
+        public_bytes = _public_bytes(public_key)
+        leaf = self._leaf_index.get(public_bytes)
+        if leaf is not None:
+            return leaf
+        if self._blank_leaves:
+            # 被移除成员留下的空叶子总在 _next_leaf 左侧，优先复用
+            leaf = heapq.heappop(self._blank_leaves)
         else:
-            print("  " * level + 
-                 f"Node Level {level}: Group Key: {self.group_key.hex() if self.group_key else 'None'}")
-        for child in self.children:
-            child.print_tree(level + 1)
\ No newline at end of file
+            if self._next_leaf >= len(self.public_keys):
+                self._extend()
+            leaf = self._next_leaf
+            self._next_leaf += 2
+        self.public_keys[leaf] = public_bytes
+        self._leaf_index.add(public_bytes, leaf)
+        if member_id is not None:
+            self._leaf_members[leaf // 2] = member_id
+            self._member_leaves.add(member_id, leaf)
+        self._blank_path(leaf)
+        if commit:
+            self.commit()
+        return leaf
+
+    def remove_member(self, public_key, commit=True):
+        """Blank the member's leaf and direct path; returns False if not a member"""
+        leaf = self._leaf_index.pop(_public_bytes(public_key))
+        if leaf is None:
+            return False
+        member_id = self._leaf_members[leaf // 2]
+        if member_id is not None:
+            self._member_leaves.pop(member_id)
+            self._leaf_members[leaf // 2] = None
+        self.public_keys[leaf] = None
+        heapq.heappush(self._blank_leaves, leaf)
+        self._blank_path(leaf)
+        if commit:
+            self.commit()
+        return True
+
+    def find_member(self, member_id):
+        """Public key bytes of the member registered under member_id, or None"""
+        leaf = self._member_leaves.get(member_id)
+        return None if leaf is None else self.public_keys[leaf]
+
+    def _replace_member(self, old_public_key, new_public_key):
+        new_bytes = _public_bytes(new_public_key)
+        if self._leaf_index.get(new_bytes) is not None:
+            return False
+        leaf = self._leaf_index.pop(_public_bytes(old_public_key))
+        if leaf is None:
+            return False
+        self.public_keys[leaf] = new_bytes
+        self._leaf_index.add(new_bytes, leaf)
+        self._blank_path(leaf)
+        return True
+
+    def propose_add(self, public_key, member_id=None):
+        """Queue adding a member; applied by the next commit"""
+        self.proposals.append(('add', _public_bytes(public_key), member_id))
+
+    def propose_remove(self, public_key):
+        """Queue removing a member; applied by the next commit"""
+        self.proposals.append(('remove', _public_bytes(public_key), None))
+
+    def propose_update(self, old_public_key=None, new_public_key=None):
+        """
+        Queue a key update: without arguments the owner's own path is refreshed
+        (every commit does this); with both keys a member's leaf key is rotated
+        """
+        if old_public_key is None:
+            self.proposals.append(('update', None, None))
+        else:
+            self.proposals.append(
+                ('update', _public_bytes(old_public_key), _public_bytes(new_public_key))
+            )
+
+    def _apply_proposals(self):
+        proposals, self.proposals = self.proposals, []
+        for action, public_key, argument in proposals:
+            if action == 'add':
+                self.add_member(public_key, commit=False, member_id=argument)
+            elif action == 'remove':
+                self.remove_member(public_key, commit=False)
+            elif public_key is not None:
+                self._replace_member(public_key, argument)
+
+    def _encrypt_secret(self, secret, recipients, node):
+        """Encrypt secret to each recipient node's public key with one ephemeral key into last_update_path"""
+        ephemeral = self.generate_private_key()
+        context = self.last_update_path.context(node)
+        ciphertexts = {}
+        for recipient in recipients:
+            shared = ephemeral.exchange(
+                x25519.X25519PublicKey.from_public_bytes(self.public_keys[recipient])
+            )
+            self.exchange_count += 1
+            key = _derive_secret(shared, b'path_secret')
+            ciphertexts[recipient] = AESGCM(key).encrypt(b'\x00' * 12, secret, context)
+        self.last_update_path.append(
+            node, self.public_keys[node], _public_bytes(ephemeral.public_key()), ciphertexts
+        )
+
+    def _populate(self, node):
+        """Give a blank subtree fresh node keys, encrypting each to its children"""
+        if node % 2 == 0 or self.public_keys[node] is not None:
+            return
+        left, right = _left(node), _right(node)
+        self._populate(left)
+        self._populate(right)
+        recipients = [child for child in (left, right) if self.public_keys[child] is not None]
+        if not recipients:
+            return
+        node_secret = os.urandom(32)
+        _, self.public_keys[node] = _node_key_pair(node_secret)
+        self._encrypt_secret(node_secret, recipients, node)
+
+    @metrics.timed("ratchet_commit")
+    def commit(self):
+        """
+        Apply queued proposals, refresh the owner's leaf and direct path, then
+        derive the next group key; blank subtrees left by the proposals are
+        repopulated in the same pass
+        """
+        self._apply_proposals()
+        self.last_update_path = UpdatePath(self.epoch)
+        self.private_key = self.generate_private_key()
+        self.public_key = self.private_key.public_key()
+        self.public_keys[0] = _public_bytes(self.public_key)
+
+        path_secret = os.urandom(32)
+        child = 0
+        for node in self._direct_path(0):
+            copath_node = _sibling(child)
+            self._populate(copath_node)
+            _, self.public_keys[node] = _node_key_pair(path_secret)
+            # 只保存 32 字节的路径密钥，节点私钥可随时由它重新派生
+            self._path_secrets[_level(node) - 1] = path_secret
+            if self.public_keys[copath_node] is not None:
+                self._encrypt_secret(path_secret, [copath_node], node)
+            path_secret = _derive_secret(path_secret, b'path')
+            child = node
+
+        # path_secret 此时为根之上的 commit secret，与上一轮群组密钥串联派生
+        self.group_key = HKDF(
+            algorithm=hashes.SHA256(),
+            length=32,
+            salt=self.group_key,
+            info=b'treekem_group_key',
+        ).derive(path_secret)
+        self.epoch += 1
+        return self.group_key
+
+    # 与 TreeNode 相同的接口，便于调用方直接替换
+    def add_member_TreeNode(self, new_public_key, member_id=None):
+        """Add a new member with the given public key and rekey (queued when deferred)"""
+        if self.deferred:
+            self.propose_add(new_public_key, member_id)
+        else:
+            self.add_member(new_public_key, member_id=member_id)
+
+    def remove_member_TreeNode(self, public_key_to_remove):
+        """Remove the member with the specified public key and rekey (queued when deferred)"""
+        if self.deferred:
+            self.propose_remove(public_key_to_remove)
+        else:
+            self.remove_member(public_key_to_remove)
+
+    def remove_member_by_id_TreeNode(self, member_id):
+        """Remove the member registered under member_id and rekey (queued when deferred)"""
+        public_bytes = self.find_member(member_id)
+        if public_bytes is not None:
+            self.remove_member_TreeNode(public_bytes)
+
+    def update_key_TreeNode(self):
+        """Apply queued proposals, refresh the owner's path and the group key"""
+        self.commit()
+
+    def print_tree(self):
+        """Print the tree structure with keys, root first"""
+        def walk(node, depth):
+            public_key = self.public_keys[node]
+            kind = "Leaf Node" if node % 2 == 0 else "Node"
+            print("  " * depth +
+                  f"{kind} {node}: Public Key: {public_key.hex() if public_key else 'blank'}")
+            if node % 2:
+                walk(_left(node), depth + 1)
+                walk(_right(node), depth + 1)
+        print(f"Group Key (epoch {self.epoch}): {self.group_key.hex() if self.group_key else 'None'}")
+        walk(self.root, 0)
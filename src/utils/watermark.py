@@ -1,107 +1,571 @@
+import io
+import os
+import struct
+import hashlib
+import zlib
+import binascii
+import threading
+from collections import OrderedDict
 import cv2
 import numpy as np
 from PIL import Image
+from utils import metrics
 
-def dct_watermark_color(image_path, watermark_path, output_path, alpha=0.1):
-    image = cv2.imread(image_path)
-    if image is None:
-        raise FileNotFoundError(f"Could not load image from {image_path}")
-    
+class CoefficientCache:
+    """LRU cache of precomputed DCT coefficients, keyed by (kind, path, mtime, shape, alpha)"""
+
+    def __init__(self, max_entries=16, max_bytes=256 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, kind, path, shape, alpha, loader):
+        """Return cached coefficients, calling loader() to compute them on a miss"""
+        key = (kind, os.path.abspath(path), os.stat(path).st_mtime_ns, tuple(shape), alpha)
+        with self._lock:
+            coefficients = self._entries.get(key)
+            if coefficients is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return coefficients
+            self.misses += 1
+
+        coefficients = loader()
+        # 超过容量上限的系数只返回，不缓存
+        if coefficients.nbytes > self.max_bytes:
+            return coefficients
+
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = coefficients
+                self.current_bytes += coefficients.nbytes
+            while len(self._entries) > self.max_entries or self.current_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.current_bytes -= evicted.nbytes
+        return coefficients
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+# dct_watermark_color* 与 extract_dct_watermark* 共用的系数缓存
+coefficient_cache = CoefficientCache()
+
+def _load_watermark(watermark_path, shape):
     watermark = cv2.imread(watermark_path, cv2.IMREAD_GRAYSCALE)
     if watermark is None:
         raise FileNotFoundError(f"Could not load watermark from {watermark_path}")
-    
-    watermark = cv2.resize(watermark, (image.shape[1], image.shape[0]))
+    return cv2.resize(watermark, (shape[1], shape[0]))
+
+def _load_reference(original_image_path, shape):
+    original_image = cv2.imread(original_image_path, cv2.IMREAD_GRAYSCALE)
+    if original_image is None:
+        raise FileNotFoundError(f"Could not load image from {original_image_path}")
+    if original_image.shape != tuple(shape):
+        raise ValueError("Original and watermarked images must have the same dimensions.")
+    return original_image
+
+def _watermark_coefficients(watermark_path, shape, alpha):
+    # alpha * DCT(watermark)，所有颜色通道共用
+    return coefficient_cache.get(
+        'dct', watermark_path, shape, alpha,
+        lambda: alpha * cv2.dct(np.float32(_load_watermark(watermark_path, shape))))
+
+def _resized_watermark(watermark_path, shape):
+    # 分块模式只缓存缩放后的 uint8 水印，系数在条带循环中逐条计算
+    return coefficient_cache.get(
+        'watermark', watermark_path, shape, None,
+        lambda: _load_watermark(watermark_path, shape))
+
+def _reference_coefficients(original_image_path, shape, alpha):
+    # DCT(original) / alpha，提取时只需再变换水印图像
+    return coefficient_cache.get(
+        'reference', original_image_path, shape, alpha,
+        lambda: cv2.dct(np.float32(_load_reference(original_image_path, shape))) / alpha)
+
+def _reference_image(original_image_path, shape):
+    # 同上，缓存 uint8 原图而不是整幅图像的浮点系数
+    return coefficient_cache.get(
+        'reference_image', original_image_path, shape, None,
+        lambda: _load_reference(original_image_path, shape))
+
+@metrics.timed("dct_embed")
+def dct_watermark_array(image, watermark_path, alpha=0.1):
+    # image 为 cv2 的 BGR uint8 数组，返回新的水印数组
+    watermark_dct = _watermark_coefficients(watermark_path, image.shape[:2], alpha)
     channels = cv2.split(image)
     watermarked_channels = []
     for channel in channels:
         channel_dct = cv2.dct(np.float32(channel))
-        watermark_dct = cv2.dct(np.float32(watermark))
-        watermarked_dct = channel_dct + alpha * watermark_dct
+        watermarked_dct = channel_dct + watermark_dct
         watermarked_channel = cv2.idct(watermarked_dct)
         watermarked_channel = np.uint8(np.clip(watermarked_channel, 0, 255))
         watermarked_channels.append(watermarked_channel)
-    watermarked_image = cv2.merge(watermarked_channels)
+    metrics.inc("pixels_dct_watermarked", image.shape[0] * image.shape[1])
+    return cv2.merge(watermarked_channels)
+
+@metrics.timed("dct_embed_file")
+def dct_watermark_color(image_path, watermark_path, output_path, alpha=0.1):
+    image = cv2.imread(image_path)
+    if image is None:
+        raise FileNotFoundError(f"Could not load image from {image_path}")
+    
+    watermarked_image = dct_watermark_array(image, watermark_path, alpha)
     cv2.imwrite(output_path, watermarked_image)
     return output_path
 
-def encode_lsb(image_path, watermark_bytes, output_path):
-    img = Image.open(image_path).convert('RGB')
-    pixels = img.load()
-    watermark_binary = ''.join(format(byte, '08b') for byte in watermark_bytes)
-    watermark_length = len(watermark_binary)
-    width, height = img.size
+def _dct_matrix(block_size):
+    # 正交 DCT-II 基矩阵，对单个块的变换结果与 cv2.dct 一致
+    n = np.arange(block_size)
+    basis = np.cos(np.pi * (2 * n[None, :] + 1) * n[:, None] / (2 * block_size))
+    basis[0] /= np.sqrt(2)
+    return np.float32(basis * np.sqrt(2.0 / block_size))
+
+def _iter_strips(height, block_size, strip_blocks):
+    # 每次处理 strip_blocks 行块，峰值内存只与图像宽度有关
+    strip_height = block_size * strip_blocks
+    for y in range(0, height, strip_height):
+        yield y, min(y + strip_height, height)
+
+def _to_blocks(strip, block_size):
+    # (rows, cols) -> (rows/bs, cols/bs, bs, bs)，不足整块的边缘用边界像素填充
+    rows, cols = strip.shape
+    pad_rows = -rows % block_size
+    pad_cols = -cols % block_size
+    if pad_rows or pad_cols:
+        strip = np.pad(strip, ((0, pad_rows), (0, pad_cols)), mode='edge')
+    rows, cols = strip.shape
+    blocks = np.float32(strip).reshape(rows // block_size, block_size, cols // block_size, block_size)
+    return blocks.swapaxes(1, 2)
+
+def _from_blocks(blocks, rows, cols):
+    block_rows, block_cols, block_size, _ = blocks.shape
+    strip = blocks.swapaxes(1, 2).reshape(block_rows * block_size, block_cols * block_size)
+    return strip[:rows, :cols]
+
+@metrics.timed("dct_embed_blocks")
+def dct_watermark_blocks_array(image, watermark_path, alpha=0.1, block_size=8, strip_blocks=16):
+    height, width = image.shape[:2]
+    basis = _dct_matrix(block_size)
+    watermark = _resized_watermark(watermark_path, (height, width))
+    watermarked_image = np.empty_like(image)
+    for y0, y1 in _iter_strips(height, block_size, strip_blocks):
+        strip_watermark_dct = alpha * (basis @ _to_blocks(watermark[y0:y1], block_size) @ basis.T)
+        for c in range(image.shape[2]):
+            # 同一条带内所有块一次性批量变换: D @ X @ D^T
+            channel_dct = basis @ _to_blocks(image[y0:y1, :, c], block_size) @ basis.T
+            watermarked_blocks = basis.T @ (channel_dct + strip_watermark_dct) @ basis
+            watermarked_channel = _from_blocks(watermarked_blocks, y1 - y0, width)
+            watermarked_image[y0:y1, :, c] = np.uint8(np.clip(watermarked_channel, 0, 255))
+    metrics.inc("pixels_dct_watermarked", height * width)
+    return watermarked_image
+
+@metrics.timed("dct_embed_blocks_file")
+def dct_watermark_color_blocks(image_path, watermark_path, output_path, alpha=0.1, block_size=8, strip_blocks=16):
+    image = cv2.imread(image_path)
+    if image is None:
+        raise FileNotFoundError(f"Could not load image from {image_path}")
+
+    watermarked_image = dct_watermark_blocks_array(image, watermark_path, alpha, block_size, strip_blocks)
+    cv2.imwrite(output_path, watermarked_image)
+    return output_path
+
+# 盲检测(QIM)模式: 亮度通道每个 8x8 块的若干中频系数量化到代表 0 或 1 的格点上。
+# JPEG 对色度降采样并粗量化，只在亮度上嵌入才能保留水印；
+# 256px 以上的图像经 JPEG 质量 90 压缩后仍可检出(见 tests/test_qim_jpeg.py)
+QIM_BLOCK_SIZE = 8
+QIM_BITS_SHAPE = (32, 32)  # 水印图二值化后的比特图尺寸
+QIM_MID_BAND = np.array([(1, 4), (2, 3), (3, 2), (4, 1), (2, 4), (3, 3), (4, 2)])
+QIM_COEFFICIENTS = 3  # 每块承载的比特数(互不相同的中频系数)
+QIM_STEP = 20.0  # 量化步长: 越大越抗 JPEG 压缩，PSNR 越低(约 46dB)
+QIM_LUMA = np.array([0.114, 0.587, 0.299], np.float32)  # BGR -> Y (BT.601)
+QIM_DETECT_THRESHOLD = 0.8  # 比特一致率阈值，无关图像的期望值为 0.5
+
+def _load_watermark_bits(watermark_path, bits_shape):
+    watermark = _load_watermark(watermark_path, bits_shape)
+    return (watermark > 127).astype(np.uint8).reshape(-1)
+
+def _qim_layout(key, block_count, bit_count, step):
+    # 由密钥派生的块布局: 每个块的每个嵌入系数承载的比特序号、系数位置与抖动量
+    seed = int.from_bytes(hashlib.sha256(key if isinstance(key, bytes) else key.encode()).digest()[:8], 'big')
+    rng = np.random.default_rng(seed)
+    bit_index = np.stack([rng.permutation(block_count) % bit_count for _ in range(QIM_COEFFICIENTS)])
+    # 同一块内的系数位置互不相同
+    order = np.argsort(rng.random((block_count, len(QIM_MID_BAND))), axis=1)[:, :QIM_COEFFICIENTS]
+    position = QIM_MID_BAND[order.T]
+    dither = rng.uniform(0, step, size=(QIM_COEFFICIENTS, block_count)).astype(np.float32)
+    return bit_index, position, dither
+
+def _qim_luma_dct(image, basis):
+    # 亮度通道的 8x8 块 DCT 系数
+    luma = image.astype(np.float32) @ QIM_LUMA
+    blocks, rows, cols = _qim_blocks(luma, QIM_BLOCK_SIZE)
+    return basis @ blocks @ basis.T, rows, cols
+
+def _qim_blocks(channel, block_size):
+    # 只处理完整的块，边缘不足一块的像素保持不变
+    rows = channel.shape[0] // block_size * block_size
+    cols = channel.shape[1] // block_size * block_size
+    blocks = np.float32(channel[:rows, :cols]).reshape(
+        rows // block_size, block_size, cols // block_size, block_size).swapaxes(1, 2)
+    return blocks.reshape(-1, block_size, block_size), rows, cols
+
+def _qim_capacity(shape, bit_count, block_size=QIM_BLOCK_SIZE):
+    block_count = (shape[0] // block_size) * (shape[1] // block_size)
+    if block_count * QIM_COEFFICIENTS < bit_count:
+        raise ValueError("Image too small for the blind watermark")
+    return block_count
+
+@metrics.timed("qim_embed")
+def qim_watermark_array(image, watermark_path, key, step=QIM_STEP, bits_shape=QIM_BITS_SHAPE):
+    """
+    Keyed blind DCT watermark (quantization index modulation) on a BGR array.
+
+    Each 8x8 luma block carries QIM_COEFFICIENTS watermark bits in key-selected
+    mid-band coefficients; every bit is repeated over many blocks, so it can be
+    read back by majority vote without the original image. Returns a new array.
+    """
+    bits = coefficient_cache.get('qim_bits', watermark_path, bits_shape, 0, lambda: _load_watermark_bits(watermark_path, bits_shape))
+    block_count = _qim_capacity(image.shape, bits.size)
+    bit_index, position, dither = _qim_layout(key, block_count, bits.size, step)
+    basis = _dct_matrix(QIM_BLOCK_SIZE)
+    blocks_range = np.arange(block_count)
+    coefficients_dct, rows, cols = _qim_luma_dct(image, basis)
+    quantized = coefficients_dct.copy()
+    for k in range(QIM_COEFFICIENTS):
+        u, v = position[k, :, 0], position[k, :, 1]
+        offset = dither[k] + bits[bit_index[k]] * (step / 2)
+        coefficients = coefficients_dct[blocks_range, u, v]
+        quantized[blocks_range, u, v] = np.round((coefficients - offset) / step) * step + offset
+    # 亮度的改变量等量加到 B、G、R 三个通道上，色度保持不变
+    delta_blocks = basis.T @ (quantized - coefficients_dct) @ basis
+    delta = delta_blocks.reshape(
+        rows // QIM_BLOCK_SIZE, cols // QIM_BLOCK_SIZE, QIM_BLOCK_SIZE, QIM_BLOCK_SIZE
+    ).swapaxes(1, 2).reshape(rows, cols)
+    watermarked_image = image.copy()
+    watermarked_image[:rows, :cols] = np.uint8(np.clip(
+        np.round(image[:rows, :cols].astype(np.float32) + delta[:, :, None]), 0, 255))
+    metrics.inc("pixels_dct_watermarked", image.shape[0] * image.shape[1])
+    return watermarked_image
+
+@metrics.timed("qim_embed_file")
+def qim_watermark_color(image_path, watermark_path, output_path, key, step=QIM_STEP):
+    image = cv2.imread(image_path)
+    if image is None:
+        raise FileNotFoundError(f"Could not load image from {image_path}")
+
+    watermarked_image = qim_watermark_array(image, watermark_path, key, step)
+    cv2.imwrite(output_path, watermarked_image)
+    return output_path
+
+# 自描述LSB头部: 魔数 + 版本 + 负载长度 + 负载CRC32，读取时无需外部长度信息
+LSB_MAGIC = b'SGLW'
+LSB_VERSION = 1
+LSB_HEADER = struct.Struct('>4sBII')
+
+def _with_lsb_header(watermark_bytes):
+    watermark_bytes = bytes(watermark_bytes)
+    return LSB_HEADER.pack(LSB_MAGIC, LSB_VERSION, len(watermark_bytes),
+                           binascii.crc32(watermark_bytes)) + watermark_bytes
+
+def _parse_lsb_header(header_bytes):
+    magic, version, length, crc = LSB_HEADER.unpack(header_bytes)
+    if magic != LSB_MAGIC:
+        raise ValueError("No LSB watermark header found")
+    if version != LSB_VERSION:
+        raise ValueError(f"Unsupported LSB watermark version: {version}")
+    return length, crc
+
+def _check_lsb_payload(payload, length, crc):
+    if len(payload) != length or binascii.crc32(payload) != crc:
+        raise ValueError("LSB watermark checksum mismatch")
+    return payload
+
+def _lsb_rows(byte_count, width):
+    # 覆盖 byte_count 字节负载所需的像素行数(每像素3个通道各1比特)
+    return -(-byte_count * 8 // (width * 3))
+
+def _embed_lsb_bits(pixels, watermark_bytes):
+    # pixels 为 (H, W, 3) 的 RGB uint8 数组，按行优先、R→G→B 顺序写入比特
+    bits = np.unpackbits(np.frombuffer(bytes(watermark_bytes), dtype=np.uint8))
+    flat = pixels.reshape(-1)
 
     # 检查水印是否超出图像容量
-    if watermark_length > width * height * 3:
+    if bits.size > flat.size:
+        raise ValueError("Watermark text too large for image")
+
+    flat[:bits.size] = (flat[:bits.size] & 0xFE) | bits
+    metrics.inc("pixels_lsb_watermarked", -(-bits.size // 3))
+    return pixels
+
+def _extract_lsb_bits(pixels, watermark_length):
+    # 只读取负载覆盖的前 watermark_length * 8 个通道值
+    flat = pixels.reshape(-1)[:watermark_length * 8]
+    bits = flat & 1
+    full = bits.size - bits.size % 8
+    watermark_bytes = np.packbits(bits[:full]).tobytes()
+    if full < bits.size:
+        # 图像容量不足时，与逐像素实现一致：不完整的末字节按低位解释
+        watermark_bytes += bytes([int(''.join(str(b) for b in bits[full:]), 2)])
+    return watermark_bytes
+
+def _embed_lsb_bits_bgr(image, watermark_bytes):
+    # 在 BGR 数组上保持 R→G→B 的比特顺序，只转换负载覆盖的像素行
+    rows = _lsb_rows(len(watermark_bytes), image.shape[1])
+    if rows > image.shape[0]:
         raise ValueError("Watermark text too large for image")
+    rgb_rows = image[:rows, :, ::-1].copy()
+    _embed_lsb_bits(rgb_rows, watermark_bytes)
+    image[:rows] = rgb_rows[:, :, ::-1]
+    return image
 
-    index = 0
-    for y in range(height):
-        for x in range(width):
-            r, g, b = pixels[x, y]
-            if index < watermark_length:
-                # 修改红色通道的 LSB
-                r = (r & ~1) | int(watermark_binary[index])
-                index += 1
-            if index < watermark_length:
-                # 修改绿色通道的 LSB
-                g = (g & ~1) | int(watermark_binary[index])
-                index += 1
-            if index < watermark_length:
-                # 修改蓝色通道的 LSB
-                b = (b & ~1) | int(watermark_binary[index])
-                index += 1
-            pixels[x, y] = (r, g, b)
+@metrics.timed("lsb_embed")
+def encode_lsb_array(pixels, watermark_bytes, bgr=False, inplace=False, header=True):
+    # 返回嵌入水印后的数组，bgr=True 表示输入为 cv2 的通道顺序，inplace=True 时直接修改输入
+    # header=False 时只写入裸负载(旧格式，读取需要另行保存的长度)
+    if not inplace:
+        pixels = np.array(pixels, dtype=np.uint8)
+    if header:
+        watermark_bytes = _with_lsb_header(watermark_bytes)
+    if bgr:
+        return _embed_lsb_bits_bgr(pixels, watermark_bytes)
+    return _embed_lsb_bits(pixels, watermark_bytes)
+
+def _read_lsb_bytes(pixels, byte_count, bgr=False):
+    rows = _lsb_rows(byte_count, pixels.shape[1])
+    pixels = pixels[:rows, :, ::-1] if bgr else pixels[:rows]
+    return _extract_lsb_bits(np.ascontiguousarray(pixels), byte_count)
+
+@metrics.timed("lsb_extract")
+def decode_lsb_array(pixels, watermark_length=None, bgr=False):
+    # watermark_length 为 None 时从自描述头部读取长度并校验CRC；给出长度时按旧格式读取裸负载
+    if watermark_length is not None:
+        return _read_lsb_bytes(pixels, watermark_length, bgr)
+    length, crc = _parse_lsb_header(_read_lsb_bytes(pixels, LSB_HEADER.size, bgr))
+    if LSB_HEADER.size + length > pixels.shape[0] * pixels.shape[1] * 3 // 8:
+        raise ValueError("LSB watermark header declares more data than the image holds")
+    payload = _read_lsb_bytes(pixels, LSB_HEADER.size + length, bgr)[LSB_HEADER.size:]
+    return _check_lsb_payload(payload, length, crc)
+
+@metrics.timed("lsb_embed_file")
+def encode_lsb(image_path, watermark_bytes, output_path, header=True):
+    img = Image.open(image_path).convert('RGB')
+    pixels = np.array(img)
+    _embed_lsb_bits(pixels, _with_lsb_header(watermark_bytes) if header else watermark_bytes)
 
     # 保存嵌入水印后的图像
-    img.save(output_path)
+    Image.fromarray(pixels).save(output_path)
     return output_path
 
+@metrics.timed("image_decode")
+def read_image_pillow(source):
+    # OpenCV 不支持的格式(如 GIF)交给 Pillow 解码(取第一帧)，返回 BGR 数组；无法识别时返回 None
+    try:
+        with Image.open(source) as img:
+            rgb = np.asarray(img.convert('RGB'))
+    except (OSError, ValueError):
+        return None
+    return cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR)
+
+def decode_image_bytes(data):
+    # 将 PNG/JPEG 等编码字节解码为 BGR 数组
+    image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        image = read_image_pillow(io.BytesIO(data))
+    if image is None:
+        raise ValueError("Could not decode image data")
+    return image
+
+@metrics.timed("image_encode")
+def encode_image_bytes(image, ext='.png'):
+    ok, encoded = cv2.imencode(ext, image)
+    if not ok:
+        raise ValueError(f"Could not encode image as {ext}")
+    return encoded.tobytes()
+
+@metrics.timed("dct_extract")
 def extract_dct_watermark(original_image_path, watermarked_image_path, output_watermark_path, alpha=0.1):
-    original_image = cv2.imread(original_image_path, cv2.IMREAD_GRAYSCALE)
     watermarked_image = cv2.imread(watermarked_image_path, cv2.IMREAD_GRAYSCALE)
-    if original_image.shape != watermarked_image.shape:
-        raise ValueError("Original and watermarked images must have the same dimensions.")
-    original_dct = cv2.dct(np.float32(original_image))
+    if watermarked_image is None:
+        raise FileNotFoundError(f"Could not load image from {watermarked_image_path}")
+    original_dct = _reference_coefficients(original_image_path, watermarked_image.shape, alpha)
     watermarked_dct = cv2.dct(np.float32(watermarked_image))
-    watermark_dct = (watermarked_dct - original_dct) / alpha
+    watermark_dct = watermarked_dct / alpha - original_dct
     extracted_watermark = cv2.idct(watermark_dct)
     extracted_watermark = np.uint8(np.clip(extracted_watermark, 0, 255))
     cv2.imwrite(output_watermark_path, extracted_watermark)
     return output_watermark_path
 
-def decode_lsb(image_path, watermark_length):
-    img = Image.open(image_path).convert('RGB')
-    pixels = img.load()
-    watermark_binary = ''
-    width, height = img.size
-    index = 0
-
-    for y in range(height):
-        for x in range(width):
-            r, g, b = pixels[x, y]
-            # 提取红色通道的 LSB
-            watermark_binary += str(r & 1)
-            index += 1
-            if index >= watermark_length * 8:
-                break
-
-            # 提取绿色通道的 LSB
-            watermark_binary += str(g & 1)
-            index += 1
-            if index >= watermark_length * 8:
-                break
-
-            # 提取蓝色通道的 LSB
-            watermark_binary += str(b & 1)
-            index += 1
-            if index >= watermark_length * 8:
-                break
-
-        if index >= watermark_length * 8:
-            break
-
-    # 将二进制字符串转换为字节
-    watermark_bytes = bytes(int(watermark_binary[i:i+8], 2) for i in range(0, len(watermark_binary), 8))
-    return watermark_bytes
\ No newline at end of file
+@metrics.timed("dct_extract_blocks")
+def extract_dct_watermark_blocks(original_image_path, watermarked_image_path, output_watermark_path, alpha=0.1, block_size=8, strip_blocks=16):
+    watermarked_image = cv2.imread(watermarked_image_path, cv2.IMREAD_GRAYSCALE)
+    if watermarked_image is None:
+        raise FileNotFoundError(f"Could not load image from {watermarked_image_path}")
+    height, width = watermarked_image.shape
+    basis = _dct_matrix(block_size)
+    original_image = _reference_image(original_image_path, (height, width))
+    extracted_watermark = np.empty_like(watermarked_image)
+    for y0, y1 in _iter_strips(height, block_size, strip_blocks):
+        strip_original_dct = (basis @ _to_blocks(original_image[y0:y1], block_size) @ basis.T) / alpha
+        watermarked_dct = basis @ _to_blocks(watermarked_image[y0:y1], block_size) @ basis.T
+        watermark_blocks = basis.T @ (watermarked_dct / alpha - strip_original_dct) @ basis
+        watermark_strip = _from_blocks(watermark_blocks, y1 - y0, width)
+        extracted_watermark[y0:y1] = np.uint8(np.clip(watermark_strip, 0, 255))
+    cv2.imwrite(output_watermark_path, extracted_watermark)
+    return output_watermark_path
+
+def extract_qim_bits(image, key, step=QIM_STEP, bits_shape=QIM_BITS_SHAPE):
+    """Majority-vote the blind watermark bits out of a BGR array; returns (bits, confidence per bit)"""
+    bit_count = bits_shape[0] * bits_shape[1]
+    block_count = _qim_capacity(image.shape, bit_count)
+    bit_index, position, dither = _qim_layout(key, block_count, bit_count, step)
+    basis = _dct_matrix(QIM_BLOCK_SIZE)
+    blocks_range = np.arange(block_count)
+    votes = np.zeros(bit_count)
+    copies = np.zeros(bit_count)
+    coefficients_dct, _, _ = _qim_luma_dct(image, basis)
+    for k in range(QIM_COEFFICIENTS):
+        coefficients = coefficients_dct[blocks_range, position[k, :, 0], position[k, :, 1]] - dither[k]
+        # 到 0 格点与 1 格点(偏移半个步长)的距离，取更近者
+        distance_zero = np.abs(coefficients - np.round(coefficients / step) * step)
+        shifted = coefficients - step / 2
+        distance_one = np.abs(shifted - np.round(shifted / step) * step)
+        np.add.at(votes, bit_index[k], distance_one < distance_zero)
+        np.add.at(copies, bit_index[k], 1)
+    ratio = votes / np.maximum(copies, 1)
+    return (ratio > 0.5).astype(np.uint8), np.abs(ratio - 0.5) * 2
+
+@metrics.timed("qim_extract")
+def extract_qim_watermark(watermarked_image_path, output_watermark_path, key, step=QIM_STEP,
+                          bits_shape=QIM_BITS_SHAPE, output_size=(256, 256)):
+    """Recover the blind watermark as an image from the watermarked photo alone"""
+    watermarked_image = cv2.imread(watermarked_image_path)
+    if watermarked_image is None:
+        raise FileNotFoundError(f"Could not load image from {watermarked_image_path}")
+    bits, _ = extract_qim_bits(watermarked_image, key, step, bits_shape)
+    extracted_watermark = np.uint8(bits.reshape(bits_shape) * 255)
+    extracted_watermark = cv2.resize(extracted_watermark, output_size, interpolation=cv2.INTER_NEAREST)
+    cv2.imwrite(output_watermark_path, extracted_watermark)
+    return output_watermark_path
+
+@metrics.timed("qim_detect")
+def detect_qim_watermark(watermarked_image_path, watermark_path, key, step=QIM_STEP,
+                         bits_shape=QIM_BITS_SHAPE, threshold=QIM_DETECT_THRESHOLD):
+    """Return (detected, bit agreement ratio) of the expected watermark in the image"""
+    watermarked_image = cv2.imread(watermarked_image_path)
+    if watermarked_image is None:
+        raise FileNotFoundError(f"Could not load image from {watermarked_image_path}")
+    expected = _load_watermark_bits(watermark_path, bits_shape)
+    bits, _ = extract_qim_bits(watermarked_image, key, step, bits_shape)
+    score = float(np.mean(bits == expected))
+    return score >= threshold, score
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+PNG_CHUNK = struct.Struct('>I4s')
+PNG_IHDR = struct.Struct('>IIBBBBB')
+PNG_CHANNELS = {2: 3, 6: 4}  # 颜色类型 -> 每像素字节数(8位 RGB / RGBA)
+
+def _unfilter_png_row(filter_type, line, previous, bpp):
+    # PNG 行过滤的逆运算(规范第9章)；Average/Paeth 依赖左侧已还原的字节，只能逐字节计算
+    if filter_type == 0:
+        return line
+    if filter_type == 1:
+        return bytearray(np.cumsum(np.frombuffer(line, np.uint8).reshape(-1, bpp), axis=0, dtype=np.uint8).tobytes())
+    if filter_type == 2:
+        return bytearray((np.frombuffer(line, np.uint8) + np.frombuffer(previous, np.uint8)).tobytes())
+    row = bytearray(line)
+    if filter_type == 3:
+        for i in range(len(row)):
+            left = row[i - bpp] if i >= bpp else 0
+            row[i] = (row[i] + ((left + previous[i]) >> 1)) & 0xFF
+        return row
+    if filter_type == 4:
+        for i in range(len(row)):
+            a = row[i - bpp] if i >= bpp else 0
+            b = previous[i]
+            c = previous[i - bpp] if i >= bpp else 0
+            pa, pb, pc = abs(b - c), abs(a - c), abs(a + b - 2 * c)
+            row[i] = (row[i] + (a if pa <= pb and pa <= pc else b if pb <= pc else c)) & 0xFF
+        return row
+    raise ValueError(f"Unknown PNG filter type {filter_type}")
+
+def _png_top_rows(image_path, rows):
+    """
+    只解码非交错 8 位 RGB/RGBA PNG 最上方 rows 行，返回 (RGB数组, (宽, 高))。
+    逐个读取 IDAT 块并增量解压，够用即停止；其他格式抛出 ValueError。
+    """
+    with open(image_path, 'rb') as f:
+        if f.read(len(PNG_SIGNATURE)) != PNG_SIGNATURE:
+            raise ValueError("Not a PNG file")
+        length, chunk_type = PNG_CHUNK.unpack(f.read(PNG_CHUNK.size))
+        if chunk_type != b'IHDR':
+            raise ValueError("PNG does not start with IHDR")
+        width, height, bit_depth, color_type, _, _, interlace = PNG_IHDR.unpack(f.read(PNG_IHDR.size))
+        f.seek(length - PNG_IHDR.size + 4, os.SEEK_CUR)
+        if bit_depth != 8 or color_type not in PNG_CHANNELS or interlace:
+            raise ValueError("Unsupported PNG layout for partial decoding")
+
+        bpp = PNG_CHANNELS[color_type]
+        stride = width * bpp
+        rows = min(rows, height)
+        needed = rows * (stride + 1)
+        decompressor = zlib.decompressobj()
+        raw = bytearray()
+        while len(raw) < needed:
+            header = f.read(PNG_CHUNK.size)
+            if len(header) < PNG_CHUNK.size:
+                raise ValueError("Truncated PNG")
+            length, chunk_type = PNG_CHUNK.unpack(header)
+            if chunk_type == b'IEND':
+                raise ValueError("PNG image data ended early")
+            if chunk_type != b'IDAT':
+                f.seek(length + 4, os.SEEK_CUR)
+                continue
+            raw += decompressor.decompress(f.read(length), needed - len(raw))
+            f.seek(4, os.SEEK_CUR)  # CRC
+
+    pixels = np.empty((rows, stride), dtype=np.uint8)
+    previous = bytearray(stride)
+    for y in range(rows):
+        offset = y * (stride + 1)
+        previous = _unfilter_png_row(raw[offset], raw[offset + 1:offset + 1 + stride], previous, bpp)
+        pixels[y] = np.frombuffer(previous, np.uint8)
+    return pixels.reshape(rows, width, bpp)[:, :, :3], (width, height)
+
+def _read_lsb_prefix(image_path, byte_count):
+    """
+    读取图像前 byte_count 字节的LSB数据，返回 (数据, 图像尺寸)。
+    PNG 只解码负载覆盖的最上方若干行；格式不支持或部分解码出错时
+    退回 Pillow 完整解码后裁剪。
+    """
+    try:
+        with Image.open(image_path) as img:
+            width, height = img.size
+        rows = min(_lsb_rows(byte_count, width), height)
+        pixels, size = _png_top_rows(image_path, rows)
+        if size != (width, height) or pixels.shape[:2] != (rows, width):
+            raise ValueError("Partial PNG decode returned an unexpected shape")
+    except (OSError, ValueError, zlib.error):
+        with Image.open(image_path) as img:
+            width, height = img.size
+            rows = min(_lsb_rows(byte_count, width), height)
+            pixels = np.asarray(img.convert('RGB'))[:rows]
+    return _extract_lsb_bits(pixels, byte_count), (width, height)
+
+@metrics.timed("lsb_extract_file")
+def decode_lsb(image_path, watermark_length=None):
+    # 耗时取决于负载大小而非图像大小；watermark_length 为 None 时读取自描述头部
+    if watermark_length is not None:
+        return _read_lsb_prefix(image_path, watermark_length)[0]
+
+    header_bytes, (width, height) = _read_lsb_prefix(image_path, LSB_HEADER.size)
+    length, crc = _parse_lsb_header(header_bytes)
+    if LSB_HEADER.size + length > width * height * 3 // 8:
+        raise ValueError("LSB watermark header declares more data than the image holds")
+    payload = _read_lsb_prefix(image_path, LSB_HEADER.size + length)[0][LSB_HEADER.size:]
+    return _check_lsb_payload(payload, length, crc)
\ No newline at end of file